@@ -0,0 +1,189 @@
+# End-to-end load test of /charts/history against a local Postgres, with IB
+# replaced by ib.simulator. Run from app/ with the app environment plus
+#
+#   IB_SIMULATOR=1 POSTGRES_HOST=localhost PYTHONPATH=src \
+#   python benchmarks/load_test.py [--save-baseline]
+#
+# Results are compared with benchmarks/baseline.json, saved by --save-baseline
+import argparse
+import asyncio
+import json
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import numpy as np
+import pytz
+from prometheus_client import REGISTRY
+
+from config import settings, db
+import main
+
+_BASELINE_PATH = Path(__file__).with_name('baseline.json')
+_HISTORY_URL = f'{settings.API_URL_PREFIX}/charts/history'
+
+
+async def run_cold(client: httpx.AsyncClient, run_id: str, count: int) -> list:
+    # Every request is for an instrument nothing is cached for
+    return [
+        _history_params(f'NASDAQ:C{run_id}{i}', days_ago=5, days=5)
+        for i in range(count)
+    ]
+
+
+async def run_warm(client: httpx.AsyncClient, run_id: str, count: int) -> list:
+    params = _history_params(f'NASDAQ:W{run_id}', days_ago=5, days=5)
+    await _request(client, params)
+
+    return [params] * count
+
+
+async def run_partial(client: httpx.AsyncClient, run_id: str, count: int) -> list:
+    # Each window reaches a day further back than the cached ones
+    await _request(client, _history_params(f'NASDAQ:P{run_id}', days_ago=5, days=5))
+
+    return [
+        _history_params(f'NASDAQ:P{run_id}', days_ago=5, days=5 + i + 1)
+        for i in range(count)
+    ]
+
+
+async def run_concurrent(client: httpx.AsyncClient, run_id: str, count: int) -> list:
+    # Mix of cached and new instruments, requested all at once
+    tickers = [f'NASDAQ:M{run_id}{i}' for i in range(max(count // 10, 1))]
+    for ticker in tickers[: len(tickers) // 2]:
+        await _request(client, _history_params(ticker, days_ago=5, days=5))
+
+    return [
+        _history_params(random.choice(tickers), days_ago=5, days=random.randint(1, 5))
+        for _ in range(count)
+    ]
+
+
+_SCENARIOS = {
+    'cold': (run_cold, 1),
+    'warm': (run_warm, 1),
+    'partial_overlap': (run_partial, 1),
+    'concurrent': (run_concurrent, 50),
+}
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, name: str, run_id: str, count: int
+) -> dict:
+    prepare, concurrency = _SCENARIOS[name]
+    requests = await prepare(client, run_id, count)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed_request(params: dict) -> None:
+        async with semaphore:
+            started_at = time.perf_counter()
+            await _request(client, params)
+            latencies.append(time.perf_counter() - started_at)
+
+    ib_calls = _get_ib_calls()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(timed_request(params) for params in requests))
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'requests_per_second': len(requests) / elapsed,
+        'ib_calls_per_request': (_get_ib_calls() - ib_calls) / len(requests),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    is_ok = True
+
+    for name, result in results.items():
+        for key, value in result.items():
+            base_value = baseline.get(name, {}).get(key)
+            if not base_value:
+                continue
+
+            # Latencies and IB calls regress upwards, throughput downwards
+            change = value / base_value - 1
+            is_regression = (
+                change < -tolerance
+                if key == 'requests_per_second'
+                else change > tolerance
+            )
+            is_ok = is_ok and not is_regression
+
+            print(
+                f'{name:16} {key:22} {value:10.2f} {base_value:10.2f} '
+                f'{change:+8.1%}{"  REGRESSION" if is_regression else ""}'
+            )
+
+    return is_ok
+
+
+async def run(args: argparse.Namespace) -> bool:
+    await db.init_db()
+    run_id = ''.join(random.choices(string.ascii_uppercase, k=6))
+    results = {}
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url='http://benchmark', timeout=None
+    ) as client:
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, name, run_id, args.requests)
+            print(name, json.dumps(results[name]))
+
+    if args.save_baseline:
+        _BASELINE_PATH.write_text(json.dumps(results, indent=2) + '\n')
+        return True
+
+    if not _BASELINE_PATH.exists():
+        print(f'No baseline at {_BASELINE_PATH}, run with --save-baseline')
+        return True
+
+    return compare(results, json.loads(_BASELINE_PATH.read_text()), args.tolerance)
+
+
+def _history_params(ticker: str, days_ago: int, days: int) -> dict:
+    end = datetime.now(pytz.utc) - timedelta(days=days_ago)
+    start = end - timedelta(days=days)
+
+    return {
+        'symbol': ticker,
+        'resolution': '5',
+        'from': int(start.timestamp()),
+        'to': int(end.timestamp()),
+    }
+
+
+async def _request(client: httpx.AsyncClient, params: dict) -> None:
+    response = await client.get(_HISTORY_URL, params=params)
+    response.raise_for_status()
+
+
+def _get_ib_calls() -> float:
+    return sum(
+        sample.value
+        for metric in REGISTRY.collect()
+        if metric.name == 'mdc_ib_requests'
+        for sample in metric.samples
+        if sample.name == 'mdc_ib_requests_total'
+    )
+
+
+if __name__ == '__main__':
+    if not settings.IB_SIMULATOR:
+        sys.exit('Set IB_SIMULATOR=1, the load test must not reach IB Gateway')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', default=list(_SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true')
+
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
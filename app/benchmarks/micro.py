@@ -0,0 +1,237 @@
+# Micro-benchmarks of the pure functions on the history and ingest paths.
+# Run from app/ with the app environment
+#
+#   PYTHONPATH=src python benchmarks/micro.py [--sizes 100 10000 1000000]
+#
+# Every run is appended to benchmarks/micro_history.jsonl, and timings slower
+# than the median of recent runs by more than the tolerance are flagged
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pytz
+
+from bars.models import Timeframe
+from bars.services import bar_interval_logic
+from common import utils
+from common.interval_index import IntervalIndex
+from common.schemas import Interval
+from ib import utils as ib_utils
+from indicators.models import IndicatorType
+from indicators.services import indicator_calc_logic
+
+_HISTORY_PATH = Path(__file__).with_name('micro_history.jsonl')
+_START = datetime(2020, 1, 1, tzinfo=pytz.utc)
+_STEP = timedelta(minutes=1)
+
+
+def bench_calculate_missing_intervals(size: int) -> Callable[[], object]:
+    # Saved fragments with one bar gaps, within a calendar of daily sessions
+    existing_intervals = IntervalIndex(
+        Interval(start=_START + 3 * i * _STEP, end=_START + (3 * i + 1) * _STEP)
+        for i in range(size)
+    )
+    trading_calendar = IntervalIndex(
+        Interval(
+            start=_START + timedelta(days=i, hours=13),
+            end=_START + timedelta(days=i, hours=20),
+        )
+        for i in range(size // 1440 * 3 + 1)
+    )
+    within = Interval(start=_START, end=_START + 3 * size * _STEP)
+
+    return lambda: bar_interval_logic.calculate_missing_intervals(
+        within, existing_intervals, trading_calendar
+    )
+
+
+def bench_split_intervals(size: int) -> Callable[[], object]:
+    intervals = [Interval(start=_START, end=_START + size * _STEP)]
+
+    return lambda: bar_interval_logic.split_intervals(intervals, Timeframe.M1, 100)
+
+
+def bench_interval_index_merge(size: int) -> Callable[[], object]:
+    # Same merging of adjacent fragments perform_defragmentation does in the
+    # database, on fragments arriving out of order
+    fragments = [
+        Interval(start=_START + i * _STEP, end=_START + i * _STEP)
+        for i in range(size)
+    ]
+    random.Random(0).shuffle(fragments)
+
+    return lambda: IntervalIndex(fragments, gap=_STEP)
+
+
+def bench_round_with_quantum(size: int) -> Callable[[], object]:
+    prices = _get_prices(size)
+    quantum = Decimal('0.01')
+
+    return lambda: [utils.round_with_quantum(price, quantum) for price in prices]
+
+
+def bench_encode_price(size: int) -> Callable[[], object]:
+    prices = _get_prices(size)
+    tick_size = Decimal('0.25')
+
+    return lambda: [utils.encode_price(price, tick_size) for price in prices]
+
+
+def bench_decode_prices(size: int) -> Callable[[], object]:
+    stored_prices = np.array(_get_prices(size), dtype=np.float64).reshape(-1, 1)
+
+    return lambda: utils.decode_prices(stored_prices, Decimal('0.01'))
+
+
+def bench_atr_incremental(size: int) -> Callable[[], object]:
+    bars = [
+        indicator_calc_logic.CalcBar(
+            high=float(price) + 1, low=float(price) - 1, close=float(price), volume=1
+        )
+        for price in _get_prices(size)
+    ]
+
+    def calculate():
+        state = {}
+        for bar in bars:
+            indicator_calc_logic.update_state(IndicatorType.ATR, 14, state, bar)
+
+    return calculate
+
+
+def bench_atr_vectorized(size: int) -> Callable[[], object]:
+    # Latest ATR of many bar sets with 250 bars each, as screening does
+    closes = np.array(_get_prices(max(size // 250, 1) * 250), dtype=np.float64)
+    closes = closes.reshape(-1, 250)
+    volumes = np.ones_like(closes)
+
+    return lambda: indicator_calc_logic.calculate_latest(
+        IndicatorType.ATR, 14, closes + 1, closes - 1, closes, volumes
+    )
+
+
+def bench_duration_to_ib(size: int) -> Callable[[], object]:
+    ends = [_START + i * _STEP * 37 for i in range(size)]
+
+    return lambda: [ib_utils.duration_to_ib(_START, end) for end in ends]
+
+
+def bench_get_trading_intervals(size: int) -> Callable[[], object]:
+    days = [(_START + timedelta(days=i)).strftime('%Y%m%d') for i in range(size)]
+    trading_hours = ';'.join(f'{day}:0930-{day}:1600' for day in days)
+
+    return lambda: ib_utils.get_trading_intervals(trading_hours, 'US/Eastern')
+
+
+_BENCHMARKS = {
+    name.removeprefix('bench_'): function
+    for name, function in list(globals().items())
+    if name.startswith('bench_')
+}
+# Sizes past these are unrealistic, e.g. a calendar is a few hundred sessions
+_MAX_SIZES = {'get_trading_intervals': 10000}
+
+
+def run(sizes: list[int], names: list[str], repeat: int) -> dict:
+    results = {}
+
+    for name in names:
+        results[name] = {}
+
+        for size in sizes:
+            if size > _MAX_SIZES.get(name, size):
+                continue
+
+            function = _BENCHMARKS[name](size)
+            # Best of the repeats is the least disturbed by other processes
+            seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+            results[name][str(size)] = seconds
+
+            print(f'{name:28} {size:>9} {seconds * 1000:12.3f} ms')
+
+    return results
+
+
+def find_regressions(results: dict, history: list[dict], tolerance: float) -> list:
+    regressions = []
+
+    for name, timings in results.items():
+        for size, seconds in timings.items():
+            previous = [
+                entry['results'][name][size]
+                for entry in history
+                if size in entry['results'].get(name, {})
+            ]
+            if not previous:
+                continue
+
+            reference = statistics.median(previous)
+            if seconds > reference * (1 + tolerance):
+                regressions.append((name, size, seconds, reference))
+
+    return regressions
+
+
+def _get_prices(size: int) -> list[Decimal]:
+    rng = random.Random(0)
+
+    return [Decimal(f'{100 + rng.uniform(-10, 10):.4f}') for _ in range(size)]
+
+
+def _get_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmarks', nargs='+', default=list(_BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 10000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--history', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--no-record', action='store_true')
+    args = parser.parse_args()
+
+    history = []
+    if _HISTORY_PATH.exists():
+        history = [
+            json.loads(line) for line in _HISTORY_PATH.read_text().splitlines()
+        ]
+
+    results = run(args.sizes, args.benchmarks, args.repeat)
+    regressions = find_regressions(results, history[-args.history :], args.tolerance)
+
+    for name, size, seconds, reference in regressions:
+        print(
+            f'REGRESSION {name} {size}: {seconds * 1000:.3f} ms, '
+            f'median of recent runs {reference * 1000:.3f} ms'
+        )
+
+    if not args.no_record:
+        entry = {
+            'timestamp': datetime.now(pytz.utc).isoformat(),
+            'commit': _get_commit(),
+            'results': results,
+        }
+        with _HISTORY_PATH.open('a') as history_file:
+            history_file.write(json.dumps(entry) + '\n')
+
+    sys.exit(1 if regressions else 0)
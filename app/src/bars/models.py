@@ -1,12 +1,21 @@
 from common.models import DBModel
 from sqlmodel import Field, Column, Enum, DateTime, ForeignKey, Relationship
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import (
+    UniqueConstraint,
+    PrimaryKeyConstraint,
+    Index,
+    BigInteger,
+    Numeric,
+)
 from instruments.models import Instrument
+from config import settings
 from uuid import UUID
 from decimal import Decimal
 from datetime import datetime
 import enum
 
+_PRICE_TYPE = BigInteger if settings.BAR_PRICES_IN_TICKS else Numeric
+
 
 class Timeframe(enum.Enum):
     M1 = '1'
@@ -27,6 +36,19 @@ class BarSet(DBModel, table=True):
     )
     instrument: Instrument = Relationship()
     timeframe: Timeframe = Field(sa_column=Column(Enum(Timeframe)))
+    # Coverage of saved bars, maintained on every ingest
+    earliest_timestamp: datetime | None = Field(
+        sa_column=Column(DateTime(timezone=True))
+    )
+    latest_timestamp: datetime | None = Field(
+        sa_column=Column(DateTime(timezone=True))
+    )
+    bar_count: int = Field(
+        default=0, sa_column=Column(BigInteger, nullable=False, server_default='0')
+    )
+    synced_at: datetime | None = Field(sa_column=Column(DateTime(timezone=True)))
+
+    __table_args__ = (UniqueConstraint('instrument_id', 'timeframe'),)
 
 
 class Bar(DBModel, table=True):
@@ -34,16 +56,24 @@ class Bar(DBModel, table=True):
         sa_column=Column(ForeignKey('barset.id', ondelete='CASCADE'), nullable=False)
     )
     bar_set: BarSet = Relationship()
-    open: Decimal
-    high: Decimal
-    low: Decimal
-    close: Decimal
+    open: Decimal | int = Field(sa_column=Column(_PRICE_TYPE, nullable=False))
+    high: Decimal | int = Field(sa_column=Column(_PRICE_TYPE, nullable=False))
+    low: Decimal | int = Field(sa_column=Column(_PRICE_TYPE, nullable=False))
+    close: Decimal | int = Field(sa_column=Column(_PRICE_TYPE, nullable=False))
     volume: int
     timestamp: datetime = Field(
-        sa_column=Column(DateTime(timezone=True), nullable=False)
+        sa_column=Column(DateTime(timezone=True), primary_key=True)
     )
 
-    __table_args__ = (UniqueConstraint('bar_set_id', 'timestamp'),)
+    # Partitioned by year, see config.db.create_bar_partitions. Keys of a
+    # partitioned table have to include the timestamp. Range scans of a bar
+    # set use the unique index, scans over all bar sets the BRIN one
+    __table_args__ = (
+        PrimaryKeyConstraint('id', 'timestamp'),
+        UniqueConstraint('bar_set_id', 'timestamp'),
+        Index('ix_bar_timestamp', 'timestamp', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
 
 
 class BarInterval(DBModel, table=True):
@@ -53,3 +83,7 @@ class BarInterval(DBModel, table=True):
     bar_set: BarSet = Relationship()
     start: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
     end: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
+    # Set for intervals verified to have no bars, which are rechecked once expired
+    expires_at: datetime | None = Field(sa_column=Column(DateTime(timezone=True)))
+
+    __table_args__ = (Index('ix_barinterval_bar_set_id_start', 'bar_set_id', 'start'),)
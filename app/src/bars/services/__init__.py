@@ -2,5 +2,8 @@ from .bar_logic import *
 from .bar_crud import *
 from .bar_interval_logic import *
 from .bar_interval_crud import *
+from .bar_prefetch_logic import *
+from .bar_resample_logic import *
 from .bar_set_logic import *
 from .bar_set_crud import *
+from .bar_stream_logic import *
@@ -1,45 +1,389 @@
-from bars.models import BarSet, Bar, BarInterval
+from bars.models import BarSet, Bar
 from common.schemas import Interval
-from config.db import DB
+from common.cache import LRUCache
+from common import metrics
+from config.db import DB, create_bar_partitions, is_migrating_bars
+from config import settings
+from sqlalchemy import func
 from sqlalchemy.future import select
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.sql import func
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import column, exists, table, text, true, union_all
 from datetime import datetime
+from typing import Awaitable, Callable
+from uuid import UUID
+from loguru import logger
+import itertools
+import numpy as np
 import pytz
+import time
 from . import bar_interval_logic
 
+# Rough in-memory footprint of a loaded Bar, including ORM instance state
+_BAR_SIZE_ESTIMATE = 1024
+
+_STAGING_TABLE = 'bar_staging'
+_COPY_COLUMNS = [
+    'id',
+    'bar_set_id',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'timestamp',
+]
+
+# Called with every saved batch of bars once it's committed
+_ingest_listeners: list[Callable[[DB, BarSet, list[Bar]], Awaitable[None]]] = []
+
+# Table used before partitioning, read along while its bars are being moved
+_UNPARTITIONED_BAR_TABLE = table(
+    'bar_unpartitioned',
+    *(column(bar_column.name, bar_column.type) for bar_column in Bar.__table__.c),
+)
+
+# Years of bar partitions known to exist
+_bar_partitions: set[int] = set()
+
+# Coverage of bar sets keyed by bar set id, read from the database once
+# expired, so saves of other processes are seen
+_coverage_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.METADATA_CACHE_TTL,
+    name='bar_coverage',
+)
+
+_bar_cache = LRUCache(
+    max_size=settings.BAR_CACHE_MAX_BYTES,
+    ttl=settings.BAR_CACHE_TTL,
+    size_of=lambda bars: (len(bars) + 1) * _BAR_SIZE_ESTIMATE,
+    name='bar',
+)
+# Bumped on every invalidation, reads started before it don't cache their
+# possibly stale result
+_bar_generations: dict[UUID, int] = {}
+
 
 async def get_bars(db: DB, bar_set: BarSet, interval: Interval) -> list[Bar]:
+    cache_key = (bar_set.id, interval.start, interval.end)
+    bars = _bar_cache.get(cache_key)
+
+    if bars is None:
+        generation = _bar_generations.get(bar_set.id, 0)
+
+        with metrics.STAGE_DURATION.labels('read_bars').time():
+            bar_source = _get_bar_source()
+            result = await db.execute(
+                select(bar_source)
+                .where(bar_source.bar_set_id == bar_set.id)
+                .where(bar_source.timestamp >= interval.start)
+                .where(bar_source.timestamp <= interval.end)
+                .order_by(bar_source.timestamp)
+            )
+            bars = result.scalars().all()
+
+        if _bar_generations.get(bar_set.id, 0) == generation:
+            _bar_cache.set(cache_key, bars)
+
+    return list(bars)
+
+
+async def get_bars_before(
+    db: DB, bar_set: BarSet, timestamp: datetime, count: int
+) -> list[Bar]:
+    bar_source = _get_bar_source()
     result = await db.execute(
-        select(Bar)
-        .where(Bar.bar_set == bar_set)
-        .where(Bar.timestamp >= interval.start)
-        .where(Bar.timestamp <= interval.end)
-        .order_by(Bar.timestamp)
+        select(bar_source)
+        .where(bar_source.bar_set_id == bar_set.id)
+        .where(bar_source.timestamp < timestamp)
+        .order_by(bar_source.timestamp.desc())
+        .limit(count)
+    )
+
+    return result.scalars().all()[::-1]
+
+
+async def get_bars_after(
+    db: DB, bar_set: BarSet, timestamp: datetime, count: int
+) -> list[Bar]:
+    bar_source = _get_bar_source()
+    result = await db.execute(
+        select(bar_source)
+        .where(bar_source.bar_set_id == bar_set.id)
+        .where(bar_source.timestamp > timestamp)
+        .order_by(bar_source.timestamp)
+        .limit(count)
     )
 
     return result.scalars().all()
 
 
+async def count_bars(db: DB, bar_set: BarSet, until: datetime) -> int:
+    bar_source = _get_bar_source()
+    result = await db.execute(
+        select(func.count())
+        .select_from(bar_source)
+        .where(bar_source.bar_set_id == bar_set.id)
+        .where(bar_source.timestamp <= until)
+    )
+
+    return result.scalar()
+
+
+async def get_group_bars(
+    db: DB, bar_sets: list[BarSet], interval: Interval
+) -> dict[UUID, list[Bar]]:
+    group_bars = {
+        bar_set.id: _bar_cache.get((bar_set.id, interval.start, interval.end))
+        for bar_set in bar_sets
+    }
+    missing_ids = [id for id, bars in group_bars.items() if bars is None]
+
+    # Bars of bar sets missing in cache are loaded with a single query
+    if missing_ids:
+        generations = {id: _bar_generations.get(id, 0) for id in missing_ids}
+        for bar_set_id in missing_ids:
+            group_bars[bar_set_id] = []
+
+        with metrics.STAGE_DURATION.labels('read_bars').time():
+            bar_source = _get_bar_source()
+            result = await db.execute(
+                select(bar_source)
+                .where(bar_source.bar_set_id.in_(missing_ids))
+                .where(bar_source.timestamp >= interval.start)
+                .where(bar_source.timestamp <= interval.end)
+                .order_by(bar_source.bar_set_id, bar_source.timestamp)
+            )
+            for bar in result.scalars().all():
+                group_bars[bar.bar_set_id].append(bar)
+
+        for bar_set_id in missing_ids:
+            if _bar_generations.get(bar_set_id, 0) == generations[bar_set_id]:
+                _bar_cache.set(
+                    (bar_set_id, interval.start, interval.end),
+                    group_bars[bar_set_id],
+                )
+
+    return {bar_set_id: list(bars) for bar_set_id, bars in group_bars.items()}
+
+
+async def get_latest_bar_arrays(
+    db: DB, bar_sets: list[BarSet], count: int
+) -> dict[UUID, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    # Latest bars of every bar set are read by index in a single query
+    bar_source = _get_bar_source()
+    latest_bars = (
+        select(
+            bar_source.timestamp,
+            bar_source.high,
+            bar_source.low,
+            bar_source.close,
+            bar_source.volume,
+        )
+        .where(bar_source.bar_set_id == BarSet.id)
+        .order_by(bar_source.timestamp.desc())
+        .limit(count)
+        .lateral()
+    )
+    query = (
+        select(BarSet.id, latest_bars)
+        .join(latest_bars, true())
+        .where(BarSet.id.in_([bar_set.id for bar_set in bar_sets]))
+        .order_by(BarSet.id, latest_bars.c.timestamp)
+    )
+    rows = (await db.execute(query)).all()
+
+    bar_arrays = {}
+    for bar_set_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        timestamps = np.array(
+            [int(row[1].timestamp()) for row in group], dtype=np.int64
+        )
+        prices = np.array([row[2:5] for row in group], dtype=np.float64)
+        volumes = np.array([row[5] for row in group], dtype=np.int64)
+
+        bar_arrays[bar_set_id] = (timestamps, prices, volumes)
+
+    return bar_arrays
+
+
 async def get_latest_timestamp(db: DB, bar_set: BarSet) -> datetime:
-    latest_ts = (
-        await db.execute(select(func.max(Bar.timestamp)).filter_by(bar_set=bar_set))
-    ).scalar()
+    latest_ts = (await get_coverage(db, bar_set)).latest_timestamp
 
     return latest_ts or pytz.utc.localize(datetime.min)
 
 
-async def bulk_save_bars(db: DB, bar_set: BarSet, bars: list[Bar]) -> None:
+async def get_coverage(db: DB, bar_set: BarSet) -> Row:
+    coverage = _coverage_cache.get(bar_set.id)
+
+    if coverage is None:
+        result = await db.execute(
+            select(
+                BarSet.earliest_timestamp,
+                BarSet.latest_timestamp,
+                BarSet.bar_count,
+                BarSet.synced_at,
+            ).where(BarSet.id == bar_set.id)
+        )
+        coverage = result.one()
+
+        _coverage_cache.set(bar_set.id, coverage)
+
+    return coverage
+
+
+async def bulk_save_bars(
+    db: DB,
+    bar_set: BarSet,
+    bars: list[Bar],
+    intervals: list[Interval] | None = None,
+    is_synced: bool = False,
+) -> None:
     if bars:
-        min_ts = min(bars, key=lambda bar: bar.timestamp).timestamp
-        max_ts = max(bars, key=lambda bar: bar.timestamp).timestamp
-        bar_values = [bar.dict(exclude_none=True) for bar in bars]
-        bar_interval = BarInterval(bar_set_id=bar_set.id, start=min_ts, end=max_ts)
+        started_at = time.perf_counter()
+
+        if not intervals:
+            min_ts = min(bars, key=lambda bar: bar.timestamp).timestamp
+            max_ts = max(bars, key=lambda bar: bar.timestamp).timestamp
+            intervals = [Interval(start=min_ts, end=max_ts)]
+
+        with metrics.STAGE_DURATION.labels('copy_bars').time():
+            await _add_bar_partitions(db, bars)
+            await _copy_bars(db, bars)
+
+        with metrics.STAGE_DURATION.labels('update_coverage').time():
+            coverage = await _update_coverage(db, bar_set, is_synced)
+
+        with metrics.STAGE_DURATION.labels('defragmentation').time():
+            for interval in intervals:
+                await bar_interval_logic.perform_defragmentation(db, bar_set, interval)
+
+        await db.commit()
+
+        _coverage_cache.set(bar_set.id, coverage)
+        for key, value in coverage._mapping.items():
+            set_committed_value(bar_set, key, value)
+
+        for interval in intervals:
+            invalidate_cached_bars(bar_set, interval)
+
+        elapsed = time.perf_counter() - started_at
+        metrics.BARS_INGESTED.labels(bar_set.timeframe.value).inc(len(bars))
+        metrics.BAR_INGEST_DURATION.observe(elapsed)
+        logger.debug(
+            f'Saved bars. {bar_set.instrument.exchange}:{bar_set.instrument.symbol}, '
+            f'{bar_set.timeframe}, {len(bars)} bars, {len(bars) / elapsed:.0f} bars/s'
+        )
+
+        for listener in _ingest_listeners:
+            try:
+                await listener(db, bar_set, bars)
+
+            # Saved bars are committed and must be served even if a listener
+            # fails, rolling back would only expire instances held by callers
+            except Exception as error:
+                logger.exception(error)
+
+
+def add_ingest_listener(
+    listener: Callable[[DB, BarSet, list[Bar]], Awaitable[None]]
+) -> None:
+    _ingest_listeners.append(listener)
+
 
-        await db.execute(insert(Bar).values(bar_values).on_conflict_do_nothing())
+def invalidate_cached_bars(bar_set: BarSet, interval: Interval) -> None:
+    _bar_generations[bar_set.id] = _bar_generations.get(bar_set.id, 0) + 1
+    _bar_cache.delete_where(
+        lambda key: key[0] == bar_set.id
+        and key[1] <= interval.end
+        and key[2] >= interval.start
+    )
+
+
+def _get_bar_source() -> type[Bar]:
+    if not is_migrating_bars():
+        return Bar
+
+    # Bars saved since the migration started win over not yet moved ones
+    bar_table = Bar.__table__
+    unpartitioned_bars = select(_UNPARTITIONED_BAR_TABLE).where(
+        ~exists().where(
+            bar_table.c.bar_set_id == _UNPARTITIONED_BAR_TABLE.c.bar_set_id,
+            bar_table.c.timestamp == _UNPARTITIONED_BAR_TABLE.c.timestamp,
+        )
+    )
 
-        db.add(bar_interval)
+    return aliased(Bar, union_all(select(bar_table), unpartitioned_bars).subquery())
 
-        await bar_interval_logic.perform_defragmentation(db, bar_set)
 
+async def _add_bar_partitions(db: DB, bars: list[Bar]) -> None:
+    years = {bar.timestamp.astimezone(pytz.utc).year for bar in bars}
+    missing_years = years - _bar_partitions
+
+    # Committed on its own, so the lock on bar isn't held for the whole ingest
+    if missing_years:
+        await create_bar_partitions(db, sorted(missing_years))
         await db.commit()
+
+        _bar_partitions.update(missing_years)
+
+
+async def _copy_bars(db: DB, bars: list[Bar]) -> None:
+    # Staging rows live until the end of the transaction and are merged
+    # into bar by _update_coverage
+    await db.execute(
+        text(
+            f'CREATE TEMP TABLE IF NOT EXISTS {_STAGING_TABLE} '
+            f'(LIKE {Bar.__tablename__} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+        )
+    )
+
+    connection = await (await db.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table(
+        _STAGING_TABLE,
+        records=(
+            (
+                bar.id,
+                bar.bar_set_id,
+                bar.open,
+                bar.high,
+                bar.low,
+                bar.close,
+                bar.volume,
+                bar.timestamp,
+            )
+            for bar in bars
+        ),
+        columns=_COPY_COLUMNS,
+    )
+
+
+async def _update_coverage(db: DB, bar_set: BarSet, is_synced: bool) -> Row:
+    # Staged rows that were actually inserted are counted, so the coverage
+    # stays exact without aggregating over bar
+    columns = ', '.join(_COPY_COLUMNS)
+    synced_at = 'now()' if is_synced else 'synced_at'
+
+    result = await db.execute(
+        text(
+            f'WITH inserted AS ('
+            f'INSERT INTO {Bar.__tablename__} ({columns}) '
+            f'SELECT {columns} FROM {_STAGING_TABLE} ON CONFLICT DO NOTHING '
+            f'RETURNING timestamp'
+            f') '
+            f'UPDATE {BarSet.__tablename__} SET '
+            f'earliest_timestamp = LEAST('
+            f'earliest_timestamp, (SELECT min(timestamp) FROM inserted)), '
+            f'latest_timestamp = GREATEST('
+            f'latest_timestamp, (SELECT max(timestamp) FROM inserted)), '
+            f'bar_count = bar_count + (SELECT count(*) FROM inserted), '
+            f'synced_at = {synced_at} '
+            f'WHERE id = :bar_set_id '
+            f'RETURNING earliest_timestamp, latest_timestamp, bar_count, synced_at'
+        ),
+        {'bar_set_id': bar_set.id},
+    )
+
+    return result.one()
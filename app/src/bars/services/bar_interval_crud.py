@@ -1,9 +1,43 @@
 from bars.models import BarSet, BarInterval
+from common.schemas import Interval
 from config.db import DB
+from sqlalchemy import delete, or_
 from sqlalchemy.future import select
+from datetime import datetime
+import pytz
 
 
-async def get_bar_intervals(db: DB, bar_set: BarSet) -> list[BarInterval]:
-    result = await db.execute(select(BarInterval).filter_by(bar_set=bar_set))
+async def get_bar_intervals(
+    db: DB,
+    bar_set: BarSet,
+    within: Interval | None = None,
+    is_permanent_only: bool = False,
+) -> list[BarInterval]:
+    query = select(BarInterval).filter_by(bar_set=bar_set)
+
+    if within:
+        query = query.where(BarInterval.end >= within.start).where(
+            BarInterval.start <= within.end
+        )
+
+    if is_permanent_only:
+        query = query.where(BarInterval.expires_at.is_(None))
+    else:
+        query = query.where(
+            or_(
+                BarInterval.expires_at.is_(None),
+                BarInterval.expires_at > datetime.now(pytz.utc),
+            )
+        )
+
+    result = await db.execute(query.order_by(BarInterval.start))
 
     return result.scalars().all()
+
+
+async def delete_expired_bar_intervals(db: DB, bar_set: BarSet) -> None:
+    await db.execute(
+        delete(BarInterval)
+        .where(BarInterval.bar_set_id == bar_set.id)
+        .where(BarInterval.expires_at <= datetime.now(pytz.utc))
+    )
@@ -1,96 +1,121 @@
 from bars.models import BarSet, BarInterval, Timeframe
 from common.schemas import Interval
+from common.interval_index import IntervalIndex
 from config.db import DB
-from sqlalchemy.future import select
-from datetime import timedelta
-import math
+from config import settings
+from datetime import datetime, timedelta
+import calendar
+import pytz
+from . import bar_interval_crud
+
+
+async def perform_defragmentation(
+    db: DB, bar_set: BarSet, interval: Interval
+) -> None:
+    step_size = get_step_size(bar_set.timeframe)
+    # Intervals verified to be empty expire, so they are never merged
+    neighbours = await bar_interval_crud.get_bar_intervals(
+        db,
+        bar_set,
+        Interval(start=interval.start - step_size, end=interval.end + step_size),
+        is_permanent_only=True,
+    )
 
+    if neighbours:
+        # Neighbours are sorted by start, so only the first one is kept
+        merged_interval = neighbours[0]
+        merged_interval.start = min(merged_interval.start, interval.start)
+        merged_interval.end = max(interval.end, *(item.end for item in neighbours))
 
-async def perform_defragmentation(db: DB, bar_set: BarSet) -> None:
-    step_size = _get_step_size(bar_set.timeframe)
-    intervals_to_delete = []
+        for neighbour in neighbours[1:]:
+            await db.delete(neighbour)
+
+    else:
+        bar_interval = BarInterval(
+            bar_set_id=bar_set.id, start=interval.start, end=interval.end
+        )
+        db.add(bar_interval)
+
+
+async def save_empty_intervals(
+    db: DB,
+    bar_set: BarSet,
+    intervals: list[Interval],
+    expires_at: datetime | None = None,
+) -> None:
+    if intervals:
+        expires_at = expires_at or datetime.now(pytz.utc) + timedelta(
+            seconds=settings.BAR_EMPTY_INTERVAL_TTL
+        )
+        await bar_interval_crud.delete_expired_bar_intervals(db, bar_set)
+
+        for interval in intervals:
+            bar_interval = BarInterval(
+                bar_set_id=bar_set.id,
+                start=interval.start,
+                end=interval.end,
+                expires_at=expires_at,
+            )
+            db.add(bar_interval)
+
+        await db.commit()
 
-    intervals = (
-        (await db.execute(select(BarInterval).where(BarInterval.bar_set == bar_set)))
-        .scalars()
-        .all()
-    )
 
-    for interval_a in intervals:
-        for interval_b in intervals:
-            if (
-                interval_a is not interval_b
-                and interval_a not in intervals_to_delete
-                and interval_b not in intervals_to_delete
-                and (
-                    interval_a.start - step_size
-                    <= interval_b.start
-                    <= interval_a.end + step_size
-                    or interval_a.start - step_size
-                    <= interval_b.end
-                    <= interval_a.end + step_size
-                )
-            ):
-                interval_a.start = min(interval_a.start, interval_b.start)
-                interval_a.end = max(interval_a.end, interval_b.end)
-                intervals_to_delete.append(interval_b)
-
-    for interval in intervals_to_delete:
-        await db.delete(interval)
+async def get_interval_index(
+    db: DB, bar_set: BarSet, within: Interval | None = None
+) -> IntervalIndex:
+    bar_intervals = await bar_interval_crud.get_bar_intervals(db, bar_set, within)
+
+    return IntervalIndex(bar_intervals, gap=get_step_size(bar_set.timeframe))
 
 
 def split_intervals(
     intervals: list[Interval], timeframe: Timeframe, length: int
 ) -> list[Interval]:
     splitted_intervals = []
-    step_size = _get_step_size(timeframe)
 
     for interval_to_split in intervals:
-        bar_count = math.ceil(
-            (interval_to_split.end - interval_to_split.start) / step_size
-        )
-        part_count = math.ceil(bar_count / length)
-
         end = interval_to_split.end
-        for _ in range(part_count):
-            start = end - length * step_size
+        while end >= interval_to_split.start:
+            start = shift_timestamp(end, timeframe, -length)
             if start < interval_to_split.start:
                 start = interval_to_split.start
 
             splitted_interval = Interval(start=start, end=end)
             splitted_intervals.append(splitted_interval)
-            end = start - step_size
+            end = shift_timestamp(start, timeframe, -1)
 
     return splitted_intervals
 
 
 def calculate_missing_intervals(
-    within_interval: Interval, existing_intervals: list[BarInterval]
+    within_interval: Interval,
+    existing_intervals: IntervalIndex,
+    trading_calendar: IntervalIndex | None = None,
 ) -> list[Interval]:
-    missing_intervals = []
-    next_start = within_interval.start
-
-    for interval in existing_intervals:
-        if (
-            interval.end > within_interval.start
-            and interval.start < within_interval.end
-        ):
-            if interval.start > next_start < within_interval.end:
-                missing_intervals.append(Interval(start=next_start, end=interval.start))
-
-            next_start = interval.end
-
-    if next_start < within_interval.end:
-        missing_intervals.append(Interval(start=next_start, end=within_interval.end))
+    missing_intervals = existing_intervals.missing(within_interval)
+
+    # There are no bars to fetch while the market is closed
+    if trading_calendar is not None:
+        missing_intervals = [
+            Interval(
+                start=max(missing_interval.start, trading_interval.start),
+                end=min(missing_interval.end, trading_interval.end),
+            )
+            for missing_interval in missing_intervals
+            for trading_interval in trading_calendar.overlapping(missing_interval)
+        ]
 
     return missing_intervals
 
 
-def _get_step_size(timeframe: Timeframe) -> timedelta:
+def get_step_size(timeframe: Timeframe) -> timedelta:
     if timeframe == Timeframe.M1:
         step_size = timedelta(minutes=1)
     elif timeframe == Timeframe.M5:
         step_size = timedelta(minutes=5)
+    elif timeframe == Timeframe.M15:
+        step_size = timedelta(minutes=15)
     elif timeframe == Timeframe.M30:
         step_size = timedelta(minutes=30)
     elif timeframe == Timeframe.M60:
@@ -100,8 +125,45 @@ def _get_step_size(timeframe: Timeframe) -> timedelta:
     elif timeframe == Timeframe.WEEK:
         step_size = timedelta(days=7)
     elif timeframe == Timeframe.MONTH:
-        step_size = timedelta(days=30)  # TODO: Better approach
+        # Longest month, bars are never further apart than this
+        step_size = timedelta(days=31)
     else:
         raise ValueError(f'Cannot get step size for timeframe {timeframe}')
 
     return step_size
+
+
+def shift_timestamp(timestamp: datetime, timeframe: Timeframe, count: int) -> datetime:
+    if timeframe == Timeframe.MONTH:
+        month_index = timestamp.year * 12 + timestamp.month - 1 + count
+        year, month = divmod(month_index, 12)
+        day = min(timestamp.day, calendar.monthrange(year, month + 1)[1])
+        shifted_timestamp = timestamp.replace(year=year, month=month + 1, day=day)
+    else:
+        shifted_timestamp = timestamp + count * get_step_size(timeframe)
+
+    return shifted_timestamp
+
+
+def get_period_start(timestamp: datetime, timeframe: Timeframe) -> datetime:
+    day_start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if timeframe == Timeframe.WEEK:
+        period_start = day_start - timedelta(days=day_start.weekday())
+    elif timeframe == Timeframe.MONTH:
+        period_start = day_start.replace(day=1)
+    else:
+        raise ValueError(f'Cannot get period start for timeframe {timeframe}')
+
+    return period_start
+
+
+def get_period_end(timestamp: datetime, timeframe: Timeframe) -> datetime:
+    period_start = get_period_start(timestamp, timeframe)
+
+    if timeframe == Timeframe.WEEK:
+        period_end = period_start + timedelta(weeks=1)
+    else:
+        period_end = get_period_start(period_start + timedelta(days=31), timeframe)
+
+    return period_end
@@ -1,65 +1,384 @@
-from bars.models import BarSet, Bar
+from bars.models import BarSet, Bar, Timeframe
 from common.schemas import Interval
-from config.db import DB
+from common.interval_index import IntervalIndex
+from common.single_flight import SingleFlight
+from common import metrics
+from config.db import DB, Session
+from config import settings
 from instruments import services as instrument_services
 from ib.connector import ib_connector
-from datetime import timedelta
+from ib_insync import RequestError
+from ib import utils as ib_utils
+from ib.scheduler import Priority
+from datetime import datetime, timedelta
+from uuid import UUID
 from loguru import logger
-from . import bar_crud, bar_interval_crud, bar_interval_logic
+import asyncio
+import pytz
+from . import (
+    bar_crud,
+    bar_interval_logic,
+    bar_resample_logic,
+    bar_set_crud,
+    bar_stream_logic,
+)
 
+# Origin fetches in flight, keyed by (bar set id, interval start, interval end)
+_origin_fetches = SingleFlight()
 
-async def get_historical_bars(db: DB, bar_set: BarSet, interval: Interval) -> list[Bar]:
-    existing_intervals = await bar_interval_crud.get_bar_intervals(db, bar_set)
+
+async def get_historical_bars(
+    db: DB,
+    bar_set: BarSet,
+    interval: Interval,
+    priority: Priority = Priority.INTERACTIVE,
+) -> list[Bar]:
+    if bar_set.timeframe in (Timeframe.WEEK, Timeframe.MONTH):
+        return await _get_calendar_bars(db, bar_set, interval, priority)
+
+    missing_intervals = await _get_missing_intervals(db, bar_set, interval)
+    live_bar = await _fill_missing_intervals(bar_set, missing_intervals, priority)
+    bars = await bar_crud.get_bars(db, bar_set, interval)
+
+    return _add_live_bar(bar_set, interval, bars, live_bar)
+
+
+async def get_group_historical_bars(
+    db: DB,
+    bar_sets: list[BarSet],
+    interval: Interval,
+    priority: Priority = Priority.INTERACTIVE,
+) -> dict[UUID, list[Bar]]:
+    calendar_bar_sets = [
+        bar_set
+        for bar_set in bar_sets
+        if bar_set.timeframe in (Timeframe.WEEK, Timeframe.MONTH)
+    ]
+    bar_sets = [bar_set for bar_set in bar_sets if bar_set not in calendar_bar_sets]
+
+    missing_intervals = [
+        await _get_missing_intervals(db, bar_set, interval) for bar_set in bar_sets
+    ]
+
+    # Origin requests of all bar sets are queued at once, so the scheduler
+    # orders them in a single pass
+    live_bars = await asyncio.gather(
+        *(
+            _fill_missing_intervals(bar_set, bar_set_missing_intervals, priority)
+            for bar_set, bar_set_missing_intervals in zip(bar_sets, missing_intervals)
+        )
+    )
+    bars = await bar_crud.get_group_bars(db, bar_sets, interval)
+
+    group_bars = {
+        bar_set.id: _add_live_bar(bar_set, interval, bars[bar_set.id], live_bar)
+        for bar_set, live_bar in zip(bar_sets, live_bars)
+    }
+    for bar_set in calendar_bar_sets:
+        group_bars[bar_set.id] = await _get_calendar_bars(
+            db, bar_set, interval, priority
+        )
+
+    return group_bars
+
+
+async def _get_missing_intervals(
+    db: DB, bar_set: BarSet, interval: Interval
+) -> list[Interval]:
+    # Daily bars are labeled with trade date, which is outside of sessions
+    trading_calendar = None
+    if bar_set.timeframe != Timeframe.DAY:
+        with metrics.STAGE_DURATION.labels('metadata').time():
+            trading_calendar = await instrument_services.get_trading_calendar(
+                db, bar_set.instrument
+            )
+
+    with metrics.STAGE_DURATION.labels('missing_intervals').time():
+        existing_intervals = await bar_interval_logic.get_interval_index(
+            db, bar_set, interval
+        )
+        missing_intervals = bar_interval_logic.calculate_missing_intervals(
+            interval, existing_intervals, trading_calendar
+        )
+
+    if not missing_intervals:
+        cache_result = 'hit'
+    elif not existing_intervals.overlapping(interval):
+        cache_result = 'miss'
+    else:
+        cache_result = 'partial'
+    metrics.CACHE_REQUESTS.labels('bar_interval', cache_result).inc()
+
+    # Derive what is possible from cached lower timeframes before asking origin
+    if missing_intervals and await bar_resample_logic.resample_missing_intervals(
+        db, bar_set, missing_intervals
+    ):
+        existing_intervals = await bar_interval_logic.get_interval_index(
+            db, bar_set, interval
+        )
+        missing_intervals = bar_interval_logic.calculate_missing_intervals(
+            interval, existing_intervals, trading_calendar
+        )
+
+    # Bars since the stream started are saved by the stream as they complete
+    streamed_since = bar_stream_logic.get_streamed_since(bar_set)
+    if streamed_since:
+        missing_intervals = [
+            Interval(
+                start=missing_interval.start,
+                end=min(missing_interval.end, streamed_since),
+            )
+            for missing_interval in missing_intervals
+            if missing_interval.start < streamed_since
+        ]
+
+    return missing_intervals
+
+
+async def _fill_missing_intervals(
+    bar_set: BarSet, missing_intervals: list[Interval], priority: Priority
+) -> Bar | None:
+    if not missing_intervals:
+        return None
+
+    with metrics.STAGE_DURATION.labels('origin_fetch').time():
+        live_bars = await asyncio.gather(
+            *(
+                _fetch_missing_interval(bar_set, missing_interval, priority)
+                for missing_interval in missing_intervals
+            )
+        )
+
+    return _get_latest_bar(live_bars)
+
+
+def _add_live_bar(
+    bar_set: BarSet, interval: Interval, bars: list[Bar], live_bar: Bar | None
+) -> list[Bar]:
+    streamed_bar = bar_stream_logic.get_live_bar(bar_set)
+    if streamed_bar and interval.start <= streamed_bar.timestamp <= interval.end:
+        live_bar = _get_latest_bar([live_bar, streamed_bar])
+
+    if live_bar and (not bars or bars[-1].timestamp < live_bar.timestamp):
+        bars.append(live_bar)
+
+    return bars
+
+
+async def _get_calendar_bars(
+    db: DB, bar_set: BarSet, interval: Interval, priority: Priority
+) -> list[Bar]:
+    timeframe = bar_set.timeframe
+    existing_intervals = await bar_interval_logic.get_interval_index(
+        db, bar_set, interval
+    )
     missing_intervals = bar_interval_logic.calculate_missing_intervals(
         interval, existing_intervals
     )
+    calendar_bars = []
+
+    # Current period is never complete, so it's always built from daily bars
+    now = datetime.now(pytz.utc)
+    current_period_start = bar_interval_logic.get_period_start(now, timeframe)
+    if interval.end >= current_period_start:
+        missing_intervals.append(Interval(start=current_period_start, end=interval.end))
+
+    if missing_intervals:
+        # Daily bars of whole periods are needed for them to be complete
+        day_interval = Interval(
+            start=bar_interval_logic.get_period_start(
+                missing_intervals[0].start, timeframe
+            ),
+            end=min(
+                bar_interval_logic.get_period_end(
+                    max(missing_interval.end for missing_interval in missing_intervals),
+                    timeframe,
+                ),
+                now,
+            ),
+        )
+        day_bar_set = await bar_set_crud.get_or_create_bar_set(
+            db, bar_set.instrument, Timeframe.DAY
+        )
+        day_bars = await get_historical_bars(db, day_bar_set, day_interval, priority)
+
+        calendar_bars, derived_interval = bar_resample_logic.resample_bars(
+            bar_set,
+            Timeframe.DAY,
+            day_bars,
+            day_interval,
+            is_incomplete_included=True,
+        )
+
+        if derived_interval:
+            complete_bars = [
+                bar
+                for bar in calendar_bars
+                if derived_interval.start <= bar.timestamp <= derived_interval.end
+            ]
+            await bar_crud.bulk_save_bars(
+                db, bar_set, complete_bars, [derived_interval]
+            )
+
+    bars = await bar_crud.get_bars(db, bar_set, interval)
+    saved_timestamps = {bar.timestamp for bar in bars}
+
+    for bar in calendar_bars:
+        if (
+            interval.start <= bar.timestamp <= interval.end
+            and bar.timestamp not in saved_timestamps
+        ):
+            bars.append(bar)
+
+    return sorted(bars, key=lambda bar: bar.timestamp)
+
+
+async def _fetch_missing_interval(
+    bar_set: BarSet, interval: Interval, priority: Priority
+) -> Bar | None:
+    # Join fetches of overlapping intervals already in flight, fetch only the rest
+    joined_keys = [
+        key
+        for key in _origin_fetches.keys()
+        if key[0] == bar_set.id and key[1] < interval.end and key[2] > interval.start
+    ]
+    joined_intervals = IntervalIndex(
+        Interval(start=start, end=end) for _, start, end in joined_keys
+    )
+    new_keys = [
+        (bar_set.id, new_interval.start, new_interval.end)
+        for new_interval in joined_intervals.missing(interval)
+    ]
+
+    live_bars = await asyncio.gather(
+        *(
+            _origin_fetches.do(
+                key,
+                lambda key=key: _fill_missing_interval(
+                    bar_set, Interval(start=key[1], end=key[2]), priority
+                ),
+            )
+            for key in joined_keys + new_keys
+        )
+    )
+
+    return _get_latest_bar(live_bars)
+
+
+async def _fill_missing_interval(
+    bar_set: BarSet, interval: Interval, priority: Priority
+) -> Bar | None:
+    # Chunks as long as IB serves, so a cold chart takes as few requests as possible
     missing_intervals = bar_interval_logic.split_intervals(
-        missing_intervals, bar_set.timeframe, 100
+        [interval],
+        bar_set.timeframe,
+        ib_utils.get_max_request_length(bar_set.timeframe),
     )
     instrument = bar_set.instrument
     live_bar = None
 
-    for missing_interval in missing_intervals:
-        is_overlap_session = await instrument_services.is_overlap_open_session(
-            db, instrument, missing_interval
-        )
+    # The fetch is shared between requests, so it must not use any request's session
+    async with Session() as db:
         latest_ts = await bar_crud.get_latest_timestamp(db, bar_set)
+        origin_tasks = []
 
-        # If missing interval doesn't overlap with open session interval
-        if not is_overlap_session:
-            # Extend missing interval to overlap possible gaps in db
-            missing_interval.start -= timedelta(days=1, seconds=1)
-            missing_interval.end += timedelta(days=1, seconds=1)
+        for missing_interval in missing_intervals:
+            is_overlap_session = await instrument_services.is_overlap_open_session(
+                db, instrument, missing_interval
+            )
 
-        logger.debug(
-            f'Missing bars within interval. Retreiving from origin... '
-            f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}, {missing_interval}'
-        )
+            # If missing interval doesn't overlap with open session interval
+            if not is_overlap_session:
+                # Extend missing interval to overlap possible gaps in db
+                missing_interval.start -= timedelta(days=1, seconds=1)
+                missing_interval.end += timedelta(days=1, seconds=1)
 
-        origin_bars = await _get_bars_from_origin(bar_set, missing_interval)
+            logger.debug(
+                f'Missing bars within interval. Retreiving from origin... '
+                f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}, {missing_interval}'
+            )
 
-        if (
-            is_overlap_session
-            and origin_bars
-            and latest_ts
-            and latest_ts < origin_bars[-1].timestamp
-        ):
-            live_bar = origin_bars[-1]
-            origin_bars.remove(live_bar)
+            origin_task = asyncio.create_task(
+                _get_bars_from_origin(
+                    bar_set, missing_interval, priority, is_overlap_session
+                )
+            )
+            origin_tasks.append(origin_task)
 
-        await bar_crud.bulk_save_bars(db, bar_set, origin_bars)
+        try:
+            batch_bars = []
+            batch_intervals = []
+            empty_intervals = []
 
-    bars = await bar_crud.get_bars(db, bar_set, interval)
-    if live_bar:
-        bars.append(live_bar)
+            # Origin requests run concurrently within scheduler limits,
+            # while the session saves their results in batches
+            for origin_task in asyncio.as_completed(origin_tasks):
+                origin_bars, origin_interval, is_overlap_session = await origin_task
 
-    return bars
+                # Failed requests say nothing about the interval, it stays
+                # missing and is requested again next time
+                if origin_bars is None:
+                    continue
+
+                # Bars of a closed period are final, so whatever origin has no
+                # bars for won't be requested again until it expires
+                if not is_overlap_session:
+                    empty_intervals += _get_empty_intervals(
+                        origin_interval, origin_bars
+                    )
+
+                if (
+                    is_overlap_session
+                    and origin_bars
+                    and latest_ts
+                    and latest_ts < origin_bars[-1].timestamp
+                ):
+                    live_bar = _get_latest_bar([live_bar, origin_bars[-1]])
+                    origin_bars.remove(origin_bars[-1])
+
+                if origin_bars:
+                    batch_bars += origin_bars
+                    batch_intervals.append(
+                        Interval(
+                            start=origin_bars[0].timestamp,
+                            end=origin_bars[-1].timestamp,
+                        )
+                    )
 
+                if len(batch_bars) >= settings.BAR_INGEST_BATCH_SIZE:
+                    await bar_crud.bulk_save_bars(
+                        db, bar_set, batch_bars, batch_intervals, is_synced=True
+                    )
+                    batch_bars, batch_intervals = [], []
 
-async def _get_bars_from_origin(bar_set: BarSet, interval: Interval) -> list[Bar]:
-    bars = await ib_connector.get_historical_bars(bar_set, interval)
+            await bar_crud.bulk_save_bars(
+                db, bar_set, batch_bars, batch_intervals, is_synced=True
+            )
+            await bar_interval_logic.save_empty_intervals(db, bar_set, empty_intervals)
+
+        finally:
+            for origin_task in origin_tasks:
+                origin_task.cancel()
+
+    return live_bar
+
+
+async def _get_bars_from_origin(
+    bar_set: BarSet, interval: Interval, priority: Priority, is_overlap_session: bool
+) -> tuple[list[Bar] | None, Interval, bool]:
     instrument = bar_set.instrument
 
+    try:
+        bars = await ib_connector.get_historical_bars(bar_set, interval, priority)
+
+    except (RequestError, asyncio.TimeoutError) as error:
+        logger.warning(
+            f'Origin request failed. '
+            f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}, '
+            f'{interval}, {error}'
+        )
+        return None, interval, is_overlap_session
+
     if bars:
         logger.debug(
             f'Received bars from origin. '
@@ -71,4 +390,28 @@ async def _get_bars_from_origin(bar_set: BarSet, interval: Interval) -> list[Bar
             f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}, {interval}'
         )
 
-    return bars
+    return bars, interval, is_overlap_session
+
+
+def _get_empty_intervals(interval: Interval, bars: list[Bar]) -> list[Interval]:
+    end = min(interval.end, datetime.now(pytz.utc))
+
+    if not bars:
+        empty_intervals = [Interval(start=interval.start, end=end)]
+    else:
+        empty_intervals = [
+            Interval(start=interval.start, end=bars[0].timestamp),
+            Interval(start=bars[-1].timestamp, end=end),
+        ]
+
+    return [
+        empty_interval
+        for empty_interval in empty_intervals
+        if empty_interval.start < empty_interval.end
+    ]
+
+
+def _get_latest_bar(bars: list[Bar | None]) -> Bar | None:
+    return max(
+        (bar for bar in bars if bar), key=lambda bar: bar.timestamp, default=None
+    )
@@ -0,0 +1,111 @@
+from bars.models import BarSet, Timeframe
+from common.schemas import Interval
+from config.db import Session
+from config import settings
+from instruments import services as instrument_services
+from ib.scheduler import Priority
+from collections import Counter
+from datetime import datetime, timedelta
+from loguru import logger
+import asyncio
+import pytz
+from . import bar_logic, bar_set_crud
+
+# Chart requests per (ticker, timeframe), the most requested pairs are prefetched
+_usage: Counter[tuple[str, Timeframe]] = Counter()
+
+# When each watched pair is due to be prefetched again
+_next_prefetch_at: dict[tuple[str, Timeframe], datetime] = {}
+
+_prefetcher: asyncio.Task | None = None
+
+
+def record_usage(bar_set: BarSet) -> None:
+    instrument = bar_set.instrument
+    ticker = f'{instrument.exchange.value}:{instrument.symbol}'
+
+    _usage[(ticker, bar_set.timeframe)] += 1
+
+
+def get_watchlist() -> list[tuple[str, Timeframe]]:
+    watchlist = []
+
+    for pair in settings.PREFETCH_WATCHLIST:
+        ticker, timeframe = pair.strip().rsplit('/', 1)
+        watchlist.append((ticker, Timeframe(timeframe)))
+
+    for pair, _ in _usage.most_common(settings.PREFETCH_USAGE_SIZE):
+        if pair not in watchlist:
+            watchlist.append(pair)
+
+    return watchlist
+
+
+def start_prefetcher() -> None:
+    global _prefetcher
+
+    if not _prefetcher or _prefetcher.done():
+        _prefetcher = asyncio.create_task(_run_prefetcher())
+
+
+def stop_prefetcher() -> None:
+    if _prefetcher:
+        _prefetcher.cancel()
+
+
+async def _run_prefetcher() -> None:
+    while True:
+        now = datetime.now(pytz.utc)
+        watchlist = get_watchlist()
+
+        for pair in watchlist:
+            if _next_prefetch_at.get(pair, now) <= now:
+                _next_prefetch_at[pair] = await _prefetch(*pair)
+
+        # Pairs are picked up from usage between sessions as well
+        sleep_until = min(
+            [
+                now + timedelta(seconds=settings.PREFETCH_POLL_INTERVAL),
+                *(_next_prefetch_at[pair] for pair in watchlist),
+            ]
+        )
+
+        await asyncio.sleep(
+            max((sleep_until - datetime.now(pytz.utc)).total_seconds(), 1)
+        )
+
+
+async def _prefetch(ticker: str, timeframe: Timeframe) -> datetime:
+    now = datetime.now(pytz.utc)
+    retry_at = now + timedelta(seconds=settings.PREFETCH_POLL_INTERVAL)
+
+    try:
+        async with Session() as db:
+            instrument = await instrument_services.get_saved_instrument(db, ticker)
+            bar_set = await bar_set_crud.get_or_create_bar_set(
+                db, instrument, timeframe
+            )
+            trading_session = await instrument_services.get_nearest_trading_session(
+                db, instrument
+            )
+
+            # Missing history is filled first, later runs only append the tail
+            interval = Interval(
+                start=now - timedelta(days=settings.PREFETCH_HISTORY_DAYS), end=now
+            )
+            await bar_logic.get_historical_bars(
+                db, bar_set, interval, Priority.BACKGROUND
+            )
+
+    except Exception as error:
+        logger.error(f'Prefetch failed. {ticker}, {timeframe}, {error}')
+        return retry_at
+
+    logger.debug(f'Prefetched bars. {ticker}, {timeframe}')
+
+    # Without a known upcoming session, the calendar is checked again later
+    if trading_session.end <= now:
+        return retry_at
+
+    # Bars of the nearest session are complete after it closes
+    return trading_session.end + timedelta(seconds=settings.PREFETCH_CLOSE_DELAY)
@@ -0,0 +1,295 @@
+from bars.models import BarSet, BarInterval, Bar, Timeframe
+from common.schemas import Interval
+from common.interval_index import IntervalIndex
+from common.utils import encode_price
+from config.db import DB
+from config import settings
+from instruments.models import Exchange
+from instruments import services as instrument_services
+from datetime import datetime
+import numpy as np
+import pytz
+from . import bar_crud, bar_interval_crud, bar_interval_logic, bar_set_crud
+
+# Lower timeframes whose bars add up to whole bars of a timeframe, coarsest first
+_SOURCE_TIMEFRAMES = {
+    Timeframe.M5: [Timeframe.M1],
+    Timeframe.M15: [Timeframe.M5, Timeframe.M1],
+    Timeframe.M30: [Timeframe.M15, Timeframe.M5, Timeframe.M1],
+    Timeframe.M60: [Timeframe.M30, Timeframe.M15, Timeframe.M5, Timeframe.M1],
+    Timeframe.DAY: [
+        Timeframe.M60,
+        Timeframe.M30,
+        Timeframe.M15,
+        Timeframe.M5,
+        Timeframe.M1,
+    ],
+}
+
+
+async def resample_missing_intervals(
+    db: DB, bar_set: BarSet, missing_intervals: list[Interval]
+) -> bool:
+    instrument = bar_set.instrument
+    is_resampled = False
+
+    # Only bar sets something was saved for can be sources, none are created
+    source_bar_sets = [
+        source_bar_set
+        for source_timeframe in _SOURCE_TIMEFRAMES.get(bar_set.timeframe, [])
+        for source_bar_set in await bar_set_crud.get_bar_sets(
+            db, [instrument], source_timeframe
+        )
+    ]
+    if not source_bar_sets:
+        return is_resampled
+
+    # Bars of the open session are still changing, leave them to origin
+    resample_until = datetime.now(pytz.utc)
+    if await instrument_services.is_session_open(db, instrument):
+        trading_session = await instrument_services.get_nearest_trading_session(
+            db, instrument
+        )
+        resample_until = trading_session.start
+
+    for source_bar_set in source_bar_sets:
+        source_timeframe = source_bar_set.timeframe
+        still_missing_intervals = []
+
+        for missing_interval in missing_intervals:
+            within = Interval(
+                start=missing_interval.start,
+                end=min(missing_interval.end, resample_until),
+            )
+            source_bar_intervals = []
+            covered_intervals = []
+
+            if within.start < within.end:
+                source_bar_intervals = await bar_interval_crud.get_bar_intervals(
+                    db, source_bar_set, within
+                )
+                source_intervals = IntervalIndex(
+                    source_bar_intervals,
+                    gap=bar_interval_logic.get_step_size(source_timeframe),
+                )
+                covered_intervals = [
+                    Interval(
+                        start=max(interval.start, within.start),
+                        end=min(interval.end, within.end),
+                    )
+                    for interval in source_intervals.overlapping(within)
+                ]
+
+            for covered_interval in covered_intervals:
+                source_bars = await bar_crud.get_bars(
+                    db, source_bar_set, covered_interval
+                )
+                bars, derived_interval = resample_bars(
+                    bar_set, source_timeframe, source_bars, covered_interval
+                )
+
+                if bars:
+                    await _save_resampled_bars(
+                        db, bar_set, bars, derived_interval, source_bar_intervals
+                    )
+                    is_resampled = True
+
+            still_missing_intervals += IntervalIndex(covered_intervals).missing(
+                missing_interval
+            )
+
+        missing_intervals = still_missing_intervals
+
+    return is_resampled
+
+
+def resample_bars(
+    bar_set: BarSet,
+    source_timeframe: Timeframe,
+    source_bars: list[Bar],
+    interval: Interval,
+    is_incomplete_included: bool = False,
+) -> tuple[list[Bar], Interval | None]:
+    if not source_bars:
+        return [], None
+
+    instrument = bar_set.instrument
+    tick_size = instrument.tick_size
+    source_step = bar_interval_logic.get_step_size(source_timeframe).total_seconds()
+
+    timestamps = np.array(
+        [int(bar.timestamp.timestamp()) for bar in source_bars], dtype=np.int64
+    )
+    prices = np.array(
+        [(bar.open, bar.high, bar.low, bar.close) for bar in source_bars],
+        dtype=np.float64,
+    )
+    volumes = np.array([bar.volume for bar in source_bars], dtype=np.int64)
+
+    # Aggregate whole ticks to avoid floating point noise in derived prices
+    if not settings.BAR_PRICES_IN_TICKS:
+        prices = prices / float(tick_size)
+    ticks = np.rint(prices).astype(np.int64)
+
+    if source_timeframe == Timeframe.DAY:
+        labels, starts, ends = _get_calendar_bucket_bounds(
+            bar_set.timeframe, timestamps
+        )
+    else:
+        labels, starts, ends = _get_session_bucket_bounds(
+            bar_set.timeframe, instrument.exchange, timestamps
+        )
+
+    first_indexes = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    last_indexes = np.r_[first_indexes[1:] - 1, len(labels) - 1]
+
+    # Only buckets entirely within the covered interval are complete. Covered
+    # intervals end with the start of their last source bar, except daily bars
+    # still trading are covered too, so calendar periods must have ended
+    if source_timeframe == Timeframe.DAY:
+        source_step = 0
+    is_complete = (starts[first_indexes] >= int(interval.start.timestamp())) & (
+        ends[first_indexes] - int(source_step) <= int(interval.end.timestamp())
+    )
+    is_included = np.ones_like(is_complete) if is_incomplete_included else is_complete
+
+    bucket_opens = ticks[first_indexes, 0]
+    bucket_highs = np.maximum.reduceat(ticks[:, 1], first_indexes)
+    bucket_lows = np.minimum.reduceat(ticks[:, 2], first_indexes)
+    bucket_closes = ticks[last_indexes, 3]
+    bucket_volumes = np.add.reduceat(volumes, first_indexes)
+
+    bars = []
+    for index in np.flatnonzero(is_included):
+        bar = Bar(
+            bar_set_id=bar_set.id,
+            open=encode_price(int(bucket_opens[index]) * tick_size, tick_size),
+            high=encode_price(int(bucket_highs[index]) * tick_size, tick_size),
+            low=encode_price(int(bucket_lows[index]) * tick_size, tick_size),
+            close=encode_price(int(bucket_closes[index]) * tick_size, tick_size),
+            volume=int(bucket_volumes[index]),
+            timestamp=datetime.fromtimestamp(
+                int(labels[first_indexes[index]]), pytz.utc
+            ),
+        )
+        bars.append(bar)
+
+    complete_labels = labels[first_indexes[is_complete]]
+    derived_interval = (
+        Interval(
+            start=datetime.fromtimestamp(int(complete_labels[0]), pytz.utc),
+            end=datetime.fromtimestamp(int(complete_labels[-1]), pytz.utc),
+        )
+        if len(complete_labels)
+        else None
+    )
+
+    return bars, derived_interval
+
+
+async def _save_resampled_bars(
+    db: DB,
+    bar_set: BarSet,
+    bars: list[Bar],
+    derived_interval: Interval,
+    source_bar_intervals: list[BarInterval],
+) -> None:
+    # Coverage derived from source intervals verified to be empty expires
+    # along with them
+    expiring_bar_intervals = [
+        bar_interval
+        for bar_interval in source_bar_intervals
+        if bar_interval.expires_at
+        and bar_interval.start < derived_interval.end
+        and bar_interval.end > derived_interval.start
+    ]
+    expiring_intervals = [
+        Interval(
+            start=max(bar_interval.start, derived_interval.start),
+            end=min(bar_interval.end, derived_interval.end),
+        )
+        for bar_interval in expiring_bar_intervals
+    ]
+    permanent_intervals = IntervalIndex(expiring_intervals).missing(derived_interval)
+
+    await bar_crud.bulk_save_bars(db, bar_set, bars, permanent_intervals)
+
+    if expiring_intervals:
+        await bar_interval_logic.save_empty_intervals(
+            db,
+            bar_set,
+            expiring_intervals,
+            min(bar_interval.expires_at for bar_interval in expiring_bar_intervals),
+        )
+
+
+def _get_session_bucket_bounds(
+    timeframe: Timeframe, exchange: Exchange, timestamps: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    step = int(bar_interval_logic.get_step_size(timeframe).total_seconds())
+    tz_id, session_open, session_close = instrument_services.get_exchange_schedule(
+        exchange
+    )
+    open_offset = session_open.hour * 3600 + session_open.minute * 60
+    close_offset = session_close.hour * 3600 + session_close.minute * 60
+
+    # Sessions crossing midnight belong to the trade date they close on
+    if open_offset > close_offset:
+        open_offset -= 86400
+    session_length = close_offset - open_offset
+
+    utc_offsets = _get_utc_offsets(timestamps, tz_id)
+    trade_days = (timestamps + utc_offsets - open_offset) // 86400
+    session_starts = trade_days * 86400 + open_offset - utc_offsets
+    session_ends = session_starts + session_length
+
+    if timeframe == Timeframe.DAY:
+        # Daily bars are labeled with trade date, same way as origin does
+        labels = trade_days * 86400
+        starts = session_starts
+        ends = session_ends
+    else:
+        # Intraday buckets are aligned to clock, but never start before session
+        floors = timestamps - timestamps % step
+        labels = np.maximum(floors, session_starts)
+        starts = labels
+        ends = np.minimum(floors + step, session_ends)
+
+    return labels, starts, ends
+
+
+def _get_calendar_bucket_bounds(
+    timeframe: Timeframe, timestamps: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Daily bars are labeled with midnight of their trade date
+    days = (timestamps // 86400).astype('datetime64[D]')
+
+    if timeframe == Timeframe.WEEK:
+        # Epoch started on Thursday, weeks start on Monday
+        period_starts = days - (days.astype(np.int64) + 3) % 7
+        period_ends = period_starts + 7
+    elif timeframe == Timeframe.MONTH:
+        months = days.astype('datetime64[M]')
+        period_starts = months.astype('datetime64[D]')
+        period_ends = (months + 1).astype('datetime64[D]')
+    else:
+        raise ValueError(f'Cannot resample daily bars into timeframe {timeframe}')
+
+    labels = period_starts.astype(np.int64) * 86400
+    ends = period_ends.astype(np.int64) * 86400
+
+    return labels, labels, ends
+
+
+def _get_utc_offsets(timestamps: np.ndarray, tz_id: str) -> np.ndarray:
+    tz = pytz.timezone(tz_id)
+    days, day_indexes = np.unique(timestamps // 86400, return_inverse=True)
+    day_offsets = np.array(
+        [
+            datetime.fromtimestamp(day * 86400 + 43200, tz).utcoffset().total_seconds()
+            for day in days.tolist()
+        ],
+        dtype=np.int64,
+    )
+
+    return day_offsets[day_indexes]
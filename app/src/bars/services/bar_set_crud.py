@@ -1,28 +1,77 @@
 from bars.models import BarSet, Timeframe
 from instruments.models import Instrument
+from common.cache import LRUCache
 from config.db import DB
+from config import settings
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
+from uuid import uuid4
+
+# Detached bar sets with loaded instruments, keyed by (instrument id, timeframe)
+_bar_set_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.METADATA_CACHE_TTL,
+    name='bar_set',
+)
 
 
 async def get_or_create_bar_set(
     db: DB, instrument: Instrument, timeframe: Timeframe
 ) -> BarSet:
-    try:
+    cache_key = (instrument.id, timeframe)
+    bar_set = _bar_set_cache.get(cache_key)
+
+    if bar_set is None:
         query = (
             select(BarSet)
-            .filter_by(instrument=instrument, timeframe=timeframe)
+            .filter_by(instrument_id=instrument.id, timeframe=timeframe)
             .options(joinedload('instrument'))
         )
-        bar_set = (await db.execute(query)).scalar_one()
 
-    except NoResultFound:
-        bar_set = BarSet(
-            instrument_id=instrument.id, instrument=instrument, timeframe=timeframe
-        )
-        db.add(bar_set)
+        try:
+            bar_set = (await db.execute(query)).scalar_one()
+
+        except NoResultFound:
+            # Concurrent creates of the same bar set end up with a single row
+            await db.execute(
+                insert(BarSet)
+                .values(id=uuid4(), instrument_id=instrument.id, timeframe=timeframe)
+                .on_conflict_do_nothing(index_elements=['instrument_id', 'timeframe'])
+            )
+            await db.commit()
 
-        await db.commit()
+            bar_set = (await db.execute(query)).scalar_one()
+
+        db.expunge(bar_set)
+        _bar_set_cache.set(cache_key, bar_set)
 
     return bar_set
+
+
+async def get_bar_sets(
+    db: DB, instruments: list[Instrument], timeframe: Timeframe
+) -> list[BarSet]:
+    bar_sets = {
+        instrument.id: _bar_set_cache.get((instrument.id, timeframe))
+        for instrument in instruments
+    }
+    missing_ids = [id for id, bar_set in bar_sets.items() if not bar_set]
+
+    # Bar sets missing in cache are loaded with a single query, none are created
+    if missing_ids:
+        query = (
+            select(BarSet)
+            .where(BarSet.instrument_id.in_(missing_ids))
+            .where(BarSet.timeframe == timeframe)
+            .options(joinedload('instrument'))
+        )
+
+        for bar_set in (await db.execute(query)).scalars().all():
+            db.expunge(bar_set)
+            _bar_set_cache.set((bar_set.instrument_id, timeframe), bar_set)
+            bar_sets[bar_set.instrument_id] = bar_set
+
+    return [bar_set for bar_set in bar_sets.values() if bar_set]
+
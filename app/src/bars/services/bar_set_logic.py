@@ -6,3 +6,18 @@ from . import bar_set_crud
 
 async def get_bar_set(db: DB, instrument: Instrument, timeframe: Timeframe) -> BarSet:
     return await bar_set_crud.get_or_create_bar_set(db, instrument, timeframe)
+
+
+async def get_group_bar_sets(
+    db: DB, instruments: list[Instrument], timeframe: Timeframe
+) -> list[BarSet]:
+    bar_sets = {
+        bar_set.instrument_id: bar_set
+        for bar_set in await bar_set_crud.get_bar_sets(db, instruments, timeframe)
+    }
+
+    return [
+        bar_sets.get(instrument.id)
+        or await bar_set_crud.get_or_create_bar_set(db, instrument, timeframe)
+        for instrument in instruments
+    ]
@@ -0,0 +1,173 @@
+from bars.models import BarSet, Bar, Timeframe
+from config.db import Session
+from config import settings
+from ib.connector import ib_connector
+from ib_insync import BarDataList, RequestError
+from uuid import UUID
+from datetime import datetime
+from dataclasses import dataclass, field
+from loguru import logger
+import asyncio
+from . import bar_crud
+
+_QUEUE_SIZE = 100
+
+
+@dataclass
+class _Subscription:
+    bar_set: BarSet
+    queues: set[asyncio.Queue] = field(default_factory=set)
+    origin_subscription: BarDataList | None = None
+    live_bar: Bar | None = None
+    streamed_since: datetime | None = None
+    started: asyncio.Task | None = None
+
+
+# One origin subscription per bar set, shared by all of its subscribers
+_subscriptions: dict[UUID, _Subscription] = {}
+# Saves of completed bars in flight, referenced until they are done
+_save_tasks: set[asyncio.Task] = set()
+
+
+async def subscribe_bars(bar_set: BarSet) -> asyncio.Queue:
+    if bar_set.timeframe in (Timeframe.WEEK, Timeframe.MONTH):
+        raise ValueError(f'Cannot stream bars for timeframe {bar_set.timeframe}')
+
+    subscription = _subscriptions.get(bar_set.id)
+    if not subscription:
+        subscription = _Subscription(bar_set=bar_set)
+        subscription.started = asyncio.create_task(_start_subscription(subscription))
+        _subscriptions[bar_set.id] = subscription
+
+    queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+    subscription.queues.add(queue)
+
+    try:
+        await asyncio.shield(subscription.started)
+
+    except BaseException:
+        unsubscribe_bars(bar_set, queue)
+        raise
+
+    if subscription.live_bar:
+        queue.put_nowait(subscription.live_bar)
+
+    return queue
+
+
+def unsubscribe_bars(bar_set: BarSet, queue: asyncio.Queue) -> None:
+    subscription = _subscriptions.get(bar_set.id)
+
+    if subscription:
+        subscription.queues.discard(queue)
+
+        if not subscription.queues:
+            del _subscriptions[bar_set.id]
+            subscription.started.cancel()
+
+            if subscription.origin_subscription:
+                ib_connector.unsubscribe_historical_bars(
+                    subscription.origin_subscription
+                )
+
+
+def get_live_bar(bar_set: BarSet) -> Bar | None:
+    subscription = _subscriptions.get(bar_set.id)
+
+    return subscription.live_bar if subscription else None
+
+
+def get_streamed_since(bar_set: BarSet) -> datetime | None:
+    subscription = _subscriptions.get(bar_set.id)
+
+    return subscription.streamed_since if subscription else None
+
+
+async def _start_subscription(subscription: _Subscription) -> None:
+    bar_set = subscription.bar_set
+    instrument = bar_set.instrument
+
+    origin_subscription, bars = await ib_connector.subscribe_historical_bars(
+        bar_set,
+        lambda bars, has_new_bar: _on_update(subscription, bars, has_new_bar),
+        lambda: _on_lost(subscription),
+    )
+    subscription.origin_subscription = origin_subscription
+
+    logger.debug(
+        f'Subscribed to origin bars. '
+        f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}'
+    )
+
+    if bars:
+        subscription.live_bar = bars[-1]
+        subscription.streamed_since = bars[0].timestamp
+
+        await _save_completed_bars(bar_set, bars[:-1])
+
+
+async def _restart_subscription(subscription: _Subscription) -> None:
+    bar_set = subscription.bar_set
+    instrument = bar_set.instrument
+    delay = settings.IB_RECONNECT_MIN_DELAY
+
+    # Connecting again is left to the next start once stopping
+    while not ib_connector.is_stopping:
+        try:
+            await _start_subscription(subscription)
+            return
+
+        except (OSError, asyncio.TimeoutError, RequestError) as error:
+            logger.warning(
+                f'Subscribing to origin bars failed. '
+                f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}, '
+                f'retrying in {delay}s, {error!r}'
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.IB_RECONNECT_MAX_DELAY)
+
+
+def _on_lost(subscription: _Subscription) -> None:
+    # Bars streamed before the disconnect are stale, so bars are read from
+    # history until the subscription is restarted
+    subscription.origin_subscription = None
+    subscription.live_bar = None
+    subscription.streamed_since = None
+
+    if _subscriptions.get(subscription.bar_set.id) is subscription:
+        subscription.started = asyncio.create_task(
+            _restart_subscription(subscription)
+        )
+
+
+def _on_update(subscription: _Subscription, bars: list[Bar], has_new_bar: bool) -> None:
+    live_bar = bars[-1]
+    subscription.live_bar = live_bar
+
+    if has_new_bar and len(bars) > 1:
+        bar_set = subscription.bar_set
+        save_task = asyncio.create_task(_save_completed_bars(bar_set, bars[:-1]))
+        _save_tasks.add(save_task)
+        save_task.add_done_callback(lambda task: _on_save_done(task, bar_set))
+
+    for queue in subscription.queues:
+        # Slow subscribers only need the latest state of the bar
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(live_bar)
+
+
+async def _save_completed_bars(bar_set: BarSet, bars: list[Bar]) -> None:
+    async with Session() as db:
+        await bar_crud.bulk_save_bars(db, bar_set, bars, is_synced=True)
+
+
+def _on_save_done(save_task: asyncio.Task, bar_set: BarSet) -> None:
+    _save_tasks.discard(save_task)
+
+    if not save_task.cancelled() and save_task.exception():
+        instrument = bar_set.instrument
+        logger.opt(exception=save_task.exception()).error(
+            f'Saving streamed bars failed. '
+            f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}'
+        )
@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Query, Depends
+from fastapi import APIRouter, Query, Depends, Request, WebSocket
 from config.db import DB, get_db
+from common.utils import cancel_on_disconnect
+from common.responses import negotiate_response
+from common import metrics
 from .schemas import History, Info, SearchResult, Config
 from . import services
 
@@ -8,16 +11,51 @@ chart_router = APIRouter(tags=['Charts'])
 
 @chart_router.get('/history', response_model=History)
 async def get_history(
+    request: Request,
     symbol: str,
     resolution: str,
     from_: int = Query(..., alias='from'),
     to: int = ...,
     db: DB = Depends(get_db),
 ):
-    if resolution == '1D':
-        resolution = 'D'
+    if resolution in ('1D', '1W', '1M'):
+        resolution = resolution[1:]
 
-    return await services.get_history(db, symbol, resolution, from_, to)
+    # Stop origin requests nobody is waiting for any more
+    history = await cancel_on_disconnect(
+        request, services.get_history(db, symbol, resolution, from_, to)
+    )
+
+    with metrics.STAGE_DURATION.labels('serialize').time():
+        return negotiate_response(request, history)
+
+
+@chart_router.get('/group_history', response_model=dict[str, History])
+async def get_group_history(
+    request: Request,
+    symbols: str,
+    resolution: str,
+    from_: int = Query(..., alias='from'),
+    to: int = ...,
+    db: DB = Depends(get_db),
+):
+    if resolution in ('1D', '1W', '1M'):
+        resolution = resolution[1:]
+
+    # Tickers are comma separated, as in TradingView symbol lists
+    tickers = list(dict.fromkeys(symbol for symbol in symbols.split(',') if symbol))
+    history = await cancel_on_disconnect(
+        request, services.get_group_history(db, tickers, resolution, from_, to)
+    )
+
+    with metrics.STAGE_DURATION.labels('serialize').time():
+        return negotiate_response(request, history)
+
+
+@chart_router.websocket('/stream')
+async def stream_bars(websocket: WebSocket):
+    await websocket.accept()
+    await services.stream_bars(websocket)
 
 
 @chart_router.get('/symbols', response_model=Info)
@@ -26,8 +64,8 @@ async def get_info(symbol: str, db: DB = Depends(get_db)):
 
 
 @chart_router.get('/search', response_model=list[SearchResult])
-async def get_search_results(query: str):
-    return await services.get_search_results(query)
+async def get_search_results(query: str, db: DB = Depends(get_db)):
+    return await services.get_search_results(db, query)
 
 
 @chart_router.get('/config', response_model=Config)
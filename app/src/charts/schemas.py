@@ -10,9 +10,25 @@ class History(BaseModel):
     v: list[int] = []
     t: list[int] = []
     s: str = 'no_data'
+    errmsg: str | None = None
     nextTime: int | None = None
 
 
+class StreamBar(BaseModel):
+    time: int
+    open: Decimal
+    high: Decimal
+    low: Decimal
+    close: Decimal
+    volume: int
+
+
+class StreamMessage(BaseModel):
+    subscriberUID: str
+    bar: StreamBar | None = None
+    error: str | None = None
+
+
 class Info(BaseModel):
     name: str
     ticker: str
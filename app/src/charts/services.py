@@ -1,25 +1,36 @@
-from .schemas import History, Info, SearchResult, Config
-from config.db import DB
-from bars.models import Timeframe
+from fastapi import WebSocket, WebSocketDisconnect
+from .schemas import History, Info, SearchResult, Config, StreamBar, StreamMessage
+from config.db import DB, Session
+from bars.models import BarSet, Bar, Timeframe
 from common.schemas import Interval
+from common.utils import decode_price, decode_prices
+from common import metrics
 from bars import services as bar_services
 from instruments.models import Exchange, InstrumentType
+from instruments.exceptions import InstrumentNotFoundError
 from instruments import services as instrument_services
 from datetime import datetime
+from decimal import Decimal
+from typing import Any
 from loguru import logger
+import asyncio
+import numpy as np
 import pytz
 
 
 async def get_history(
     db: DB, ticker: str, timeframe: str, from_t: int, to_t: int
-) -> History:
-    history = History()
+) -> dict[str, Any]:
     bars = []
     next_time = 0
 
     try:
-        instrument = await instrument_services.get_saved_instrument(db, ticker)
-        bar_set = await bar_services.get_bar_set(db, instrument, Timeframe(timeframe))
+        with metrics.STAGE_DURATION.labels('metadata').time():
+            instrument = await instrument_services.get_saved_instrument(db, ticker)
+            bar_set = await bar_services.get_bar_set(
+                db, instrument, Timeframe(timeframe)
+            )
+        bar_services.record_usage(bar_set)
 
         start = datetime.fromtimestamp(from_t, pytz.utc)
         end = datetime.fromtimestamp(to_t, pytz.utc)
@@ -32,20 +43,102 @@ async def get_history(
     except ConnectionRefusedError as error:
         logger.error(error)
 
-    for bar in bars:
-        history.o.append(bar.open)
-        history.h.append(bar.high)
-        history.l.append(bar.low)
-        history.c.append(bar.close)
-        history.v.append(bar.volume)
-        history.t.append(int(bar.timestamp.timestamp()))
+    if not bars:
+        return History(nextTime=next_time if next_time > 0 else None).dict()
+
+    return _bars_to_history(bars, instrument.tick_size, next_time)
+
+
+async def get_group_history(
+    db: DB, tickers: list[str], timeframe: str, from_t: int, to_t: int
+) -> dict[str, dict[str, Any]]:
+    group_history = {ticker: History().dict() for ticker in tickers}
+
+    try:
+        with metrics.STAGE_DURATION.labels('metadata').time():
+            # Known instruments and their bar sets are resolved with batched
+            # queries, only unknown ones are looked up one by one
+            instruments = {
+                f'{instrument.exchange.value}:{instrument.symbol}': instrument
+                for instrument in await instrument_services.get_saved_instruments(
+                    db, tickers
+                )
+            }
+            for ticker in tickers:
+                if ticker not in instruments:
+                    # Tickers that can't be resolved fail alone
+                    try:
+                        instrument = await instrument_services.get_saved_instrument(
+                            db, ticker
+                        )
+                        instruments[ticker] = instrument
+
+                    except (
+                        ConnectionRefusedError,
+                        InstrumentNotFoundError,
+                        ValueError,
+                    ) as error:
+                        logger.error(error)
+                        group_history[ticker] = History(
+                            s='error', errmsg=f'Cannot resolve {ticker}'
+                        ).dict()
+
+            tickers = [ticker for ticker in tickers if ticker in instruments]
+            bar_sets = await bar_services.get_group_bar_sets(
+                db, [instruments[ticker] for ticker in tickers], Timeframe(timeframe)
+            )
+
+        for bar_set in bar_sets:
+            bar_services.record_usage(bar_set)
+
+        start = datetime.fromtimestamp(from_t, pytz.utc)
+        end = datetime.fromtimestamp(to_t, pytz.utc)
+        interval = Interval(start=start, end=end)
+        group_bars = await bar_services.get_group_historical_bars(
+            db, bar_sets, interval
+        )
+
+        for ticker, bar_set in zip(tickers, bar_sets):
+            latest_ts = await bar_services.get_latest_timestamp(db, bar_set)
+            group_history[ticker] = _bars_to_history(
+                group_bars[bar_set.id],
+                bar_set.instrument.tick_size,
+                int(latest_ts.timestamp()),
+            )
+
+    except ConnectionRefusedError as error:
+        logger.error(error)
+
+    return group_history
+
+
+async def stream_bars(websocket: WebSocket) -> None:
+    forwarders: dict[str, asyncio.Task] = {}
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            subscriber_uid = str(message.get('subscriberUID'))
+
+            if message.get('type') == 'subscribe' and subscriber_uid not in forwarders:
+                forwarders[subscriber_uid] = asyncio.create_task(
+                    _forward_bars(
+                        websocket,
+                        subscriber_uid,
+                        message.get('symbol', ''),
+                        message.get('resolution', ''),
+                    )
+                )
 
-    if bars:
-        history.s = 'ok'
-    elif next_time > 0:
-        history.nextTime = next_time
+            elif message.get('type') == 'unsubscribe' and subscriber_uid in forwarders:
+                forwarders.pop(subscriber_uid).cancel()
 
-    return history
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        for forwarder in forwarders.values():
+            forwarder.cancel()
 
 
 async def get_info(db: DB, ticker: str) -> Info:
@@ -73,9 +166,9 @@ async def get_info(db: DB, ticker: str) -> Info:
     return info
 
 
-async def get_search_results(search: str) -> list[SearchResult]:
+async def get_search_results(db: DB, search: str) -> list[SearchResult]:
     results = []
-    instruments = await instrument_services.search_broker_instruments(search)
+    instruments = await instrument_services.search_instruments(db, search)
 
     for instrument in instruments:
         ticker = f'{instrument.exchange}:{instrument.symbol}'
@@ -93,8 +186,11 @@ async def get_search_results(search: str) -> list[SearchResult]:
 
 
 def get_config() -> Config:
+    # Group requests of UDF are about symbol info, resolved from /symbol_info
+    # instead of /symbols and /search. Group history is requested by clients
+    # of /group_history directly, so it stays off
     return Config(
-        supported_resolutions=['1', '5', '30', '60', '1D'],
+        supported_resolutions=['1', '5', '15', '30', '60', '1D', '1W', '1M'],
         supports_search=True,
         supports_group_request=False,
         supports_marks=False,
@@ -102,6 +198,82 @@ def get_config() -> Config:
     )
 
 
+async def _forward_bars(
+    websocket: WebSocket, subscriber_uid: str, ticker: str, resolution: str
+) -> None:
+    if resolution in ('1D', '1W', '1M'):
+        resolution = resolution[1:]
+
+    try:
+        # Session must not outlive the lookup, the stream can last for hours
+        async with Session() as db:
+            instrument = await instrument_services.get_saved_instrument(db, ticker)
+            bar_set = await bar_services.get_bar_set(
+                db, instrument, Timeframe(resolution)
+            )
+
+        queue = await bar_services.subscribe_bars(bar_set)
+
+    except (ConnectionRefusedError, ValueError) as error:
+        logger.error(error)
+        message = StreamMessage(subscriberUID=subscriber_uid, error=str(error))
+        await websocket.send_text(message.json())
+        return
+
+    try:
+        while True:
+            bar = await queue.get()
+            message = StreamMessage(
+                subscriberUID=subscriber_uid, bar=_bar_to_stream(bar_set, bar)
+            )
+            await websocket.send_text(message.json())
+
+    finally:
+        bar_services.unsubscribe_bars(bar_set, queue)
+
+
+def _bars_to_history(
+    bars: list[Bar], tick_size: Decimal, next_time: int
+) -> dict[str, Any]:
+    if not bars:
+        return History(nextTime=next_time if next_time > 0 else None).dict()
+
+    # Columns are built in one pass and serialized as arrays, skipping
+    # per value validation of the History model
+    prices = np.array(
+        [(bar.open, bar.high, bar.low, bar.close) for bar in bars], dtype=np.float64
+    )
+    opens, highs, lows, closes = np.ascontiguousarray(
+        decode_prices(prices, tick_size).T
+    )
+
+    return {
+        'o': opens,
+        'h': highs,
+        'l': lows,
+        'c': closes,
+        'v': np.fromiter((bar.volume for bar in bars), np.int64, len(bars)),
+        't': np.fromiter(
+            (bar.timestamp.timestamp() for bar in bars), np.int64, len(bars)
+        ),
+        's': 'ok',
+        'nextTime': None,
+    }
+
+
+def _bar_to_stream(bar_set: BarSet, bar: Bar) -> StreamBar:
+    tick_size = bar_set.instrument.tick_size
+
+    return StreamBar(
+        time=int(bar.timestamp.timestamp()) * 1000,
+        open=decode_price(bar.open, tick_size),
+        high=decode_price(bar.high, tick_size),
+        low=decode_price(bar.low, tick_size),
+        close=decode_price(bar.close, tick_size),
+        volume=bar.volume,
+    )
+
+
 def _instrument_type_to_chart(type: InstrumentType) -> str:
     if type == InstrumentType.STOCK:
         instrument_type = 'stock'
@@ -114,16 +286,8 @@ def _instrument_type_to_chart(type: InstrumentType) -> str:
 
 
 def _exchange_schedule_to_chart(exchange: Exchange) -> tuple[str, str]:
-    if exchange in (Exchange.NASDAQ, Exchange.NYSE):
-        tz_id = 'America/New_York'
-        session = '0930-1600'
-    elif exchange == Exchange.NYMEX:
-        tz_id = 'America/New_York'
-        session = '1800-1700'
-    elif exchange in (Exchange.GLOBEX, Exchange.ECBOT):
-        tz_id = 'America/Chicago'
-        session = '1700-1600'
-    else:
-        raise ValueError(f'Cannot get schedule for exchange {exchange}')
+    tz_id, session_open, session_close = instrument_services.get_exchange_schedule(
+        exchange
+    )
 
-    return tz_id, session
+    return tz_id, f'{session_open:%H%M}-{session_close:%H%M}'
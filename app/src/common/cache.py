@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+from .metrics import CACHE_REQUESTS
+import time
+
+
+class LRUCache:
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        size_of: Callable[[Any], int] = lambda _: 1,
+        name: str | None = None,
+    ):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._size_of = size_of
+        self._entries: OrderedDict[Hashable, tuple[Any, int, float]] = OrderedDict()
+        self._size = 0
+        self._hits = CACHE_REQUESTS.labels(name, 'hit') if name else None
+        self._misses = CACHE_REQUESTS.labels(name, 'miss') if name else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[2] <= time.monotonic():
+            self.delete(key)
+            entry = None
+
+        if entry is None:
+            if self._misses:
+                self._misses.inc()
+            return default
+
+        if self._hits:
+            self._hits.inc()
+        self._entries.move_to_end(key)
+
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.delete(key)
+
+        size = self._size_of(value)
+        if size > self._max_size:
+            return
+
+        self._entries[key] = (value, size, time.monotonic() + self._ttl)
+        self._size += size
+
+        while self._size > self._max_size:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    def delete(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._size -= entry[1]
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        keys = [key for key in self._entries if predicate(key)]
+
+        for key in keys:
+            self.delete(key)
+
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
@@ -0,0 +1,70 @@
+from .schemas import Interval
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+
+# Sorted disjoint intervals, neighbours closer than gap are merged on insertion
+class IntervalIndex:
+    def __init__(self, intervals: Iterable = (), gap: timedelta = timedelta(0)):
+        self._gap = gap
+        self._starts: list[datetime] = []
+        self._ends: list[datetime] = []
+
+        for interval in sorted(intervals, key=lambda interval: interval.start):
+            self.add(interval.start, interval.end)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self) -> Iterator[Interval]:
+        for start, end in zip(self._starts, self._ends):
+            yield Interval(start=start, end=end)
+
+    def add(self, start: datetime, end: datetime) -> Interval:
+        lo = bisect_left(self._ends, start - self._gap)
+        hi = bisect_right(self._starts, end + self._gap)
+
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+            del self._starts[lo:hi]
+            del self._ends[lo:hi]
+
+        self._starts.insert(lo, start)
+        self._ends.insert(lo, end)
+
+        return Interval(start=start, end=end)
+
+    def covers(self, interval: Interval) -> bool:
+        index = bisect_right(self._starts, interval.start) - 1
+
+        return index >= 0 and self._ends[index] >= interval.end
+
+    def overlapping(self, interval: Interval) -> list[Interval]:
+        overlapping = []
+
+        for index in range(bisect_right(self._ends, interval.start), len(self)):
+            if self._starts[index] >= interval.end:
+                break
+
+            overlapping.append(
+                Interval(start=self._starts[index], end=self._ends[index])
+            )
+
+        return overlapping
+
+    def missing(self, within: Interval) -> list[Interval]:
+        missing = []
+        next_start = within.start
+
+        for interval in self.overlapping(within):
+            if interval.start > next_start:
+                missing.append(Interval(start=next_start, end=interval.start))
+
+            next_start = max(next_start, interval.end)
+
+        if next_start < within.end:
+            missing.append(Interval(start=next_start, end=within.end))
+
+        return missing
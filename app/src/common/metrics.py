@@ -0,0 +1,56 @@
+from prometheus_client import Counter, Gauge, Histogram
+from config.db import engine
+
+# Stages of serving history, from metadata lookups to serialization
+STAGE_DURATION = Histogram(
+    'mdc_stage_duration_seconds',
+    'Duration of history pipeline stages',
+    ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+# Results are hit, miss, and partial for ranges that are cached in part
+CACHE_REQUESTS = Counter(
+    'mdc_cache_requests_total', 'Cache lookups by result', ['cache', 'result']
+)
+
+IB_REQUESTS = Counter(
+    'mdc_ib_requests_total', 'Requests to IB by type and status', ['type', 'status']
+)
+IB_REQUEST_DURATION = Histogram(
+    'mdc_ib_request_duration_seconds',
+    'Duration of requests to IB, excluding pacing waits',
+    ['type'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+IB_PACING_WAIT = Histogram(
+    'mdc_ib_pacing_wait_seconds',
+    'Time historical data requests are queued by the scheduler',
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600),
+)
+IB_CONNECTED_CLIENTS = Gauge(
+    'mdc_ib_connected_clients', 'Connected IB clients by lane', ['lane']
+)
+IB_QUEUED_REQUESTS = Gauge(
+    'mdc_ib_queued_requests', 'Historical data requests waiting in the scheduler'
+)
+
+# Rate of bars ingested per second is rate(bars) / rate(duration sum)
+BARS_INGESTED = Counter(
+    'mdc_bars_ingested_total', 'Bars saved by ingests', ['timeframe']
+)
+BAR_INGEST_DURATION = Histogram(
+    'mdc_bar_ingest_duration_seconds', 'Duration of saving a batch of bars'
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    'mdc_db_pool_connections', 'Connections of the database pool by state', ['state']
+)
+DB_POOL_CONNECTIONS.labels('checked_out').set_function(
+    lambda: engine.pool.checkedout()
+)
+DB_POOL_CONNECTIONS.labels('checked_in').set_function(lambda: engine.pool.checkedin())
+# Pool reports overflow as negative until its base size is reached
+DB_POOL_CONNECTIONS.labels('overflow').set_function(
+    lambda: max(engine.pool.overflow(), 0)
+)
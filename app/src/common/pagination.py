@@ -0,0 +1,100 @@
+from pydantic.generics import GenericModel
+from config.db import DB
+from sqlalchemy import Column, func, tuple_
+from sqlalchemy.future import select
+from sqlalchemy.sql import Select
+from typing import Any, Generic, TypeVar
+import base64
+import enum
+import json
+
+T = TypeVar('T')
+
+
+class CountStrategy(enum.Enum):
+    NONE = 'none'
+    ESTIMATED = 'estimated'
+    EXACT = 'exact'
+
+
+class KeysetPage(GenericModel, Generic[T]):
+    items: list[T]
+    # Passed as cursor to get the next page, none on the last page
+    next_cursor: str | None
+    total: int | None
+
+
+async def paginate(
+    db: DB,
+    query: Select,
+    keys: list[Column],
+    limit: int,
+    cursor: str | None = None,
+    count: CountStrategy = CountStrategy.NONE,
+) -> KeysetPage:
+    # Keys have to be unique together, rows after the cursor are read from
+    # the index over them instead of skipping the previous pages
+    total = await _count(db, query, count)
+    page_query = query.order_by(*keys).limit(limit + 1)
+
+    if cursor:
+        page_query = page_query.where(
+            tuple_(*keys) > tuple_(*_decode_cursor(cursor, keys))
+        )
+
+    items = (await db.execute(page_query)).scalars().all()
+    next_cursor = None
+
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = _encode_cursor([getattr(items[-1], key.key) for key in keys])
+
+    return KeysetPage(items=items, next_cursor=next_cursor, total=total)
+
+
+async def _count(db: DB, query: Select, count: CountStrategy) -> int | None:
+    total = None
+
+    if count == CountStrategy.EXACT:
+        total = (
+            await db.execute(select(func.count()).select_from(query.subquery()))
+        ).scalar()
+
+    # Planner estimate costs no scan, but may be far off for selective filters
+    elif count == CountStrategy.ESTIMATED:
+        connection = await db.connection()
+        compiled = query.compile(
+            dialect=connection.dialect, compile_kwargs={'literal_binds': True}
+        )
+        plan = (
+            await connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}')
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        total = int(plan[0]['Plan']['Plan Rows'])
+
+    return total
+
+
+def _encode_cursor(values: list[Any]) -> str:
+    values = [
+        value.value if isinstance(value, enum.Enum) else value for value in values
+    ]
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, keys: list[Column]) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError as error:
+        raise ValueError(f'Invalid cursor {cursor}') from error
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError(f'Invalid cursor {cursor}')
+
+    # Enum columns get members back, other values are used as decoded
+    return [
+        key.type.enum_class(value) if getattr(key.type, 'enum_class', None) else value
+        for key, value in zip(keys, values)
+    ]
@@ -0,0 +1,38 @@
+from fastapi import Request
+from fastapi.responses import Response
+from typing import Any
+import msgpack
+import numpy as np
+import orjson
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+class ORJSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=_to_builtin)
+
+
+def negotiate_response(request: Request, content: Any) -> Response:
+    accept = request.headers.get('accept', '')
+
+    if MSGPACK_MEDIA_TYPE in accept or 'application/x-msgpack' in accept:
+        return MsgPackResponse(content)
+
+    return ORJSONResponse(content)
+
+
+def _to_builtin(value: Any) -> Any:
+    if isinstance(value, np.ndarray | np.generic):
+        return value.tolist()
+
+    raise TypeError(f'Cannot serialize {type(value)}')
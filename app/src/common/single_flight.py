@@ -0,0 +1,45 @@
+from typing import Any, Awaitable, Callable, Hashable
+from dataclasses import dataclass
+import asyncio
+
+
+@dataclass
+class _Call:
+    task: asyncio.Task
+    waiter_count: int = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+
+    def keys(self) -> list[Hashable]:
+        return list(self._calls)
+
+    def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Awaitable[Any]:
+        call = self._calls.get(key)
+
+        if call is None:
+            call = _Call(task=asyncio.create_task(func()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._calls[key] = call
+
+        call.waiter_count += 1
+
+        return self._wait(call)
+
+    async def _wait(self, call: _Call) -> Any:
+        try:
+            # Waiter cancellation must not cancel the call shared with other waiters
+            return await asyncio.shield(call.task)
+
+        finally:
+            call.waiter_count -= 1
+
+            # Nobody is interested in the result any more
+            if not call.waiter_count and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -1,5 +1,57 @@
+from fastapi import Request
+from config import settings
+from typing import Any, Coroutine
 from decimal import Decimal, ROUND_HALF_UP
+import asyncio
+import numpy as np
 
 
 def round_with_quantum(number: Decimal, quantum: Decimal) -> Decimal:
     return quantum * (number / quantum).quantize(Decimal('1.'), ROUND_HALF_UP)
+
+
+def price_to_ticks(price: Decimal, tick_size: Decimal) -> int:
+    return int((price / tick_size).quantize(Decimal('1.'), ROUND_HALF_UP))
+
+
+def encode_price(price: Decimal, tick_size: Decimal) -> Decimal | int:
+    if settings.BAR_PRICES_IN_TICKS:
+        stored_price = price_to_ticks(price, tick_size)
+    else:
+        stored_price = round_with_quantum(price, tick_size)
+
+    return stored_price
+
+
+def decode_price(stored_price: Decimal | int, tick_size: Decimal) -> Decimal:
+    if settings.BAR_PRICES_IN_TICKS:
+        price = stored_price * tick_size
+    else:
+        price = stored_price
+
+    return price
+
+
+def decode_prices(stored_prices: np.ndarray, tick_size: Decimal) -> np.ndarray:
+    prices = stored_prices.astype(np.float64)
+
+    if settings.BAR_PRICES_IN_TICKS:
+        # Rounding to tick precision removes float noise of the multiplication
+        decimals = max(-tick_size.normalize().as_tuple().exponent, 0)
+        prices = np.round(prices * float(tick_size), decimals)
+
+    return prices
+
+
+async def cancel_on_disconnect(
+    request: Request, coroutine: Coroutine, poll_interval: float = 1.0
+) -> Any:
+    task = asyncio.create_task(coroutine)
+
+    while not task.done():
+        await asyncio.wait({task}, timeout=poll_interval)
+
+        if not task.done() and await request.is_disconnected():
+            task.cancel()
+
+    return await task
@@ -1,13 +1,23 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import text
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
-from .settings import DB_URL
+from loguru import logger
+from typing import Awaitable, Callable, Iterable
+import asyncio
+from . import settings
 
-engine = create_async_engine(DB_URL)
+engine = create_async_engine(settings.DB_URL)
 Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 DB = AsyncSession
 
+# Bars of the table used before partitioning are moved in background, reads
+# include its bars until it's done
+_is_migrating_bars = False
+_bar_migrator: asyncio.Task | None = None
+
 
 async def get_db():
     async with Session() as session:
@@ -15,5 +25,364 @@ async def get_db():
 
 
 async def init_db():
+    global _is_migrating_bars
+
     async with engine.begin() as conn:
+        await conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
         await conn.run_sync(SQLModel.metadata.create_all)
+        await _partition_bars(conn)
+        await _add_bar_set_coverage(conn)
+        await _add_unique_constraint(
+            conn, 'barset', ['instrument_id', 'timeframe'], _merge_duplicate_bar_sets
+        )
+        await _add_unique_constraint(
+            conn,
+            'tradingsession',
+            ['instrument_id', 'start'],
+            _delete_duplicate_trading_sessions,
+        )
+        # Instruments used to have a single trading session
+        await conn.execute(
+            text(
+                'ALTER TABLE tradingsession '
+                'DROP CONSTRAINT IF EXISTS tradingsession_instrument_id_key'
+            )
+        )
+        await conn.execute(
+            text(
+                'ALTER TABLE barinterval '
+                'ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE'
+            )
+        )
+        await conn.execute(
+            text(
+                'CREATE INDEX IF NOT EXISTS ix_barinterval_bar_set_id_start '
+                'ON barinterval (bar_set_id, start)'
+            )
+        )
+        # Search indexes of instruments created before them
+        await conn.run_sync(_create_indexes, 'instrument')
+
+        _is_migrating_bars = (
+            await conn.execute(
+                text("SELECT to_regclass('bar_unpartitioned') IS NOT NULL")
+            )
+        ).scalar()
+
+
+def is_migrating_bars() -> bool:
+    return _is_migrating_bars
+
+
+def start_bar_migrator() -> None:
+    global _bar_migrator
+
+    if _is_migrating_bars and (not _bar_migrator or _bar_migrator.done()):
+        _bar_migrator = asyncio.create_task(_run_bar_migrator())
+
+
+def stop_bar_migrator() -> None:
+    if _bar_migrator:
+        _bar_migrator.cancel()
+
+
+async def create_bar_partitions(
+    connection: AsyncConnection | AsyncSession, years: Iterable[int]
+) -> None:
+    for year in years:
+        await connection.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS bar_y{year} PARTITION OF bar '
+                f"FOR VALUES FROM ('{year}-01-01 00:00:00+00') "
+                f"TO ('{year + 1}-01-01 00:00:00+00')"
+            )
+        )
+
+
+async def _run_bar_migrator() -> None:
+    try:
+        await _migrate_bars()
+
+    except Exception as error:
+        logger.opt(exception=error).error('Moving bars to partitions failed')
+
+
+async def _migrate_bars() -> None:
+    global _is_migrating_bars
+
+    # Bars are moved in batches, each in its own transaction, so an interrupted
+    # migration resumes where it stopped
+    async with engine.begin() as conn:
+        first_year, last_year = (
+            await conn.execute(
+                text(
+                    "SELECT extract(year FROM min(timestamp) AT TIME ZONE 'UTC'), "
+                    "extract(year FROM max(timestamp) AT TIME ZONE 'UTC') "
+                    'FROM bar_unpartitioned'
+                )
+            )
+        ).one()
+        if first_year is not None:
+            await create_bar_partitions(
+                conn, range(int(first_year), int(last_year) + 1)
+            )
+
+    logger.info('Moving bars to partitions, it can take a while')
+
+    moved_count = settings.BAR_MIGRATION_BATCH_SIZE
+    while moved_count == settings.BAR_MIGRATION_BATCH_SIZE:
+        async with engine.begin() as conn:
+            moved_count = (
+                await conn.execute(
+                    text(
+                        'WITH moved AS ('
+                        'DELETE FROM bar_unpartitioned WHERE id IN ('
+                        'SELECT id FROM bar_unpartitioned ORDER BY id LIMIT :limit'
+                        ') RETURNING *'
+                        '), inserted AS ('
+                        'INSERT INTO bar '
+                        '(id, bar_set_id, open, high, low, close, volume, timestamp) '
+                        'SELECT id, bar_set_id, open, high, low, close, volume, '
+                        'timestamp FROM moved ON CONFLICT DO NOTHING'
+                        ') SELECT count(*) FROM moved'
+                    ),
+                    {'limit': settings.BAR_MIGRATION_BATCH_SIZE},
+                )
+            ).scalar()
+
+    # Reads stop including the old table, which has no bars left
+    _is_migrating_bars = False
+
+    # Coverage computed while bars were being moved is computed again
+    async with engine.begin() as conn:
+        await _compute_bar_set_coverage(conn, 'SELECT id FROM barset')
+        await conn.execute(text('DROP TABLE bar_unpartitioned'))
+
+    logger.info('Moved bars to partitions')
+
+
+async def _partition_bars(conn: AsyncConnection) -> None:
+    # Bars used to be saved in a single table, which is replaced by yearly
+    # partitions once. Its bars are moved by the bar migrator
+    is_partitioned = (
+        await conn.execute(
+            text(
+                "SELECT relkind = 'p' FROM pg_class "
+                "WHERE relname = 'bar' AND relnamespace = 'public'::regnamespace"
+            )
+        )
+    ).scalar()
+
+    if is_partitioned:
+        return
+
+    # Names of indexes are unique in a schema, so the ones of the old table
+    # are renamed before the partitioned table is created. Batches are taken
+    # in order of the primary key, reads use the unique index
+    await conn.execute(text('ALTER TABLE bar RENAME TO bar_unpartitioned'))
+    await conn.execute(
+        text(
+            'ALTER TABLE bar_unpartitioned '
+            'RENAME CONSTRAINT bar_pkey TO bar_unpartitioned_pkey'
+        )
+    )
+    await conn.execute(
+        text(
+            'ALTER TABLE bar_unpartitioned RENAME CONSTRAINT '
+            'bar_bar_set_id_timestamp_key TO bar_unpartitioned_bar_set_id_timestamp_key'
+        )
+    )
+    await conn.run_sync(SQLModel.metadata.create_all)
+
+
+async def _add_bar_set_coverage(conn: AsyncConnection) -> None:
+    # Bar sets created before coverage was tracked get it computed once
+    is_added = (
+        await conn.execute(
+            text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'barset' AND column_name = 'bar_count'"
+            )
+        )
+    ).scalar()
+
+    if not is_added:
+        await conn.execute(
+            text(
+                'ALTER TABLE barset '
+                'ADD COLUMN earliest_timestamp TIMESTAMP WITH TIME ZONE, '
+                'ADD COLUMN latest_timestamp TIMESTAMP WITH TIME ZONE, '
+                'ADD COLUMN bar_count BIGINT NOT NULL DEFAULT 0, '
+                'ADD COLUMN synced_at TIMESTAMP WITH TIME ZONE'
+            )
+        )
+        await _compute_bar_set_coverage(conn, 'SELECT id FROM barset')
+
+
+async def _compute_bar_set_coverage(conn: AsyncConnection, bar_set_ids: str) -> None:
+    await conn.execute(
+        text(
+            'UPDATE barset SET '
+            'earliest_timestamp = coverage.earliest_timestamp, '
+            'latest_timestamp = coverage.latest_timestamp, '
+            'bar_count = coverage.bar_count '
+            'FROM ('
+            'SELECT bar_set_id, min(timestamp) AS earliest_timestamp, '
+            'max(timestamp) AS latest_timestamp, count(*) AS bar_count '
+            f'FROM bar WHERE bar_set_id IN ({bar_set_ids}) GROUP BY bar_set_id'
+            ') AS coverage '
+            'WHERE barset.id = coverage.bar_set_id'
+        )
+    )
+
+
+async def _merge_duplicate_bar_sets(conn: AsyncConnection) -> None:
+    # Bar sets created concurrently before the unique constraint are merged
+    # into the one with most bars
+    await conn.execute(
+        text(
+            'CREATE TEMP TABLE barset_duplicate ON COMMIT DROP AS '
+            'SELECT id, survivor_id FROM ('
+            'SELECT id, first_value(id) OVER ('
+            'PARTITION BY instrument_id, timeframe ORDER BY bar_count DESC, id'
+            ') AS survivor_id FROM barset'
+            ') AS ranked WHERE id != survivor_id'
+        )
+    )
+    duplicate_count = (
+        await conn.execute(text('SELECT count(*) FROM barset_duplicate'))
+    ).scalar()
+
+    if not duplicate_count:
+        return
+
+    logger.info(f'Merging {duplicate_count} duplicate bar sets')
+
+    # Bars are copied with new ids, the survivor keeps its own bar of a timestamp
+    await conn.execute(
+        text(
+            'INSERT INTO bar '
+            '(id, bar_set_id, open, high, low, close, volume, timestamp) '
+            'SELECT gen_random_uuid(), barset_duplicate.survivor_id, '
+            'open, high, low, close, volume, timestamp '
+            'FROM bar JOIN barset_duplicate ON bar.bar_set_id = barset_duplicate.id '
+            'ON CONFLICT DO NOTHING'
+        )
+    )
+    await conn.execute(
+        text(
+            'UPDATE barinterval SET bar_set_id = barset_duplicate.survivor_id '
+            'FROM barset_duplicate WHERE barinterval.bar_set_id = barset_duplicate.id'
+        )
+    )
+
+    # One indicator series of a type and length is kept, preferring the
+    # survivor's own, and it's computed again from the merged bars
+    await conn.execute(
+        text(
+            'DELETE FROM indicatorseries WHERE id IN ('
+            'SELECT id FROM ('
+            'SELECT indicatorseries.id, row_number() OVER ('
+            'PARTITION BY coalesce(barset_duplicate.survivor_id, bar_set_id), '
+            'type, length '
+            'ORDER BY barset_duplicate.id IS NOT NULL, indicatorseries.id'
+            ') AS rank '
+            'FROM indicatorseries LEFT JOIN barset_duplicate '
+            'ON indicatorseries.bar_set_id = barset_duplicate.id'
+            ') AS ranked WHERE rank > 1'
+            ')'
+        )
+    )
+    await conn.execute(
+        text(
+            'UPDATE indicatorseries SET bar_set_id = barset_duplicate.survivor_id '
+            'FROM barset_duplicate '
+            'WHERE indicatorseries.bar_set_id = barset_duplicate.id'
+        )
+    )
+    await conn.execute(
+        text(
+            "UPDATE indicatorseries SET state = '{}', latest_timestamp = NULL, "
+            'bar_count = 0 '
+            'WHERE bar_set_id IN (SELECT survivor_id FROM barset_duplicate)'
+        )
+    )
+
+    # Bars not moved to partitions yet are copied to the survivor's partitions
+    is_migrating = (
+        await conn.execute(text("SELECT to_regclass('bar_unpartitioned') IS NOT NULL"))
+    ).scalar()
+    if is_migrating:
+        years = (
+            await conn.execute(
+                text(
+                    "SELECT DISTINCT extract(year FROM timestamp AT TIME ZONE 'UTC') "
+                    'FROM bar_unpartitioned JOIN barset_duplicate '
+                    'ON bar_unpartitioned.bar_set_id = barset_duplicate.id'
+                )
+            )
+        ).scalars()
+        await create_bar_partitions(conn, sorted(int(year) for year in years))
+        await conn.execute(
+            text(
+                'INSERT INTO bar '
+                '(id, bar_set_id, open, high, low, close, volume, timestamp) '
+                'SELECT gen_random_uuid(), barset_duplicate.survivor_id, '
+                'open, high, low, close, volume, timestamp '
+                'FROM bar_unpartitioned JOIN barset_duplicate '
+                'ON bar_unpartitioned.bar_set_id = barset_duplicate.id '
+                'ON CONFLICT DO NOTHING'
+            )
+        )
+
+    # Bars of duplicates are deleted along with them
+    await conn.execute(
+        text('DELETE FROM barset WHERE id IN (SELECT id FROM barset_duplicate)')
+    )
+    await _compute_bar_set_coverage(conn, 'SELECT survivor_id FROM barset_duplicate')
+
+
+async def _delete_duplicate_trading_sessions(conn: AsyncConnection) -> None:
+    # Sessions are refreshed from origin, so any one of the duplicates will do
+    await conn.execute(
+        text(
+            'DELETE FROM tradingsession WHERE id IN ('
+            'SELECT id FROM ('
+            'SELECT id, row_number() OVER ('
+            'PARTITION BY instrument_id, start ORDER BY "end" DESC, id'
+            ') AS rank FROM tradingsession'
+            ') AS ranked WHERE rank > 1'
+            ')'
+        )
+    )
+
+
+def _create_indexes(sync_conn: Connection, table: str) -> None:
+    for index in SQLModel.metadata.tables[table].indexes:
+        index.create(sync_conn, checkfirst=True)
+
+
+async def _add_unique_constraint(
+    conn: AsyncConnection,
+    table: str,
+    columns: list[str],
+    remove_duplicates: Callable[[AsyncConnection], Awaitable[None]] | None = None,
+) -> None:
+    # Named the same way as constraints created along with the table
+    name = f'{table}_{"_".join(columns)}_key'
+    is_added = (
+        await conn.execute(
+            text('SELECT 1 FROM pg_constraint WHERE conname = :name'), {'name': name}
+        )
+    ).scalar()
+
+    if not is_added:
+        if remove_duplicates:
+            await remove_duplicates(conn)
+
+        await conn.execute(
+            text(
+                f'ALTER TABLE {table} '
+                f'ADD CONSTRAINT {name} UNIQUE ({", ".join(columns)})'
+            )
+        )
@@ -11,10 +11,72 @@ SECRET_KEY = os.environ['APP_SECRET_KEY']
 DB_URL = (
     f'postgresql+asyncpg://{os.getenv("POSTGRES_USER")}:'
     f'{os.getenv("POSTGRES_PASSWORD")}@'
-    f'mdc-db:5432/'
+    f'{os.getenv("POSTGRES_HOST", "mdc-db")}:{os.getenv("POSTGRES_PORT", "5432")}/'
     f'{os.getenv("POSTGRES_DB")}'
 )
 
+BAR_CACHE_MAX_BYTES = int(os.getenv('BAR_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+BAR_CACHE_TTL = int(os.getenv('BAR_CACHE_TTL', 3600))
+# Bars indicator series are computed from are read in chunks of this size
+INDICATOR_CHUNK_SIZE = int(os.getenv('INDICATOR_CHUNK_SIZE', 10000))
+
+# Store bar prices as BIGINT counts of instrument tick size instead of NUMERIC,
+# chosen when the bar table is created
+BAR_PRICES_IN_TICKS = int(os.getenv('BAR_PRICES_IN_TICKS', 0))
+
+# Instruments, bar sets, trading sessions and indicators kept in memory
+METADATA_CACHE_MAX_SIZE = int(os.getenv('METADATA_CACHE_MAX_SIZE', 10000))
+METADATA_CACHE_TTL = int(os.getenv('METADATA_CACHE_TTL', 600))
+
+# Instrument search results, including the ones of IB, are kept for a while
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 30))
+# Searches without local matches give up on IB after this many seconds
+SEARCH_ORIGIN_TIMEOUT = float(os.getenv('SEARCH_ORIGIN_TIMEOUT', 10))
+
+TRADING_CALENDAR_REFRESH_INTERVAL = int(
+    os.getenv('TRADING_CALENDAR_REFRESH_INTERVAL', 6 * 3600)
+)
+
+# How long intervals origin returned no bars for are not requested again
+BAR_EMPTY_INTERVAL_TTL = int(os.getenv('BAR_EMPTY_INTERVAL_TTL', 24 * 3600))
+
+BAR_INGEST_BATCH_SIZE = int(os.getenv('BAR_INGEST_BATCH_SIZE', 10000))
+# Bars of the table used before partitioning are moved in batches of this size
+BAR_MIGRATION_BATCH_SIZE = int(os.getenv('BAR_MIGRATION_BATCH_SIZE', 100000))
+
+IB_HOST = os.getenv('IB_HOST', 'trixter-ib')
+IB_PORT = int(os.getenv('IB_PORT', 4002))
+# Historical data clients take consecutive ids from IB_CLIENT_ID, followed by
+# the client for contract details and searches
+IB_CLIENT_ID = int(os.getenv('IB_CLIENT_ID', 14))
+IB_HISTORICAL_CLIENTS = int(os.getenv('IB_HISTORICAL_CLIENTS', 2))
+IB_RECONNECT_MIN_DELAY = float(os.getenv('IB_RECONNECT_MIN_DELAY', 1))
+IB_RECONNECT_MAX_DELAY = float(os.getenv('IB_RECONNECT_MAX_DELAY', 60))
+IB_HISTORICAL_CONCURRENCY = int(os.getenv('IB_HISTORICAL_CONCURRENCY', 4))
+IB_HISTORICAL_TIMEOUT = float(os.getenv('IB_HISTORICAL_TIMEOUT', 60))
+# Share of concurrency and pacing windows background requests may use, the
+# rest is kept for interactive ones
+IB_BACKGROUND_SHARE = float(os.getenv('IB_BACKGROUND_SHARE', 0.5))
+
+# Serve synthetic bars from ib.simulator instead of IB Gateway, for benchmarks
+IB_SIMULATOR = int(os.getenv('IB_SIMULATOR', 0))
+IB_SIMULATOR_LATENCY = float(os.getenv('IB_SIMULATOR_LATENCY', 0.2))
+IB_SIMULATOR_PACING_ERROR_RATE = float(
+    os.getenv('IB_SIMULATOR_PACING_ERROR_RATE', 0.0)
+)
+
+# Instruments kept warm in background, as comma separated TICKER/TIMEFRAME
+# pairs, e.g. NASDAQ:AAPL/1,GLOBEX:ES/D
+PREFETCH_WATCHLIST = [
+    pair for pair in os.getenv('PREFETCH_WATCHLIST', '').split(',') if pair
+]
+# Most requested pairs are added to the watchlist on top of configured ones
+PREFETCH_USAGE_SIZE = int(os.getenv('PREFETCH_USAGE_SIZE', 20))
+PREFETCH_HISTORY_DAYS = int(os.getenv('PREFETCH_HISTORY_DAYS', 30))
+PREFETCH_CLOSE_DELAY = int(os.getenv('PREFETCH_CLOSE_DELAY', 300))
+PREFETCH_POLL_INTERVAL = int(os.getenv('PREFETCH_POLL_INTERVAL', 300))
+
 BACKEND_CORS_ORIGINS = [
     'http://localhost:3000',
 ]
@@ -1,31 +1,86 @@
-from ib_insync import IB, Contract
+from ib_insync import Contract, BarData, BarDataList, RequestError
 from instruments.models import Exchange, InstrumentType
+from instruments.exceptions import InstrumentNotFoundError
 from bars.models import Bar, BarSet
 from .schemas import InstrumentInfo
 from common.schemas import Interval
+from config import settings
+from typing import Awaitable, Callable, TypeVar
 from decimal import Decimal
 from . import utils
-from common.utils import round_with_quantum
+from .scheduler import HistoricalDataScheduler, Priority
+from .pool import IBClient, IBClientPool
+from common.utils import encode_price
+from common import metrics
 from loguru import logger
+import asyncio
+import functools
+import time
+
+T = TypeVar('T')
+
+# Errors that don't fail a historical data request
+_WARNING_CODES = {110, 165, 202, 399, 404, 434, 492, 10167}
+_NO_DATA_MESSAGE = 'query returned no data'
 
 
 class IBConnector:
     def __init__(self):
-        self._ib = IB()
-        self._ib.errorEvent += self._error_callback
+        self._pool = IBClientPool(
+            first_client_id=settings.IB_CLIENT_ID,
+            historical_count=settings.IB_HISTORICAL_CLIENTS,
+        )
+        # Pacing limits apply to the gateway, so one scheduler serves all clients
+        self._scheduler = HistoricalDataScheduler(
+            max_concurrency=settings.IB_HISTORICAL_CONCURRENCY,
+            background_share=settings.IB_BACKGROUND_SHARE,
+        )
+        # Clients of live subscriptions, which only they can cancel
+        self._subscription_clients: dict[BarDataList, IBClient] = {}
+        # Callbacks of live subscriptions ended by a disconnect of their client
+        self._subscription_callbacks: dict[BarDataList, Callable[[], None]] = {}
+        # Errors of historical data requests, keyed by (client id, request id),
+        # with the time they were received
+        self._request_errors: dict[tuple[int, int], tuple[int, str, float]] = {}
+        # Set while the clients are disconnected on purpose
+        self._is_stopping = False
+
+        for client in self._pool.clients:
+            client.ib.errorEvent += functools.partial(self._error_callback, client)
+            client.ib.disconnectedEvent += functools.partial(
+                self._disconnected_callback, client
+            )
 
     @property
     def is_connected(self) -> bool:
-        return self._ib.isConnected()
+        return any(client.is_connected for client in self._pool.clients)
+
+    @property
+    def is_stopping(self) -> bool:
+        return self._is_stopping
+
+    def start(self) -> None:
+        self._is_stopping = False
+        self._pool.start()
+
+    def stop(self) -> None:
+        self._is_stopping = True
+        self._pool.stop()
 
     async def get_instrument_info(
         self, symbol: str, exchange: Exchange
     ) -> InstrumentInfo:
-        await self._connect()
+        client = await self._pool.get_lookup_client()
 
         contract = self._get_contract(symbol, exchange)
-        await self._ib.qualifyContractsAsync(contract)
-        details = await self._ib.reqContractDetailsAsync(contract)
+        await self._request(
+            'qualify_contracts', client.ib.qualifyContractsAsync(contract)
+        )
+        details = await self._request(
+            'contract_details', client.ib.reqContractDetailsAsync(contract)
+        )
+        if not details:
+            raise InstrumentNotFoundError(f'{exchange}:{symbol}')
 
         type = utils.get_instrument_type_by_exchange(exchange)
         is_stock = type == InstrumentType.STOCK
@@ -42,7 +97,7 @@ class IBConnector:
         multiplier = tr_multiplier or ('1.00' if is_stock else contract.multiplier)
         tick_size = tr_tick_size or ('0.01' if is_stock else str(details[0].minTick))
         trading_hours = details[0].liquidHours if is_stock else details[0].tradingHours
-        nearest_trading_interval = utils.get_nearest_trading_interval(
+        trading_intervals = utils.get_trading_intervals(
             trading_hours, details[0].timeZoneId
         )
 
@@ -54,60 +109,113 @@ class IBConnector:
             description=description,
             tick_size=Decimal(tick_size),
             multiplier=Decimal(multiplier),
-            nearest_session=nearest_trading_interval,
+            sessions=trading_intervals,
         )
 
     async def get_historical_bars(
         self,
         bar_set: BarSet,
         interval: Interval,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> list[Bar]:
-        await self._connect()
-
         instrument = bar_set.instrument
         contract = self._get_contract(instrument.symbol, instrument.exchange)
         is_stock = instrument.type == InstrumentType.STOCK
-        volume_multiplier = 100 if is_stock else 1
-
-        ib_bars = await self._ib.reqHistoricalDataAsync(
-            contract=contract,
-            endDateTime=interval.end,
-            durationStr=utils.duration_to_ib(interval.start, interval.end),
-            barSizeSetting=utils.timeframe_to_ib(bar_set.timeframe),
-            whatToShow='TRADES',
-            useRTH=is_stock,
-            formatDate=2,
-            keepUpToDate=False,
+        duration = utils.duration_to_ib(interval.start, interval.end)
+        bar_size = utils.timeframe_to_ib(bar_set.timeframe)
+        contract_key = (contract.symbol, contract.exchange, contract.secType, 'TRADES')
+
+        ib_bars = await self._scheduler.submit(
+            lambda: self._request_historical_data(
+                contract=contract,
+                endDateTime=interval.end,
+                durationStr=duration,
+                barSizeSetting=bar_size,
+                whatToShow='TRADES',
+                useRTH=is_stock,
+                formatDate=2,
+                keepUpToDate=False,
+            ),
+            key=(contract_key, interval.end, duration, bar_size, is_stock),
+            contract_key=contract_key,
+            priority=priority,
+            is_globally_paced=utils.is_small_bar_size(bar_size),
         )
 
         bars = []
         for ib_bar in ib_bars:
-            tick_size = instrument.tick_size
-            timestamp = utils.timestamp_from_ib(ib_bar.date)
-
-            if interval.start <= timestamp <= interval.end:
-                bar = Bar(
-                    bar_set_id=bar_set.id,
-                    open=round_with_quantum(Decimal(ib_bar.open), tick_size),
-                    high=round_with_quantum(Decimal(ib_bar.high), tick_size),
-                    low=round_with_quantum(Decimal(ib_bar.low), tick_size),
-                    close=round_with_quantum(Decimal(ib_bar.close), tick_size),
-                    volume=int(ib_bar.volume) * volume_multiplier,
-                    timestamp=timestamp,
-                )
+            bar = self._bar_from_ib(bar_set, ib_bar)
 
+            if interval.start <= bar.timestamp <= interval.end:
                 bars.append(bar)
 
         return bars
 
+    async def subscribe_historical_bars(
+        self,
+        bar_set: BarSet,
+        on_update: Callable[[list[Bar], bool], None],
+        on_lost: Callable[[], None],
+    ) -> tuple[BarDataList, list[Bar]]:
+        instrument = bar_set.instrument
+        contract = self._get_contract(instrument.symbol, instrument.exchange)
+        is_stock = instrument.type == InstrumentType.STOCK
+        bar_size = utils.timeframe_to_ib(bar_set.timeframe)
+        contract_key = (contract.symbol, contract.exchange, contract.secType, 'TRADES')
+
+        ib_bars = await self._scheduler.submit(
+            lambda: self._request_historical_data(
+                contract=contract,
+                endDateTime='',
+                durationStr='2 D',
+                barSizeSetting=bar_size,
+                whatToShow='TRADES',
+                useRTH=is_stock,
+                formatDate=2,
+                keepUpToDate=True,
+            ),
+            key=(contract_key, '', '2 D', bar_size, is_stock),
+            contract_key=contract_key,
+            is_globally_paced=utils.is_small_bar_size(bar_size),
+        )
+
+        # Only the last bar changes, and the one before it when a new bar starts
+        ib_bars.updateEvent += lambda updated_ib_bars, has_new_bar: on_update(
+            [self._bar_from_ib(bar_set, ib_bar) for ib_bar in updated_ib_bars[-2:]],
+            has_new_bar,
+        )
+        self._subscription_callbacks[ib_bars] = on_lost
+
+        return ib_bars, [self._bar_from_ib(bar_set, ib_bar) for ib_bar in ib_bars]
+
+    def unsubscribe_historical_bars(self, subscription: BarDataList) -> None:
+        client = self._subscription_clients.pop(subscription, None)
+        self._subscription_callbacks.pop(subscription, None)
+
+        if client:
+            client.ib.cancelHistoricalData(subscription)
+
     async def search_instrument_info(self, symbol: str) -> list[InstrumentInfo]:
-        await self._connect()
+        client = await self._pool.get_lookup_client()
+        types = tuple(InstrumentType)
+        exchange_values = {exchange.value for exchange in Exchange}
+        exchanges = []
 
-        results = []
-        for type in tuple(InstrumentType):
-            contract = self._get_contract(symbol, instrument_type=type)
-            details = await self._ib.reqContractDetailsAsync(contract)
+        # Contract details of all types, then of every exchange found, are
+        # requested concurrently
+        type_details = await asyncio.gather(
+            *(
+                self._request(
+                    'contract_details',
+                    client.ib.reqContractDetailsAsync(
+                        self._get_contract(symbol, instrument_type=type)
+                    ),
+                )
+                for type in types
+            )
+        )
 
+        for type, details in zip(types, type_details):
             for item in details:
                 if item.contract:
                     exchange = (
@@ -115,19 +223,66 @@ class IBConnector:
                         if type == InstrumentType.STOCK
                         else item.contract.exchange
                     )
-                    if exchange in tuple(Exchange) and not next(
-                        (res for res in results if res.exchange == exchange), None
-                    ):
-                        instrument_info = await self.get_instrument_info(
-                            symbol, Exchange(exchange)
-                        )
-                        results.append(instrument_info)
+                    if exchange in exchange_values and exchange not in exchanges:
+                        exchanges.append(exchange)
+
+        return list(
+            await asyncio.gather(
+                *(
+                    self.get_instrument_info(symbol, Exchange(exchange))
+                    for exchange in exchanges
+                )
+            )
+        )
+
+    async def _request(self, type: str, request: Awaitable[T]) -> T:
+        with metrics.IB_REQUEST_DURATION.labels(type).time():
+            try:
+                result = await request
+
+            except Exception:
+                metrics.IB_REQUESTS.labels(type, 'error').inc()
+                raise
 
-        return results
+        metrics.IB_REQUESTS.labels(type, 'ok').inc()
 
-    async def _connect(self, client_id=14):
-        if not self.is_connected:
-            await self._ib.connectAsync('trixter-ib', 4002, client_id)
+        return result
+
+    async def _request_historical_data(self, **params) -> BarDataList:
+        # Client is picked once the scheduler starts the request, so the load
+        # is spread by what's actually running
+        client = await self._pool.get_historical_client()
+        client.running_count += 1
+
+        try:
+            ib_bars = await self._request(
+                'historical_data', self._get_historical_data(client, params)
+            )
+
+        finally:
+            client.running_count -= 1
+
+        if params['keepUpToDate']:
+            self._subscription_clients[ib_bars] = client
+
+        return ib_bars
+
+    async def _get_historical_data(
+        self, client: IBClient, params: dict
+    ) -> BarDataList:
+        # Failed and timed out requests end with no bars too, which must not
+        # pass for an answer that there are none
+        ib_bars = await asyncio.wait_for(
+            client.ib.reqHistoricalDataAsync(**params, timeout=0),
+            settings.IB_HISTORICAL_TIMEOUT,
+        )
+        error = self._request_errors.pop((client.client_id, ib_bars.reqId), None)
+
+        if error:
+            error_code, error_string, _ = error
+            raise RequestError(ib_bars.reqId, error_code, error_string)
+
+        return ib_bars
 
     def _get_contract(
         self,
@@ -159,11 +314,75 @@ class IBConnector:
             currency='USD',
         )
 
+    def _bar_from_ib(self, bar_set: BarSet, ib_bar: BarData) -> Bar:
+        instrument = bar_set.instrument
+        tick_size = instrument.tick_size
+        volume_multiplier = 100 if instrument.type == InstrumentType.STOCK else 1
+
+        return Bar(
+            bar_set_id=bar_set.id,
+            open=encode_price(Decimal(ib_bar.open), tick_size),
+            high=encode_price(Decimal(ib_bar.high), tick_size),
+            low=encode_price(Decimal(ib_bar.low), tick_size),
+            close=encode_price(Decimal(ib_bar.close), tick_size),
+            volume=int(ib_bar.volume) * volume_multiplier,
+            timestamp=utils.timestamp_from_ib(ib_bar.date),
+        )
+
     def _error_callback(
-        self, req_id: int, error_code: int, error_string: str, contract: Contract
+        self,
+        client: IBClient,
+        req_id: int,
+        error_code: int,
+        error_string: str,
+        contract: Contract,
     ) -> None:
         logger.debug(f'{req_id} {error_code} {error_string} {contract}')
 
+        # Errors of live subscriptions come after their request has returned
+        is_failed = (
+            client in self._pool.historical_clients
+            and error_code not in _WARNING_CODES
+            and not 2100 <= error_code < 2200
+            and _NO_DATA_MESSAGE not in error_string
+            and not any(
+                subscription.reqId == req_id and subscription_client is client
+                for subscription, subscription_client in (
+                    self._subscription_clients.items()
+                )
+            )
+        )
+        if is_failed:
+            # Requests that timed out never pick up their errors, which are
+            # dropped once no request they could belong to is pending
+            now = time.monotonic()
+            self._request_errors = {
+                key: error
+                for key, error in self._request_errors.items()
+                if error[2] > now - settings.IB_HISTORICAL_TIMEOUT
+            }
+            self._request_errors[(client.client_id, req_id)] = (
+                error_code,
+                error_string,
+                now,
+            )
+
+    def _disconnected_callback(self, client: IBClient) -> None:
+        # Live subscriptions don't survive a reconnect, their owners subscribe
+        # again when told, unless the connector is being stopped
+        lost_subscriptions = [
+            subscription
+            for subscription, subscription_client in self._subscription_clients.items()
+            if subscription_client is client
+        ]
+
+        for subscription in lost_subscriptions:
+            del self._subscription_clients[subscription]
+            on_lost = self._subscription_callbacks.pop(subscription, None)
+
+            if on_lost and not self._is_stopping:
+                on_lost()
+
     def _get_special_case_translated_values(
         self,
         symbol: str,
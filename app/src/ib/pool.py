@@ -0,0 +1,117 @@
+from ib_insync import IB
+from config import settings
+from common import metrics
+from loguru import logger
+import asyncio
+from .simulator import SimulatedIB
+
+
+class IBClient:
+    def __init__(self, client_id: int):
+        self.client_id = client_id
+        self.ib = SimulatedIB() if settings.IB_SIMULATOR else IB()
+        # Requests in flight, used to pick the least loaded client
+        self.running_count = 0
+        self._connect_lock = asyncio.Lock()
+        self._reconnector: asyncio.Task | None = None
+        self._is_started = False
+
+        self.ib.disconnectedEvent += self._on_disconnected
+
+    @property
+    def is_connected(self) -> bool:
+        return self.ib.isConnected()
+
+    async def connect(self) -> None:
+        # Concurrent callers wait for the attempt in progress instead of
+        # starting their own
+        async with self._connect_lock:
+            if not self.is_connected:
+                await self.ib.connectAsync(
+                    settings.IB_HOST, settings.IB_PORT, self.client_id
+                )
+
+    def start(self) -> None:
+        self._is_started = True
+        self._start_reconnector()
+
+    def stop(self) -> None:
+        self._is_started = False
+
+        if self._reconnector:
+            self._reconnector.cancel()
+
+        self.ib.disconnect()
+
+    def _on_disconnected(self) -> None:
+        if self._is_started:
+            logger.warning(f'IB client disconnected. Client {self.client_id}')
+            self._start_reconnector()
+
+    def _start_reconnector(self) -> None:
+        if not self._reconnector or self._reconnector.done():
+            self._reconnector = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = settings.IB_RECONNECT_MIN_DELAY
+
+        while not self.is_connected:
+            try:
+                await self.connect()
+
+            except (OSError, asyncio.TimeoutError) as error:
+                logger.error(
+                    f'IB connection failed. Client {self.client_id}, '
+                    f'retrying in {delay}s, {error!r}'
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, settings.IB_RECONNECT_MAX_DELAY)
+
+
+# Historical data requests are spread over several clients, while contract
+# details and searches have a client of their own, so they don't wait behind
+# large history pulls
+class IBClientPool:
+    def __init__(self, first_client_id: int, historical_count: int):
+        self.historical_clients = [
+            IBClient(first_client_id + index) for index in range(historical_count)
+        ]
+        self.lookup_client = IBClient(first_client_id + historical_count)
+
+        metrics.IB_CONNECTED_CLIENTS.labels('historical').set_function(
+            lambda: sum(client.is_connected for client in self.historical_clients)
+        )
+        metrics.IB_CONNECTED_CLIENTS.labels('lookup').set_function(
+            lambda: int(self.lookup_client.is_connected)
+        )
+
+    @property
+    def clients(self) -> list[IBClient]:
+        return [*self.historical_clients, self.lookup_client]
+
+    def start(self) -> None:
+        for client in self.clients:
+            client.start()
+
+    def stop(self) -> None:
+        for client in self.clients:
+            client.stop()
+
+    async def get_historical_client(self) -> IBClient:
+        connected_clients = [
+            client for client in self.historical_clients if client.is_connected
+        ]
+
+        # Without a connected client the request waits for one to connect,
+        # and fails if the gateway is unreachable
+        if not connected_clients:
+            client = self.historical_clients[0]
+            await client.connect()
+            connected_clients = [client]
+
+        return min(connected_clients, key=lambda client: client.running_count)
+
+    async def get_lookup_client(self) -> IBClient:
+        await self.lookup_client.connect()
+
+        return self.lookup_client
@@ -0,0 +1,217 @@
+from typing import Any, Awaitable, Callable, Hashable
+from common import metrics
+from collections import deque
+from dataclasses import dataclass, field
+import asyncio
+import enum
+import heapq
+import itertools
+import time
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 10
+
+
+@dataclass
+class _Request:
+    func: Callable[[], Awaitable[Any]]
+    key: Hashable
+    contract_key: Hashable
+    future: asyncio.Future
+    priority: Priority
+    is_globally_paced: bool
+    submitted_at: float = field(default_factory=time.monotonic)
+    task: asyncio.Task | None = field(default=None)
+
+
+class HistoricalDataScheduler:
+    def __init__(
+        self,
+        max_concurrency: int,
+        identical_interval: float = 15,
+        contract_limit: int = 6,
+        contract_period: float = 2,
+        global_limit: int = 60,
+        global_period: float = 600,
+        background_share: float = 1,
+    ):
+        self._max_concurrency = max_concurrency
+        self._identical_interval = identical_interval
+        self._contract_limit = contract_limit
+        self._contract_period = contract_period
+        self._global_limit = global_limit
+        self._global_period = global_period
+        self._background_share = background_share
+
+        self._queue: list[tuple[int, int, _Request]] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._wakeup: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task | None = None
+
+        self._identical_history: dict[Hashable, float] = {}
+        self._contract_history: dict[Hashable, deque[float]] = {}
+        self._global_history: deque[float] = deque()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._queue)
+
+    async def submit(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        key: Hashable,
+        contract_key: Hashable,
+        priority: Priority = Priority.INTERACTIVE,
+        is_globally_paced: bool = False,
+    ) -> Any:
+        request = _Request(
+            func=func,
+            key=key,
+            contract_key=contract_key,
+            future=asyncio.get_running_loop().create_future(),
+            priority=priority,
+            is_globally_paced=is_globally_paced,
+        )
+        heapq.heappush(self._queue, (priority, next(self._sequence), request))
+        metrics.IB_QUEUED_REQUESTS.inc()
+        self._wake_dispatcher()
+
+        try:
+            return await request.future
+
+        except asyncio.CancelledError:
+            # Caller is gone, drop the request if queued or stop it if running
+            if request.task:
+                request.task.cancel()
+            raise
+
+    def _wake_dispatcher(self) -> None:
+        if not self._dispatcher or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        self._wakeup.set()
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            delay = self._start_ready_requests()
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_ready_requests(self) -> float | None:
+        now = time.monotonic()
+        postponed = []
+        delays = []
+
+        self._forget_expired_history(now)
+
+        while self._queue and self._running < self._max_concurrency:
+            item = heapq.heappop(self._queue)
+            request = item[2]
+
+            if request.future.done():
+                metrics.IB_QUEUED_REQUESTS.dec()
+                continue
+
+            # Waits for a running request to complete, not for a pacing window
+            if self._running >= self._get_limit(self._max_concurrency, request):
+                postponed.append(item)
+                continue
+
+            delay = self._get_pacing_delay(request, now)
+            if delay > 0:
+                postponed.append(item)
+                delays.append(delay)
+            else:
+                self._start(request, now)
+
+        for item in postponed:
+            heapq.heappush(self._queue, item)
+
+        # Without a pacing delay the dispatcher sleeps until a request is
+        # submitted or a running one completes
+        return min(delays, default=None)
+
+    def _get_pacing_delay(self, request: _Request, now: float) -> float:
+        delays = [0.0]
+
+        identical_ts = self._identical_history.get(request.key)
+        if identical_ts is not None:
+            delays.append(identical_ts + self._identical_interval - now)
+
+        contract_history = self._contract_history.get(request.contract_key, ())
+        contract_limit = self._get_limit(self._contract_limit, request)
+        if len(contract_history) >= contract_limit:
+            delays.append(
+                contract_history[-contract_limit] + self._contract_period - now
+            )
+
+        global_limit = self._get_limit(self._global_limit, request)
+        if request.is_globally_paced and len(self._global_history) >= global_limit:
+            delays.append(
+                self._global_history[-global_limit] + self._global_period - now
+            )
+
+        return max(delays)
+
+    def _get_limit(self, limit: int, request: _Request) -> int:
+        # Background requests leave part of every limit to interactive ones,
+        # so a prefetch never makes a chart wait for a pacing window
+        if request.priority == Priority.BACKGROUND:
+            limit = max(int(limit * self._background_share), 1)
+
+        return limit
+
+    def _start(self, request: _Request, now: float) -> None:
+        self._identical_history[request.key] = now
+        self._contract_history.setdefault(request.contract_key, deque()).append(now)
+        if request.is_globally_paced:
+            self._global_history.append(now)
+        self._running += 1
+        metrics.IB_QUEUED_REQUESTS.dec()
+        metrics.IB_PACING_WAIT.observe(now - request.submitted_at)
+
+        request.task = asyncio.create_task(self._run(request))
+
+    async def _run(self, request: _Request) -> None:
+        try:
+            result = await request.func()
+            if not request.future.done():
+                request.future.set_result(result)
+
+        except asyncio.CancelledError:
+            request.future.cancel()
+
+        except Exception as error:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+        finally:
+            self._running -= 1
+            self._wakeup.set()
+
+    def _forget_expired_history(self, now: float) -> None:
+        self._identical_history = {
+            key: ts
+            for key, ts in self._identical_history.items()
+            if ts + self._identical_interval > now
+        }
+
+        for key, history in list(self._contract_history.items()):
+            while history and history[0] + self._contract_period <= now:
+                history.popleft()
+            if not history:
+                del self._contract_history[key]
+
+        while (
+            self._global_history
+            and self._global_history[0] + self._global_period <= now
+        ):
+            self._global_history.popleft()
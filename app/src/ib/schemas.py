@@ -12,4 +12,4 @@ class InstrumentInfo(BaseModel):
     description: str
     tick_size: Decimal
     multiplier: Decimal
-    nearest_session: Interval
+    sessions: list[Interval]
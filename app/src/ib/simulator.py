@@ -0,0 +1,220 @@
+from ib_insync import BarData, BarDataList, Contract, ContractDetails, Event
+from config import settings
+from datetime import date, datetime, time, timedelta
+import asyncio
+import itertools
+import math
+import random
+import pytz
+
+# Stand-in for ib_insync.IB with the requests IBConnector makes, serving
+# synthetic bars without a gateway. Bars depend only on symbol and timestamp,
+# so overlapping requests agree with each other
+_TZ_ID = 'US/Eastern'
+_PACING_ERROR_CODE = 162
+_PACING_ERROR_MESSAGE = (
+    'Historical Market Data Service error message:'
+    'API historical data query cancelled: pacing violation'
+)
+_DURATION_UNITS = {
+    'S': timedelta(seconds=1),
+    'D': timedelta(days=1),
+    'W': timedelta(weeks=1),
+    'M': timedelta(days=31),
+    'Y': timedelta(days=365),
+}
+_BAR_SIZES = {
+    '1 min': timedelta(minutes=1),
+    '5 mins': timedelta(minutes=5),
+    '15 mins': timedelta(minutes=15),
+    '30 mins': timedelta(minutes=30),
+    '1 hour': timedelta(hours=1),
+    '1 day': timedelta(days=1),
+    '1 week': timedelta(weeks=1),
+    '1 month': timedelta(days=31),
+}
+
+
+class SimulatedIB:
+    def __init__(
+        self,
+        latency: float = settings.IB_SIMULATOR_LATENCY,
+        pacing_error_rate: float = settings.IB_SIMULATOR_PACING_ERROR_RATE,
+    ):
+        self._latency = latency
+        self._pacing_error_rate = pacing_error_rate
+        self._is_connected = False
+        self._req_ids = itertools.count(1)
+        self.errorEvent = Event('errorEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+
+    def isConnected(self) -> bool:
+        return self._is_connected
+
+    async def connectAsync(self, host: str, port: int, clientId: int) -> None:
+        await asyncio.sleep(self._latency)
+        self._is_connected = True
+
+    def disconnect(self) -> None:
+        if self._is_connected:
+            self._is_connected = False
+            self.disconnectedEvent.emit()
+
+    async def qualifyContractsAsync(self, *contracts: Contract) -> list[Contract]:
+        await asyncio.sleep(self._latency)
+
+        for contract in contracts:
+            contract.conId = abs(hash(contract.symbol)) % 10**8
+            if contract.secType == 'CONTFUT' and not contract.multiplier:
+                contract.multiplier = '50'
+
+        return list(contracts)
+
+    async def reqContractDetailsAsync(
+        self, contract: Contract
+    ) -> list[ContractDetails]:
+        await asyncio.sleep(self._latency)
+
+        is_stock = contract.secType == 'STK'
+        exchange = contract.exchange.split(':')[-1]
+        if exchange in ('', 'SMART'):
+            exchange = 'NASDAQ' if is_stock else 'GLOBEX'
+
+        details_contract = Contract(
+            symbol=contract.symbol,
+            secType=contract.secType,
+            exchange='SMART' if is_stock else exchange,
+            primaryExchange=exchange if is_stock else '',
+            multiplier=contract.multiplier or ('' if is_stock else '50'),
+            currency=contract.currency,
+        )
+
+        return [
+            ContractDetails(
+                contract=details_contract,
+                longName=f'{contract.symbol} simulated',
+                minTick=0.01 if is_stock else 0.25,
+                timeZoneId=_TZ_ID,
+                tradingHours=_get_trading_hours(time(4), time(20)),
+                liquidHours=_get_trading_hours(time(9, 30), time(16)),
+            )
+        ]
+
+    async def reqHistoricalDataAsync(
+        self,
+        contract: Contract,
+        endDateTime: datetime | str,
+        durationStr: str,
+        barSizeSetting: str,
+        whatToShow: str,
+        useRTH: bool,
+        formatDate: int = 1,
+        keepUpToDate: bool = False,
+        timeout: float = 60,
+    ) -> BarDataList:
+        req_id = next(self._req_ids)
+        await asyncio.sleep(self._latency)
+
+        ib_bars = BarDataList()
+        ib_bars.reqId = req_id
+        ib_bars.contract = contract
+        ib_bars.keepUpToDate = keepUpToDate
+
+        # Like IB, a pacing violation is reported as an error event and the
+        # request returns no bars
+        if random.random() < self._pacing_error_rate:
+            self.errorEvent.emit(
+                req_id, _PACING_ERROR_CODE, _PACING_ERROR_MESSAGE, contract
+            )
+            return ib_bars
+
+        end = endDateTime or datetime.now(pytz.utc)
+        amount, unit = durationStr.split()
+        start = end - int(amount) * _DURATION_UNITS[unit]
+        tick_size = 0.01 if contract.secType == 'STK' else 0.25
+
+        ib_bars += [
+            _get_bar(contract.symbol, timestamp, step, tick_size)
+            for timestamp, step in _get_timestamps(
+                start, end, _BAR_SIZES[barSizeSetting], useRTH
+            )
+        ]
+
+        return ib_bars
+
+    def cancelHistoricalData(self, ib_bars: BarDataList) -> None:
+        ib_bars.keepUpToDate = False
+
+
+def _get_trading_hours(session_open: time, session_close: time) -> str:
+    ib_sessions = []
+    today = datetime.now(pytz.timezone(_TZ_ID)).date()
+
+    for day in (today + timedelta(days=days) for days in range(7)):
+        if day.weekday() < 5:
+            ib_sessions.append(
+                f'{day:%Y%m%d}:{session_open:%H%M}-{day:%Y%m%d}:{session_close:%H%M}'
+            )
+        else:
+            ib_sessions.append(f'{day:%Y%m%d}:CLOSED')
+
+    return ';'.join(ib_sessions)
+
+
+def _get_timestamps(start: datetime, end: datetime, step: timedelta, is_rth: bool):
+    session_tz = pytz.timezone(_TZ_ID)
+
+    # Daily and longer bars are labeled with dates, the rest with bar start
+    if step >= timedelta(days=1):
+        day = start.astimezone(session_tz).date()
+        while day <= end.astimezone(session_tz).date():
+            is_bar_start = (
+                (step == timedelta(days=1) and day.weekday() < 5)
+                or (step == timedelta(weeks=1) and day.weekday() == 0)
+                or (step == timedelta(days=31) and day.day == 1)
+            )
+            if is_bar_start:
+                yield day, step
+            day += timedelta(days=1)
+
+        return
+
+    timestamp = datetime.fromtimestamp(
+        start.timestamp() // step.total_seconds() * step.total_seconds(), pytz.utc
+    )
+    while timestamp < end:
+        local_time = timestamp.astimezone(session_tz)
+        is_open = local_time.weekday() < 5 and (
+            not is_rth or time(9, 30) <= local_time.time() < time(16)
+        )
+        if is_open:
+            yield timestamp, step
+        timestamp += step
+
+
+def _get_bar(
+    symbol: str, timestamp: datetime | date, step: timedelta, tick_size: float
+) -> BarData:
+    if type(timestamp) is date:
+        seconds = datetime.combine(timestamp, time(), pytz.utc).timestamp()
+    else:
+        seconds = timestamp.timestamp()
+
+    # Slow wave per symbol, with noise seeded by symbol and timestamp
+    rng = random.Random(f'{symbol}{seconds}')
+    phase = sum(map(ord, symbol))
+    base = 100 + phase % 100 + 10 * math.sin(seconds / 86400 / 20 + phase)
+    spread = base * 0.001 * math.sqrt(step.total_seconds() / 60)
+    prices = [base + rng.uniform(-spread, spread) for _ in range(4)]
+    open, close = prices[0], prices[1]
+    high = max(prices)
+    low = min(prices)
+
+    return BarData(
+        date=timestamp,
+        open=round(open / tick_size) * tick_size,
+        high=round(high / tick_size) * tick_size,
+        low=round(low / tick_size) * tick_size,
+        close=round(close / tick_size) * tick_size,
+        volume=rng.randint(1, 1000),
+    )
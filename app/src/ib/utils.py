@@ -7,12 +7,18 @@ import pytz
 
 
 def timeframe_to_ib(timeframe: Timeframe) -> str:
-    if timeframe == Timeframe.DAY:
+    if timeframe == Timeframe.MONTH:
+        ib_timeframe = '1 month'
+    elif timeframe == Timeframe.WEEK:
+        ib_timeframe = '1 week'
+    elif timeframe == Timeframe.DAY:
         ib_timeframe = '1 day'
     elif timeframe == Timeframe.M60:
         ib_timeframe = '1 hour'
     elif timeframe == Timeframe.M30:
         ib_timeframe = '30 mins'
+    elif timeframe == Timeframe.M15:
+        ib_timeframe = '15 mins'
     elif timeframe == Timeframe.M5:
         ib_timeframe = '5 mins'
     elif timeframe == Timeframe.M1:
@@ -23,6 +29,35 @@ def timeframe_to_ib(timeframe: Timeframe) -> str:
     return ib_timeframe
 
 
+def is_small_bar_size(bar_size: str) -> bool:
+    # IB limits requests of these to 60 in any 10 minutes
+    return bar_size in ('1 secs', '5 secs', '10 secs', '15 secs', '30 secs')
+
+
+def get_max_request_length(timeframe: Timeframe) -> int:
+    # Bars in the longest duration IB serves per request of the bar size
+    if timeframe == Timeframe.M1:
+        length = 1440  # 1 D
+    elif timeframe == Timeframe.M5:
+        length = 2016  # 1 W
+    elif timeframe == Timeframe.M15:
+        length = 672  # 1 W
+    elif timeframe == Timeframe.M30:
+        length = 1440  # 30 D
+    elif timeframe == Timeframe.M60:
+        length = 720  # 30 D
+    elif timeframe == Timeframe.DAY:
+        length = 365  # 1 Y
+    elif timeframe == Timeframe.WEEK:
+        length = 52  # 1 Y
+    elif timeframe == Timeframe.MONTH:
+        length = 12  # 1 Y
+    else:
+        raise ValueError(f'Cannot get request length for timeframe {timeframe}')
+
+    return length
+
+
 def duration_to_ib(start: datetime, end: datetime) -> str:
     total_seconds = int((end - start).total_seconds())
     total_days = math.ceil(total_seconds / 86400)  # Seconds in day
@@ -80,9 +115,8 @@ def security_type_to_ib(
     return sec_type
 
 
-def get_nearest_trading_interval(trading_hours: str, tz_id: str) -> Interval:
-    min_dt = pytz.utc.localize(datetime.min)
-    nearest_interval = Interval(start=min_dt, end=min_dt)
+def get_trading_intervals(trading_hours: str, tz_id: str) -> list[Interval]:
+    trading_intervals = []
     session_tz = pytz.timezone(tz_id)
 
     for ib_session in trading_hours.split(';'):
@@ -90,9 +124,10 @@ def get_nearest_trading_interval(trading_hours: str, tz_id: str) -> Interval:
             ib_open, ib_close = tuple(ib_session.split('-'))
             open = session_tz.localize(datetime.strptime(ib_open, '%Y%m%d:%H%M'))
             close = session_tz.localize(datetime.strptime(ib_close, '%Y%m%d:%H%M'))
-            if close > datetime.now(pytz.utc):
-                nearest_interval.start = open
-                nearest_interval.end = close
-                break
+            trading_intervals.append(
+                Interval(
+                    start=open.astimezone(pytz.utc), end=close.astimezone(pytz.utc)
+                )
+            )
 
-    return nearest_interval
+    return trading_intervals
@@ -1,21 +1,53 @@
 from common.models import DBModel
-from sqlmodel import Field, Column, DateTime, ForeignKey
-from sqlalchemy import UniqueConstraint
+from sqlmodel import Field, Column, Enum, DateTime, ForeignKey
+from sqlalchemy import UniqueConstraint, BigInteger, Float, JSON
 from uuid import UUID
-from decimal import Decimal
 from datetime import datetime
-import pytz
+from typing import Any
+import enum
 
 
-class Indicator(DBModel, table=True):
+class IndicatorType(enum.Enum):
+    ATR = 'ATR'
+    SMA = 'SMA'
+    EMA = 'EMA'
+    RSI = 'RSI'
+    VWAP = 'VWAP'
+
+
+class IndicatorSeries(DBModel, table=True):
     bar_set_id: UUID = Field(
         sa_column=Column(ForeignKey('barset.id', ondelete='CASCADE'), nullable=False)
     )
+    type: IndicatorType = Field(
+        sa_column=Column(Enum(IndicatorType), nullable=False)
+    )
     length: int
-    atr: Decimal = Decimal('0.0')
-    valid_until: datetime = Field(
-        sa_column=Column(DateTime(timezone=True), nullable=False),
-        default_factory=lambda: pytz.utc.localize(datetime.min),
+    # Rolling state after the latest applied bar
+    state: dict[str, Any] = Field(
+        default_factory=dict, sa_column=Column(JSON, nullable=False)
+    )
+    latest_timestamp: datetime | None = Field(
+        sa_column=Column(DateTime(timezone=True))
+    )
+    # Bars of the bar set applied so far, more bars in the bar set mean some
+    # were saved before the latest one and the series has to be rebuilt
+    bar_count: int = Field(
+        default=0, sa_column=Column(BigInteger, nullable=False, server_default='0')
+    )
+
+    __table_args__ = (UniqueConstraint('bar_set_id', 'type', 'length'),)
+
+
+class IndicatorValue(DBModel, table=True):
+    indicator_series_id: UUID = Field(
+        sa_column=Column(
+            ForeignKey('indicatorseries.id', ondelete='CASCADE'), nullable=False
+        )
+    )
+    timestamp: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False)
     )
+    value: float = Field(sa_column=Column(Float, nullable=False))
 
-    __table_args__ = (UniqueConstraint('bar_set_id', 'length'),)
+    __table_args__ = (UniqueConstraint('indicator_series_id', 'timestamp'),)
@@ -1,11 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends
 from config.db import DB, get_db
-from .schemas import IndicatorGet
+from bars.models import Timeframe
+from instruments.exceptions import InstrumentNotFoundError
+from common.schemas import Interval
+from datetime import datetime
+import pytz
+from .models import IndicatorType
+from .schemas import IndicatorGet, IndicatorSeriesGet, ScreenParams, ScreenResult
 from . import services
 
 indicator_router = APIRouter(tags=['Indicators'])
 
 
+@indicator_router.post('/screen', response_model=list[ScreenResult])
+async def screen_indicators(params: ScreenParams, db: DB = Depends(get_db)):
+    return await services.screen_indicators(db, params)
+
+
 @indicator_router.get('/{ticker}', response_model=IndicatorGet)
 async def get_indicator(
     ticker: str,
@@ -20,3 +31,36 @@ async def get_indicator(
             status_code=404,
             detail=f'Instrument with ticker {ticker} not found',
         )
+
+
+@indicator_router.get('/{ticker}/series', response_model=IndicatorSeriesGet)
+async def get_indicator_series(
+    ticker: str,
+    resolution: str,
+    type: IndicatorType,
+    length: int,
+    from_: int = Query(..., alias='from'),
+    to: int = ...,
+    db: DB = Depends(get_db),
+):
+    if resolution in ('1D', '1W', '1M'):
+        resolution = resolution[1:]
+
+    interval = Interval(
+        start=datetime.fromtimestamp(from_, pytz.utc),
+        end=datetime.fromtimestamp(to, pytz.utc),
+    )
+
+    try:
+        return await services.get_indicator_series(
+            db, ticker, Timeframe(resolution), type, length, interval
+        )
+
+    except InstrumentNotFoundError:
+        raise HTTPException(
+            status_code=404,
+            detail=f'Instrument with ticker {ticker} not found',
+        )
+
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
@@ -1,7 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, validator
 from bars.models import Timeframe
 from datetime import datetime
 from decimal import Decimal
+from typing import Literal
+from .models import IndicatorType
 
 
 class IndicatorGet(BaseModel):
@@ -9,5 +11,35 @@ class IndicatorGet(BaseModel):
     atr: Decimal
     valid_until: datetime
 
-    class Config:
-        orm_mode = True
+
+class IndicatorSeriesGet(BaseModel):
+    t: list[int] = []
+    v: list[float] = []
+
+
+class ScreenParams(BaseModel):
+    # All instruments with bars of the timeframe when not given
+    tickers: list[str] | None = None
+    timeframe: Timeframe = Timeframe.DAY
+    type: IndicatorType
+    length: int = Field(..., ge=1)
+    # Latest bars each value is calculated from
+    lookback: int = Field(250, ge=2, le=5000)
+    min_value: float | None = None
+    max_value: float | None = None
+    order: Literal['asc', 'desc'] = 'desc'
+    limit: int | None = Field(None, ge=1)
+
+    @validator('lookback')
+    def check_lookback(cls, lookback: int, values: dict) -> int:
+        length = values.get('length')
+        if length is not None and length > lookback:
+            raise ValueError(f'Lookback must not be less than length {length}')
+
+        return lookback
+
+
+class ScreenResult(BaseModel):
+    ticker: str
+    value: float
+    timestamp: int
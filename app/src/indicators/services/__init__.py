@@ -1,2 +1,3 @@
 from .indicator_logic import *
 from .indicator_crud import *
+from .indicator_screen_logic import *
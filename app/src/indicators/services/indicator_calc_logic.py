@@ -0,0 +1,232 @@
+from indicators.models import IndicatorType
+from typing import Any, Callable, NamedTuple
+import numpy as np
+
+# Rolling state of an indicator is a JSON compatible dict, so it can be
+# persisted between ingests and advanced by one bar at a time
+
+
+class CalcBar(NamedTuple):
+    high: float
+    low: float
+    close: float
+    volume: int
+
+
+def update_state(
+    type: IndicatorType, length: int, state: dict[str, Any], bar: CalcBar
+) -> float | None:
+    return _UPDATERS[type](length, state, bar)
+
+
+def get_warmup_length(type: IndicatorType, length: int) -> int:
+    # Bars before a bar that its value depends on. Smoothed indicators depend
+    # on all of them, but the weight of bars this far back is below e^-10
+    if type in (IndicatorType.SMA, IndicatorType.VWAP):
+        warmup_length = length
+    else:
+        warmup_length = 10 * length + 1
+
+    return warmup_length
+
+
+def calculate_latest(
+    type: IndicatorType,
+    length: int,
+    highs: np.ndarray,
+    lows: np.ndarray,
+    closes: np.ndarray,
+    volumes: np.ndarray,
+) -> np.ndarray:
+    # Rows are bars of many bar sets, padded with NaN at the start. Each row
+    # gets the value update_state would end up with after the same bars
+    return _LATEST_CALCULATORS[type](length, highs, lows, closes, volumes)
+
+
+def _update_sma(length: int, state: dict[str, Any], bar: CalcBar) -> float | None:
+    return _push_window(length, state, bar.close)
+
+
+def _update_ema(length: int, state: dict[str, Any], bar: CalcBar) -> float | None:
+    ema = state.get('ema')
+
+    # Seeded with SMA of the first length closes
+    if ema is None:
+        ema = _push_window(length, state, bar.close)
+    else:
+        ema += 2 / (length + 1) * (bar.close - ema)
+
+    state['ema'] = ema
+
+    return ema
+
+
+def _update_atr(length: int, state: dict[str, Any], bar: CalcBar) -> float | None:
+    prev_close = state.get('prev_close')
+    true_range = bar.high - bar.low
+    if prev_close is not None:
+        true_range = max(
+            true_range, abs(bar.high - prev_close), abs(bar.low - prev_close)
+        )
+
+    state['prev_close'] = bar.close
+
+    return _smooth_wilder(length, state, 'tr', true_range)
+
+
+def _update_rsi(length: int, state: dict[str, Any], bar: CalcBar) -> float | None:
+    prev_close = state.get('prev_close')
+    state['prev_close'] = bar.close
+
+    if prev_close is None:
+        return None
+
+    change = bar.close - prev_close
+    avg_gain = _smooth_wilder(length, state, 'gain', max(change, 0.0))
+    avg_loss = _smooth_wilder(length, state, 'loss', max(-change, 0.0))
+
+    if avg_gain is None or avg_loss is None:
+        rsi = None
+    elif avg_loss == 0:
+        rsi = 100.0
+    else:
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+
+    return rsi
+
+
+def _update_vwap(length: int, state: dict[str, Any], bar: CalcBar) -> float | None:
+    # Moving VWAP of the last length bars at typical price
+    typical_price = (bar.high + bar.low + bar.close) / 3
+    window = state.setdefault('window', [])
+    window.append([typical_price * bar.volume, bar.volume])
+    state['pv_sum'] = state.get('pv_sum', 0.0) + typical_price * bar.volume
+    state['volume_sum'] = state.get('volume_sum', 0) + bar.volume
+
+    if len(window) > length:
+        pv, volume = window.pop(0)
+        state['pv_sum'] -= pv
+        state['volume_sum'] -= volume
+
+    if len(window) < length or not state['volume_sum']:
+        return None
+
+    return state['pv_sum'] / state['volume_sum']
+
+
+def _push_window(length: int, state: dict[str, Any], value: float) -> float | None:
+    window = state.setdefault('window', [])
+    window.append(value)
+    state['sum'] = state.get('sum', 0.0) + value
+
+    if len(window) > length:
+        state['sum'] -= window.pop(0)
+
+    return state['sum'] / length if len(window) == length else None
+
+
+def _smooth_wilder(
+    length: int, state: dict[str, Any], key: str, value: float
+) -> float | None:
+    average = state.get(f'{key}_avg')
+
+    # Seeded with simple average of the first length values
+    if average is None:
+        count = state.get(f'{key}_count', 0) + 1
+        total = state.get(f'{key}_sum', 0.0) + value
+        state[f'{key}_count'] = count
+        state[f'{key}_sum'] = total
+
+        if count == length:
+            average = total / length
+    else:
+        average = (average * (length - 1) + value) / length
+
+    state[f'{key}_avg'] = average
+
+    return average
+
+
+_UPDATERS: dict[IndicatorType, Callable[[int, dict, CalcBar], float | None]] = {
+    IndicatorType.SMA: _update_sma,
+    IndicatorType.EMA: _update_ema,
+    IndicatorType.ATR: _update_atr,
+    IndicatorType.RSI: _update_rsi,
+    IndicatorType.VWAP: _update_vwap,
+}
+
+
+def _latest_sma(length: int, highs, lows, closes, volumes) -> np.ndarray:
+    # Rows with less than length bars have NaN among the last length closes
+    if length > closes.shape[1]:
+        return np.full(len(closes), np.nan)
+
+    return closes[:, -length:].mean(axis=1)
+
+
+def _latest_ema(length: int, highs, lows, closes, volumes) -> np.ndarray:
+    return _smooth(closes, length, 2 / (length + 1))
+
+
+def _latest_atr(length: int, highs, lows, closes, volumes) -> np.ndarray:
+    prev_closes = np.roll(closes, 1, axis=1)
+    prev_closes[:, 0] = np.nan
+    # Without previous close the range of the bar is its true range
+    true_ranges = np.fmax(
+        highs - lows,
+        np.fmax(np.abs(highs - prev_closes), np.abs(lows - prev_closes)),
+    )
+
+    return _smooth(true_ranges, length, 1 / length)
+
+
+def _latest_rsi(length: int, highs, lows, closes, volumes) -> np.ndarray:
+    changes = np.diff(closes, axis=1)
+    gains = np.where(np.isnan(changes), np.nan, np.maximum(changes, 0.0))
+    losses = np.where(np.isnan(changes), np.nan, np.maximum(-changes, 0.0))
+    avg_gains = _smooth(gains, length, 1 / length)
+    avg_losses = _smooth(losses, length, 1 / length)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + avg_gains / avg_losses)
+
+    return np.where(avg_losses == 0, 100.0, rsi)
+
+
+def _latest_vwap(length: int, highs, lows, closes, volumes) -> np.ndarray:
+    if length > closes.shape[1]:
+        return np.full(len(closes), np.nan)
+
+    typical_prices = (highs + lows + closes) / 3
+    pv_sums = (typical_prices * volumes)[:, -length:].sum(axis=1)
+    volume_sums = volumes[:, -length:].sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(volume_sums > 0, pv_sums / volume_sums, np.nan)
+
+
+def _smooth(values: np.ndarray, length: int, alpha: float) -> np.ndarray:
+    is_valid = ~np.isnan(values)
+    counts = np.cumsum(is_valid, axis=1)
+    sums = np.cumsum(np.where(is_valid, values, 0.0), axis=1)
+    averages = np.full(len(values), np.nan)
+
+    # Seeded with simple average of the first length values of each row,
+    # rows not seeded yet stay NaN
+    for column in range(values.shape[1]):
+        averages = np.where(
+            counts[:, column] == length,
+            sums[:, column] / length,
+            averages + alpha * (values[:, column] - averages),
+        )
+
+    return averages
+
+
+_LATEST_CALCULATORS: dict[IndicatorType, Callable[..., np.ndarray]] = {
+    IndicatorType.SMA: _latest_sma,
+    IndicatorType.EMA: _latest_ema,
+    IndicatorType.ATR: _latest_atr,
+    IndicatorType.RSI: _latest_rsi,
+    IndicatorType.VWAP: _latest_vwap,
+}
@@ -1,19 +1,164 @@
-from indicators.models import Indicator
+from indicators.models import IndicatorSeries, IndicatorType, IndicatorValue
 from bars.models import BarSet
+from common.cache import LRUCache
+from common.schemas import Interval
 from config.db import DB
+from config import settings
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
+from datetime import datetime
+from typing import Any
+from uuid import uuid4
 
+# Detached indicator series keyed by (bar set id, type, length)
+_indicator_series_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.METADATA_CACHE_TTL,
+    name='indicator_series',
+)
+# Ids of all indicator series of a bar set, keyed by bar set id
+_bar_set_series_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.METADATA_CACHE_TTL,
+    name='bar_set_indicator_series',
+)
 
-async def get_or_create_indicator(db: DB, bar_set: BarSet, length: int) -> Indicator:
-    try:
-        query = select(Indicator).filter_by(bar_set_id=bar_set.id, length=length)
-        indicator = (await db.execute(query)).scalar_one()
 
-    except NoResultFound:
-        indicator = Indicator(bar_set_id=bar_set.id, length=length)
-        db.add(indicator)
+async def get_or_create_indicator_series(
+    db: DB, bar_set: BarSet, type: IndicatorType, length: int
+) -> IndicatorSeries:
+    cache_key = (bar_set.id, type, length)
+    indicator_series = _indicator_series_cache.get(cache_key)
 
-        await db.commit()
+    if indicator_series is None:
+        query = select(IndicatorSeries).filter_by(
+            bar_set_id=bar_set.id, type=type, length=length
+        )
 
-    return indicator
+        try:
+            indicator_series = (await db.execute(query)).scalar_one()
+
+        except NoResultFound:
+            # Concurrent creates of the same series end up with a single row
+            await db.execute(
+                insert(IndicatorSeries)
+                .values(
+                    id=uuid4(),
+                    bar_set_id=bar_set.id,
+                    type=type,
+                    length=length,
+                    state={},
+                )
+                .on_conflict_do_nothing(
+                    index_elements=['bar_set_id', 'type', 'length']
+                )
+            )
+            await db.commit()
+
+            indicator_series = (await db.execute(query)).scalar_one()
+            _bar_set_series_cache.delete(bar_set.id)
+
+        db.expunge(indicator_series)
+        _indicator_series_cache.set(cache_key, indicator_series)
+
+    return indicator_series
+
+
+async def get_bar_set_indicator_series(
+    db: DB, bar_set: BarSet
+) -> list[IndicatorSeries]:
+    series_keys = _bar_set_series_cache.get(bar_set.id)
+
+    if series_keys is None:
+        query = select(IndicatorSeries.type, IndicatorSeries.length).filter_by(
+            bar_set_id=bar_set.id
+        )
+        series_keys = (await db.execute(query)).all()
+
+        _bar_set_series_cache.set(bar_set.id, series_keys)
+
+    return [
+        await get_or_create_indicator_series(db, bar_set, type, length)
+        for type, length in series_keys
+    ]
+
+
+async def save_indicator_values(
+    db: DB,
+    indicator_series: IndicatorSeries,
+    values: list[tuple[datetime, float]],
+    state: dict[str, Any],
+    latest_timestamp: datetime | None,
+    bar_count: int,
+    is_rebuilt: bool = False,
+) -> None:
+    if is_rebuilt:
+        await db.execute(
+            delete(IndicatorValue).where(
+                IndicatorValue.indicator_series_id == indicator_series.id
+            )
+        )
+
+    if values:
+        query = insert(IndicatorValue)
+        await db.execute(
+            query.on_conflict_do_update(
+                index_elements=['indicator_series_id', 'timestamp'],
+                set_={'value': query.excluded.value},
+            ),
+            [
+                {
+                    'id': uuid4(),
+                    'indicator_series_id': indicator_series.id,
+                    'timestamp': timestamp,
+                    'value': value,
+                }
+                for timestamp, value in values
+            ],
+        )
+
+    series_values = {
+        'state': state,
+        'latest_timestamp': latest_timestamp,
+        'bar_count': bar_count,
+    }
+    await db.execute(
+        update(IndicatorSeries)
+        .where(IndicatorSeries.id == indicator_series.id)
+        .values(**series_values)
+    )
+    await db.commit()
+
+    # Cached instance is shared between requests, so it's updated in place
+    for key, value in series_values.items():
+        set_committed_value(indicator_series, key, value)
+
+
+async def get_indicator_values(
+    db: DB, indicator_series: IndicatorSeries, interval: Interval
+) -> list[IndicatorValue]:
+    query = (
+        select(IndicatorValue)
+        .filter_by(indicator_series_id=indicator_series.id)
+        .where(IndicatorValue.timestamp >= interval.start)
+        .where(IndicatorValue.timestamp <= interval.end)
+        .order_by(IndicatorValue.timestamp)
+    )
+
+    return (await db.execute(query)).scalars().all()
+
+
+async def get_latest_indicator_value(
+    db: DB, indicator_series: IndicatorSeries
+) -> IndicatorValue | None:
+    query = (
+        select(IndicatorValue)
+        .filter_by(indicator_series_id=indicator_series.id)
+        .order_by(IndicatorValue.timestamp.desc())
+        .limit(1)
+    )
+
+    return (await db.execute(query)).scalar()
@@ -1,59 +1,270 @@
-from indicators.models import Indicator
-from bars.models import Timeframe, Bar
-from config.db import DB
+from indicators.models import IndicatorSeries, IndicatorType
+from indicators.schemas import IndicatorGet, IndicatorSeriesGet
+from bars.models import BarSet, Bar, Timeframe
+from config.db import DB, Session
+from config import settings
 from instruments import services as instrument_services
 from bars import services as bar_services
 from common.schemas import Interval
-from common.utils import round_with_quantum
-from datetime import datetime, time, timedelta
+from common.utils import round_with_quantum, decode_price
+from collections import defaultdict
+from uuid import UUID
+from datetime import datetime
 from decimal import Decimal
+from loguru import logger
+import asyncio
+import copy
 import pytz
-from . import indicator_crud
+from . import indicator_calc_logic, indicator_crud
 
+# Series are updated by ingests and reads concurrently
+_series_locks: defaultdict[UUID, asyncio.Lock] = defaultdict(asyncio.Lock)
+# Updates of series after ingests, keyed by bar set id. They run in background,
+# off the ingest path, and reads wait for them
+_update_tasks: defaultdict[UUID, set[asyncio.Task]] = defaultdict(set)
 
-async def get_indicator(db: DB, ticker: str, length: int) -> Indicator:
+
+async def get_indicator(db: DB, ticker: str, length: int) -> IndicatorGet:
     instrument = await instrument_services.get_saved_instrument(db, ticker)
     bar_set = await bar_services.get_bar_set(db, instrument, Timeframe.DAY)
-    indicator = await indicator_crud.get_or_create_indicator(
-        db, bar_set=bar_set, length=length
+    indicator_series = await _get_up_to_date_indicator_series(
+        db, bar_set, IndicatorType.ATR, length
+    )
+
+    latest_value = await indicator_crud.get_latest_indicator_value(
+        db, indicator_series
+    )
+    trading_session = await instrument_services.get_nearest_trading_session(
+        db, instrument
+    )
+    atr = Decimal(str(latest_value.value)) if latest_value else Decimal('0.0')
+
+    return IndicatorGet(
+        length=length,
+        atr=round_with_quantum(atr, Decimal('0.0001')),
+        valid_until=trading_session.end,
+    )
+
+
+async def get_indicator_series(
+    db: DB,
+    ticker: str,
+    timeframe: Timeframe,
+    type: IndicatorType,
+    length: int,
+    interval: Interval,
+) -> IndicatorSeriesGet:
+    instrument = await instrument_services.get_saved_instrument(db, ticker)
+    bar_set = await bar_services.get_bar_set(db, instrument, timeframe)
+
+    # Bars saved on the way update the series through the ingest listener
+    await bar_services.get_historical_bars(db, bar_set, interval)
+
+    indicator_series = await _get_up_to_date_indicator_series(
+        db, bar_set, type, length
+    )
+    values = await indicator_crud.get_indicator_values(db, indicator_series, interval)
+
+    return IndicatorSeriesGet(
+        t=[int(value.timestamp.timestamp()) for value in values],
+        v=[value.value for value in values],
+    )
+
+
+async def update_indicators(db: DB, bar_set: BarSet, bars: list[Bar]) -> None:
+    update_task = asyncio.create_task(_update_bar_set_indicators(bar_set, bars))
+    _update_tasks[bar_set.id].add(update_task)
+    update_task.add_done_callback(lambda task: _on_update_done(task, bar_set))
+
+
+async def _update_bar_set_indicators(bar_set: BarSet, bars: list[Bar]) -> None:
+    async with Session() as db:
+        for indicator_series in await indicator_crud.get_bar_set_indicator_series(
+            db, bar_set
+        ):
+            await _update_indicator_series(db, bar_set, indicator_series, bars)
+
+
+def _on_update_done(update_task: asyncio.Task, bar_set: BarSet) -> None:
+    update_tasks = _update_tasks[bar_set.id]
+    update_tasks.discard(update_task)
+    if not update_tasks:
+        del _update_tasks[bar_set.id]
+
+    if not update_task.cancelled() and update_task.exception():
+        instrument = bar_set.instrument
+        logger.opt(exception=update_task.exception()).error(
+            f'Updating indicators failed. '
+            f'{instrument.exchange}:{instrument.symbol}, {bar_set.timeframe}'
+        )
+
+
+async def _get_up_to_date_indicator_series(
+    db: DB, bar_set: BarSet, type: IndicatorType, length: int
+) -> IndicatorSeries:
+    if length < 1:
+        raise ValueError(f'Indicator length must be positive, got {length}')
+
+    indicator_series = await indicator_crud.get_or_create_indicator_series(
+        db, bar_set, type, length
     )
 
-    now = datetime.now(pytz.utc)
-    if indicator.valid_until <= now:
-        end = pytz.utc.localize(datetime.combine(now.date(), time(0, 0)))
-        if await instrument_services.is_session_open(db, instrument):
-            end -= timedelta(days=1)
-        start = end - timedelta(days=30)  # TODO Better approach
-        interval = Interval(start=start, end=end)
+    update_tasks = _update_tasks.get(bar_set.id)
+    if update_tasks:
+        await asyncio.wait(update_tasks)
+
+    # New series, or one that missed ingests of another process
+    coverage = await bar_services.get_coverage(db, bar_set)
+    if indicator_series.bar_count != coverage.bar_count:
+        await _update_indicator_series(db, bar_set, indicator_series)
+
+    return indicator_series
+
 
-        bars = await bar_services.get_bars(db, bar_set, interval)
-        trading_session = await instrument_services.get_nearest_trading_session(
-            db, instrument
+async def _update_indicator_series(
+    db: DB,
+    bar_set: BarSet,
+    indicator_series: IndicatorSeries,
+    new_bars: list[Bar] | None = None,
+) -> None:
+    # Bar count of a series is the count of bars up to its latest timestamp
+    async with _series_locks[indicator_series.id]:
+        latest_ts = indicator_series.latest_timestamp
+        new_bars = sorted(
+            {bar.timestamp: bar for bar in new_bars or []}.values(),
+            key=lambda bar: bar.timestamp,
         )
 
-        indicator.atr = _calculate_atr(bars, length)
-        indicator.valid_until = trading_session.end
+        # Bars after the latest applied one are applied to the saved state
+        if new_bars and latest_ts and new_bars[0].timestamp > latest_ts:
+            state = copy.deepcopy(indicator_series.state)
+            values = _apply_bars(bar_set, indicator_series, state, new_bars)
+            await indicator_crud.save_indicator_values(
+                db,
+                indicator_series,
+                values,
+                state,
+                new_bars[-1].timestamp,
+                indicator_series.bar_count + len(new_bars),
+            )
 
-        await db.commit()
+        # Bars saved before it change values from the first of them on
+        elif new_bars and latest_ts:
+            values, state, latest_ts = await _recalculate_from(
+                db, bar_set, indicator_series, new_bars
+            )
+            bar_count = await bar_services.count_bars(db, bar_set, latest_ts)
+            await indicator_crud.save_indicator_values(
+                db, indicator_series, values, state, latest_ts, bar_count
+            )
 
-    return indicator
+        # New series, or one that missed ingests of another process
+        elif (
+            indicator_series.bar_count
+            != (await bar_services.get_coverage(db, bar_set)).bar_count
+        ):
+            await _catch_up(db, bar_set, indicator_series)
 
 
-def _calculate_atr(bars: list[Bar], length: int) -> Decimal:
-    atr = Decimal('0.0')
+async def _catch_up(
+    db: DB, bar_set: BarSet, indicator_series: IndicatorSeries
+) -> None:
+    state = copy.deepcopy(indicator_series.state)
+    latest_ts = indicator_series.latest_timestamp
+    bar_count = indicator_series.bar_count
 
-    if 0 < length < len(bars):
-        source_bars = sorted(bars, key=lambda bar: bar.timestamp, reverse=True)
-        true_ranges = []
-        for index, bar in enumerate(source_bars[: length - 1]):
-            true_range_option1 = bar.high - bar.low
-            true_range_option2 = abs(bar.high - source_bars[index + 1].close)
-            true_range_option3 = abs(bar.low - source_bars[index + 1].close)
-            true_range = max(true_range_option1, true_range_option2, true_range_option3)
-            true_ranges.append(true_range)
+    # Missed bars before the latest applied one need the series computed again,
+    # later ones are applied to the saved state
+    is_rebuilt = not latest_ts or (
+        await bar_services.count_bars(db, bar_set, latest_ts) != bar_count
+    )
+    if is_rebuilt:
+        state = {}
+        latest_ts = pytz.utc.localize(datetime.min)
+        bar_count = 0
+        is_rebuilt = True
 
-        atr = round_with_quantum(
-            Decimal(sum(true_ranges) / len(true_ranges)), Decimal('0.0001')
+    # Bars are read in chunks, and each one is saved along with the state
+    # after it, so memory use doesn't grow with history
+    while True:
+        bars = await bar_services.get_bars_after(
+            db, bar_set, latest_ts, settings.INDICATOR_CHUNK_SIZE
         )
+        if not bars and not is_rebuilt:
+            break
+
+        values = _apply_bars(bar_set, indicator_series, state, bars)
+        if bars:
+            latest_ts = bars[-1].timestamp
+            bar_count += len(bars)
+
+        await indicator_crud.save_indicator_values(
+            db,
+            indicator_series,
+            values,
+            state,
+            latest_ts if bar_count else None,
+            bar_count,
+            is_rebuilt,
+        )
+        is_rebuilt = False
+
+        if len(bars) < settings.INDICATOR_CHUNK_SIZE:
+            break
+
+
+async def _recalculate_from(
+    db: DB, bar_set: BarSet, indicator_series: IndicatorSeries, new_bars: list[Bar]
+) -> tuple[list[tuple], dict, datetime]:
+    # Values from the first new bar until warmup length bars after the last one
+    # are calculated again, later ones don't depend on new bars anymore
+    warmup_length = indicator_calc_logic.get_warmup_length(
+        indicator_series.type, indicator_series.length
+    )
+    interval = Interval(start=new_bars[0].timestamp, end=new_bars[-1].timestamp)
+    warmup_bars = await bar_services.get_bars_before(
+        db, bar_set, interval.start, warmup_length
+    )
+    bars = await bar_services.get_bars(db, bar_set, interval)
+    bars += await bar_services.get_bars_after(
+        db, bar_set, interval.end, warmup_length
+    )
+
+    state = {}
+    _apply_bars(bar_set, indicator_series, state, warmup_bars)
+    values = _apply_bars(bar_set, indicator_series, state, bars)
+
+    # State after the latest bar is only replaced if it was reached
+    latest_ts = indicator_series.latest_timestamp
+    if bars and bars[-1].timestamp >= latest_ts:
+        latest_ts = bars[-1].timestamp
+    else:
+        state = indicator_series.state
+
+    return values, state, latest_ts
+
+
+def _apply_bars(
+    bar_set: BarSet, indicator_series: IndicatorSeries, state: dict, bars: list[Bar]
+) -> list[tuple]:
+    tick_size = bar_set.instrument.tick_size
+    values = []
+
+    for bar in bars:
+        calc_bar = indicator_calc_logic.CalcBar(
+            high=float(decode_price(bar.high, tick_size)),
+            low=float(decode_price(bar.low, tick_size)),
+            close=float(decode_price(bar.close, tick_size)),
+            volume=bar.volume,
+        )
+        value = indicator_calc_logic.update_state(
+            indicator_series.type, indicator_series.length, state, calc_bar
+        )
+
+        if value is not None:
+            values.append((bar.timestamp, value))
+
+    return values
+
 
-    return atr
+bar_services.add_ingest_listener(update_indicators)
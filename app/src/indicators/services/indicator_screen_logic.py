@@ -0,0 +1,69 @@
+from indicators.schemas import ScreenParams, ScreenResult
+from config.db import DB
+from instruments import services as instrument_services
+from bars import services as bar_services
+from common.utils import decode_prices
+import numpy as np
+from . import indicator_calc_logic
+
+
+async def screen_indicators(db: DB, params: ScreenParams) -> list[ScreenResult]:
+    if params.tickers:
+        instruments = await instrument_services.get_saved_instruments(
+            db, params.tickers
+        )
+    else:
+        instruments = await instrument_services.filter_instruments(db)
+
+    bar_sets = await bar_services.get_bar_sets(db, instruments, params.timeframe)
+    bar_arrays = await bar_services.get_latest_bar_arrays(
+        db, bar_sets, params.lookback
+    )
+    bar_sets = [bar_set for bar_set in bar_sets if bar_set.id in bar_arrays]
+
+    if not bar_sets:
+        return []
+
+    # Bars of all bar sets are aligned to the end, so the latest bars share
+    # the last column
+    shape = (len(bar_sets), params.lookback)
+    highs, lows, closes, volumes = (np.full(shape, np.nan) for _ in range(4))
+    latest_timestamps = np.empty(len(bar_sets), dtype=np.int64)
+
+    for row, bar_set in enumerate(bar_sets):
+        timestamps, prices, bar_volumes = bar_arrays[bar_set.id]
+        prices = decode_prices(prices, bar_set.instrument.tick_size)
+        count = len(timestamps)
+
+        highs[row, -count:] = prices[:, 0]
+        lows[row, -count:] = prices[:, 1]
+        closes[row, -count:] = prices[:, 2]
+        volumes[row, -count:] = bar_volumes
+        latest_timestamps[row] = timestamps[-1]
+
+    values = indicator_calc_logic.calculate_latest(
+        params.type, params.length, highs, lows, closes, volumes
+    )
+
+    is_included = ~np.isnan(values)
+    if params.min_value is not None:
+        is_included &= values >= params.min_value
+    if params.max_value is not None:
+        is_included &= values <= params.max_value
+
+    rows = np.flatnonzero(is_included)
+    rows = rows[np.argsort(values[rows], kind='stable')]
+    if params.order == 'desc':
+        rows = rows[::-1]
+
+    results = []
+    for row in rows[: params.limit]:
+        instrument = bar_sets[row].instrument
+        result = ScreenResult(
+            ticker=f'{instrument.exchange.value}:{instrument.symbol}',
+            value=float(values[row]),
+            timestamp=int(latest_timestamps[row]),
+        )
+        results.append(result)
+
+    return results
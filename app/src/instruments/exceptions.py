@@ -0,0 +1,2 @@
+class InstrumentNotFoundError(Exception):
+    pass
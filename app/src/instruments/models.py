@@ -1,6 +1,6 @@
 from common.models import DBModel
 from sqlmodel import Field, Column, Enum, DateTime, ForeignKey, Relationship
-from sqlalchemy import orm, UniqueConstraint
+from sqlalchemy import orm, UniqueConstraint, Index
 from uuid import UUID
 from decimal import Decimal
 from datetime import datetime
@@ -23,9 +23,9 @@ class InstrumentType(enum.Enum):
 
 class Instrument(DBModel, table=True):
     symbol: str
-    trading_session: 'TradingSession' = Relationship(
+    trading_sessions: list['TradingSession'] = Relationship(
         sa_relationship=orm.RelationshipProperty(
-            'TradingSession', back_populates='instrument', uselist=False
+            'TradingSession', back_populates='instrument'
         )
     )
     ib_symbol: str
@@ -35,7 +35,28 @@ class Instrument(DBModel, table=True):
     tick_size: Decimal
     multiplier: Decimal
 
-    __table_args__ = (UniqueConstraint('symbol', 'exchange'),)
+    # Searches match symbol prefixes and trigrams of symbol and description,
+    # trigram operators come from the pg_trgm extension created by init_db
+    __table_args__ = (
+        UniqueConstraint('symbol', 'exchange'),
+        Index(
+            'ix_instrument_symbol_prefix',
+            'symbol',
+            postgresql_ops={'symbol': 'varchar_pattern_ops'},
+        ),
+        Index(
+            'ix_instrument_symbol_trgm',
+            'symbol',
+            postgresql_using='gin',
+            postgresql_ops={'symbol': 'gin_trgm_ops'},
+        ),
+        Index(
+            'ix_instrument_description_trgm',
+            'description',
+            postgresql_using='gin',
+            postgresql_ops={'description': 'gin_trgm_ops'},
+        ),
+    )
 
 
 class TradingSession(DBModel, table=True):
@@ -44,7 +65,7 @@ class TradingSession(DBModel, table=True):
             ForeignKey('instrument.id', ondelete='CASCADE'), nullable=False
         )
     )
-    instrument: Instrument = Relationship(back_populates='trading_session')
+    instrument: Instrument = Relationship(back_populates='trading_sessions')
     start: datetime = Field(
         sa_column=Column(DateTime(timezone=True), nullable=False),
         default_factory=lambda: pytz.utc.localize(datetime.min),
@@ -53,3 +74,5 @@ class TradingSession(DBModel, table=True):
         sa_column=Column(DateTime(timezone=True), nullable=False),
         default_factory=lambda: pytz.utc.localize(datetime.min),
     )
+
+    __table_args__ = (UniqueConstraint('instrument_id', 'start'),)
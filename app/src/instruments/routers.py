@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from config.db import DB, get_db
-from fastapi_pagination import Page, paginate
+from common.pagination import CountStrategy, KeysetPage
 from .models import InstrumentType
 from .schemas import InstrumentGet, InstrumentList, SessionGet
 from . import services
@@ -8,15 +8,21 @@ from . import services
 instrument_router = APIRouter(tags=['Instruments'])
 
 
-@instrument_router.get('', response_model=Page[InstrumentList])
+@instrument_router.get('', response_model=KeysetPage[InstrumentList])
 async def get_instrument_list(
     search: str | None = None,
     type: InstrumentType | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = None,
+    count: CountStrategy = CountStrategy.ESTIMATED,
     db: DB = Depends(get_db),
 ):
-    instruments = await services.filter_instruments(db, search, type)
-
-    return paginate(instruments)
+    try:
+        return await services.get_instrument_page(
+            db, search, type, limit, cursor, count
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
 
 
 @instrument_router.get('/{ticker}', response_model=InstrumentGet)
@@ -1,7 +1,21 @@
 from instruments.models import Instrument, Exchange, InstrumentType
+from common.cache import LRUCache
+from common import pagination
 from config.db import DB
+from config import settings
+from sqlalchemy import case, func, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
+from sqlalchemy.sql import Select
 from decimal import Decimal
+from uuid import uuid4
+
+# Detached instruments keyed by (symbol, exchange)
+_instrument_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.METADATA_CACHE_TTL,
+    name='instrument',
+)
 
 
 async def create_instrument(
@@ -14,36 +28,130 @@ async def create_instrument(
     tick_size: Decimal,
     multiplier: Decimal,
 ) -> Instrument:
-    instrument = Instrument(
-        symbol=symbol,
-        ib_symbol=ib_symbol,
-        exchange=exchange,
-        type=type,
-        description=description,
-        tick_size=tick_size,
-        multiplier=multiplier,
+    # Concurrent creates of the same instrument end up with a single row
+    await db.execute(
+        insert(Instrument)
+        .values(
+            id=uuid4(),
+            symbol=symbol,
+            ib_symbol=ib_symbol,
+            exchange=exchange,
+            type=type,
+            description=description,
+            tick_size=tick_size,
+            multiplier=multiplier,
+        )
+        .on_conflict_do_nothing(index_elements=['symbol', 'exchange'])
     )
-    db.add(instrument)
-
     await db.commit()
 
-    return instrument
+    return await get_instrument(db, symbol, exchange)
 
 
 async def get_instrument(db: DB, symbol: str, exchange: Exchange) -> Instrument:
-    query = select(Instrument).filter_by(symbol=symbol, exchange=exchange)
+    cache_key = (symbol, exchange)
+    instrument = _instrument_cache.get(cache_key)
+
+    if instrument is None:
+        query = select(Instrument).filter_by(symbol=symbol, exchange=exchange)
+        instrument = (await db.execute(query)).scalar_one()
+
+        db.expunge(instrument)
+        _instrument_cache.set(cache_key, instrument)
+
+    return instrument
+
+
+async def get_instruments(
+    db: DB, keys: list[tuple[str, Exchange]]
+) -> list[Instrument]:
+    instruments = {key: _instrument_cache.get(key) for key in keys}
+    missing_keys = [key for key, instrument in instruments.items() if not instrument]
+
+    # Instruments missing in cache are loaded with a single query
+    if missing_keys:
+        query = select(Instrument).where(
+            tuple_(Instrument.symbol, Instrument.exchange).in_(missing_keys)
+        )
+
+        for instrument in (await db.execute(query)).scalars().all():
+            key = (instrument.symbol, instrument.exchange)
+
+            db.expunge(instrument)
+            _instrument_cache.set(key, instrument)
+            instruments[key] = instrument
+
+    return [instrument for instrument in instruments.values() if instrument]
 
-    return (await db.execute(query)).scalar_one()
+
+async def search_instruments(db: DB, search: str, limit: int) -> list[Instrument]:
+    symbol = search.upper()
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    is_prefix = Instrument.symbol.like(f'{escaped.upper()}%', escape='\\')
+
+    # Exact symbol first, then symbol prefixes, then closest trigram matches
+    # of symbol or description
+    query = (
+        select(Instrument)
+        .where(
+            or_(
+                is_prefix,
+                Instrument.symbol.op('%')(symbol),
+                Instrument.description.ilike(f'%{escaped}%', escape='\\'),
+            )
+        )
+        .order_by(
+            case((Instrument.symbol == symbol, 0), else_=1),
+            case((is_prefix, 0), else_=1),
+            func.similarity(Instrument.symbol, symbol).desc(),
+            Instrument.symbol,
+        )
+        .limit(limit)
+    )
+    instruments = (await db.execute(query)).scalars().all()
+
+    for instrument in instruments:
+        db.expunge(instrument)
+
+    return instruments
 
 
 async def filter_instruments(
     db: DB, symbol: str | None = None, type: InstrumentType | None = None
 ) -> list[Instrument]:
+    query = _get_filter_query(symbol, type)
+
+    return (await db.execute(query)).scalars().all()
+
+
+async def get_instrument_page(
+    db: DB,
+    symbol: str | None,
+    type: InstrumentType | None,
+    limit: int,
+    cursor: str | None,
+    count: pagination.CountStrategy,
+) -> pagination.KeysetPage:
+    # Pages follow the (symbol, exchange) unique index
+    return await pagination.paginate(
+        db,
+        _get_filter_query(symbol, type),
+        [Instrument.symbol, Instrument.exchange],
+        limit,
+        cursor,
+        count,
+    )
+
+
+def _get_filter_query(symbol: str | None, type: InstrumentType | None) -> Select:
     query = select(Instrument)
 
+    # Substring matches are served by the symbol trigram index
     if symbol:
-        query = query.where(Instrument.symbol.contains(symbol))  # type: ignore
+        query = query.where(
+            Instrument.symbol.contains(symbol, autoescape=True)  # type: ignore
+        )
     if type:
         query = query.filter_by(type=type)
 
-    return (await db.execute(query)).scalars().all()
+    return query
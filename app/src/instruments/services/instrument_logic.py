@@ -1,8 +1,24 @@
 from instruments.models import Instrument, Exchange
-from config.db import DB
+from ib.schemas import InstrumentInfo
+from common.cache import LRUCache
+from config.db import DB, Session
+from config import settings
 from sqlalchemy.orm.exc import NoResultFound
 from ib.connector import ib_connector
-from . import instrument_crud
+from ib_insync import RequestError
+from datetime import time
+from loguru import logger
+import asyncio
+from . import instrument_crud, trading_session_crud
+
+# Search results keyed by upper cased search text
+_search_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.SEARCH_CACHE_TTL,
+    name='instrument_search',
+)
+# Lookups of searches at origin running in background, keyed by search text
+_search_tasks: dict[str, asyncio.Task] = {}
 
 
 async def get_saved_instrument(db: DB, ticker: str) -> Instrument:
@@ -17,39 +33,127 @@ async def get_saved_instrument(db: DB, ticker: str) -> Instrument:
 
     except NoResultFound:
         info = await ib_connector.get_instrument_info(symbol, exchange)
-        instrument = await instrument_crud.create_instrument(
-            db,
-            info.symbol,
-            info.ib_symbol,
-            info.exchange,
-            info.type,
-            info.description,
-            info.tick_size,
-            info.multiplier,
-        )
+        instrument = await _save_instrument_info(db, info)
 
     return instrument
 
 
-async def search_broker_instruments(symbol: str) -> list[Instrument]:
-    instruments = []
-    infos = await ib_connector.search_instrument_info(symbol)
+async def get_saved_instruments(db: DB, tickers: list[str]) -> list[Instrument]:
+    keys = []
+    for ticker in tickers:
+        try:
+            exchange, symbol = _split_ticker(ticker)
+
+        # Invalid tickers are unknown as well
+        except ValueError:
+            continue
+
+        keys.append((symbol, exchange))
+
+    # Unlike a single instrument, unknown ones are not looked up at origin
+    return await instrument_crud.get_instruments(db, keys)
+
+
+async def search_instruments(db: DB, search: str) -> list[Instrument]:
+    cache_key = search.upper()
+    instruments = _search_cache.get(cache_key)
 
-    for info in infos:
-        instrument = Instrument(
-            symbol=info.symbol,
-            ib_symbol=info.ib_symbol,
-            exchange=info.exchange,
-            type=info.type,
-            description=info.description,
-            tick_size=info.tick_size,
-            multiplier=info.multiplier,
+    if instruments is None:
+        instruments = await instrument_crud.search_instruments(
+            db, search, settings.SEARCH_RESULTS_LIMIT
         )
-        instruments.append(instrument)
+
+        # IB is only asked about symbols never seen, found ones are saved so
+        # the next searches are answered locally. Local matches are returned
+        # right away, while IB is asked in background
+        if cache_key and cache_key not in (
+            instrument.symbol for instrument in instruments
+        ):
+            if instruments:
+                _start_search_task(cache_key, instruments)
+
+            else:
+                try:
+                    instruments = await asyncio.wait_for(
+                        _search_origin(db, cache_key, instruments),
+                        settings.SEARCH_ORIGIN_TIMEOUT,
+                    )
+
+                except (OSError, asyncio.TimeoutError, RequestError) as error:
+                    logger.warning(f'Instrument search failed. {cache_key}, {error!r}')
+                    return instruments
+
+        _search_cache.set(cache_key, instruments)
 
     return instruments
 
 
+async def _search_origin(
+    db: DB, search: str, instruments: list[Instrument]
+) -> list[Instrument]:
+    known_keys = {
+        (instrument.symbol, instrument.exchange) for instrument in instruments
+    }
+    new_instruments = [
+        await _save_instrument_info(db, info)
+        for info in await ib_connector.search_instrument_info(search)
+        if (info.symbol, info.exchange) not in known_keys
+    ]
+
+    return new_instruments + instruments
+
+
+def _start_search_task(search: str, instruments: list[Instrument]) -> None:
+    if search not in _search_tasks:
+        _search_tasks[search] = asyncio.create_task(
+            _run_search_task(search, instruments)
+        )
+
+
+async def _run_search_task(search: str, instruments: list[Instrument]) -> None:
+    try:
+        async with Session() as db:
+            _search_cache.set(search, await _search_origin(db, search, instruments))
+
+    except Exception as error:
+        logger.warning(f'Instrument search failed. {search}, {error!r}')
+
+    finally:
+        del _search_tasks[search]
+
+
+def get_exchange_schedule(exchange: Exchange) -> tuple[str, time, time]:
+    if exchange in (Exchange.NASDAQ, Exchange.NYSE):
+        tz_id = 'America/New_York'
+        session_open, session_close = time(9, 30), time(16, 0)
+    elif exchange == Exchange.NYMEX:
+        tz_id = 'America/New_York'
+        session_open, session_close = time(18, 0), time(17, 0)
+    elif exchange in (Exchange.GLOBEX, Exchange.ECBOT):
+        tz_id = 'America/Chicago'
+        session_open, session_close = time(17, 0), time(16, 0)
+    else:
+        raise ValueError(f'Cannot get schedule for exchange {exchange}')
+
+    return tz_id, session_open, session_close
+
+
+async def _save_instrument_info(db: DB, info: InstrumentInfo) -> Instrument:
+    instrument = await instrument_crud.create_instrument(
+        db,
+        info.symbol,
+        info.ib_symbol,
+        info.exchange,
+        info.type,
+        info.description,
+        info.tick_size,
+        info.multiplier,
+    )
+    await trading_session_crud.save_trading_sessions(db, instrument, info.sessions)
+
+    return instrument
+
+
 def _split_ticker(ticker: str) -> tuple[Exchange, str]:
     exchange, symbol = tuple(ticker.split(':'))
     exchange = Exchange(exchange)
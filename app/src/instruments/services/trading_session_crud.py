@@ -1,20 +1,65 @@
 from instruments.models import TradingSession, Instrument
+from common.schemas import Interval
+from common.cache import LRUCache
 from config.db import DB
+from config import settings
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
-from sqlalchemy.orm.exc import NoResultFound
+from uuid import uuid4
 
+# Detached trading sessions sorted by start, keyed by instrument id
+_trading_session_cache = LRUCache(
+    max_size=settings.METADATA_CACHE_MAX_SIZE,
+    ttl=settings.METADATA_CACHE_TTL,
+    name='trading_session',
+)
 
-async def get_or_create_trading_session(
-    db: DB, instrument: Instrument
-) -> TradingSession:
-    try:
-        query = select(TradingSession).filter_by(instrument=instrument)
-        trading_session = (await db.execute(query)).scalar_one()
 
-    except NoResultFound:
-        trading_session = TradingSession(instrument_id=instrument.id)
-        db.add(trading_session)
+async def get_trading_sessions(db: DB, instrument: Instrument) -> list[TradingSession]:
+    trading_sessions = _trading_session_cache.get(instrument.id)
 
+    if trading_sessions is None:
+        query = (
+            select(TradingSession)
+            .filter_by(instrument_id=instrument.id)
+            .order_by(TradingSession.start)
+        )
+        trading_sessions = (await db.execute(query)).scalars().all()
+
+        for trading_session in trading_sessions:
+            db.expunge(trading_session)
+        _trading_session_cache.set(instrument.id, trading_sessions)
+
+    return trading_sessions
+
+
+async def save_trading_sessions(
+    db: DB, instrument: Instrument, sessions: list[Interval]
+) -> None:
+    if sessions:
+        # Calendar is replaced from the first listed session on,
+        # so changed schedules and announced holidays are picked up
+        await db.execute(
+            delete(TradingSession)
+            .where(TradingSession.instrument_id == instrument.id)
+            .where(TradingSession.start >= sessions[0].start)
+        )
+        await db.execute(
+            insert(TradingSession)
+            .values(
+                [
+                    {
+                        'id': uuid4(),
+                        'instrument_id': instrument.id,
+                        'start': session.start,
+                        'end': session.end,
+                    }
+                    for session in sessions
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=['instrument_id', 'start'])
+        )
         await db.commit()
 
-    return trading_session
+    _trading_session_cache.delete(instrument.id)
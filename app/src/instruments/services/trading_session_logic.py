@@ -1,25 +1,33 @@
 from instruments.models import Instrument, TradingSession
 from common.schemas import Interval
-from config.db import DB
+from common.interval_index import IntervalIndex
+from config.db import DB, Session
+from config import settings
 from ib.connector import ib_connector
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from loguru import logger
+import asyncio
 import pytz
-from . import trading_session_crud
+from . import instrument_crud, trading_session_crud
+
+# Longer gaps between known sessions are periods the calendar wasn't refreshed
+# for, not holidays
+_MAX_CLOSED_PERIOD = timedelta(days=5)
+
+_calendar_refresher: asyncio.Task | None = None
 
 
 async def get_nearest_trading_session(db: DB, instrument: Instrument) -> TradingSession:
-    trading_session = await trading_session_crud.get_or_create_trading_session(
-        db, instrument
+    trading_sessions = await _get_up_to_date_trading_sessions(db, instrument)
+    index = bisect_right(
+        trading_sessions, datetime.now(pytz.utc), key=lambda session: session.end
     )
 
-    if not is_session_up_to_date(trading_session):
-        info = await ib_connector.get_instrument_info(
-            instrument.symbol, instrument.exchange
-        )
-        trading_session.start = info.nearest_session.start
-        trading_session.end = info.nearest_session.end
-
-        await db.commit()
+    if index < len(trading_sessions):
+        trading_session = trading_sessions[index]
+    else:
+        trading_session = TradingSession(instrument_id=instrument.id)
 
     return trading_session
 
@@ -45,5 +53,72 @@ async def is_session_open(db: DB, instrument: Instrument) -> bool:
     return trading_session.start <= datetime.now(pytz.utc) < trading_session.end
 
 
-def is_session_up_to_date(session: TradingSession) -> bool:
-    return session.end > datetime.now(pytz.utc)
+async def get_trading_calendar(db: DB, instrument: Instrument) -> IntervalIndex:
+    trading_sessions = await _get_up_to_date_trading_sessions(db, instrument)
+    min_dt = pytz.utc.localize(datetime.min)
+    max_dt = pytz.utc.localize(datetime.max)
+
+    # Market is assumed to be open wherever the calendar is unknown
+    if not trading_sessions:
+        return IntervalIndex([Interval(start=min_dt, end=max_dt)])
+
+    trading_calendar = IntervalIndex(trading_sessions)
+    trading_calendar.add(min_dt, trading_sessions[0].start)
+    trading_calendar.add(trading_sessions[-1].end, max_dt)
+
+    for session, next_session in zip(trading_sessions, trading_sessions[1:]):
+        if next_session.start - session.end > _MAX_CLOSED_PERIOD:
+            trading_calendar.add(session.end, next_session.start)
+
+    return trading_calendar
+
+
+async def refresh_trading_sessions(db: DB, instrument: Instrument) -> None:
+    info = await ib_connector.get_instrument_info(
+        instrument.symbol, instrument.exchange
+    )
+
+    await trading_session_crud.save_trading_sessions(db, instrument, info.sessions)
+
+
+def start_calendar_refresher() -> None:
+    global _calendar_refresher
+
+    if not _calendar_refresher or _calendar_refresher.done():
+        _calendar_refresher = asyncio.create_task(_run_calendar_refresher())
+
+
+def stop_calendar_refresher() -> None:
+    if _calendar_refresher:
+        _calendar_refresher.cancel()
+
+
+async def _get_up_to_date_trading_sessions(
+    db: DB, instrument: Instrument
+) -> list[TradingSession]:
+    trading_sessions = await trading_session_crud.get_trading_sessions(db, instrument)
+
+    # Background refresh hasn't reached the instrument yet
+    if not trading_sessions or trading_sessions[-1].end <= datetime.now(pytz.utc):
+        await refresh_trading_sessions(db, instrument)
+        trading_sessions = await trading_session_crud.get_trading_sessions(
+            db, instrument
+        )
+
+    return trading_sessions
+
+
+async def _run_calendar_refresher() -> None:
+    while True:
+        async with Session() as db:
+            for instrument in await instrument_crud.filter_instruments(db):
+                try:
+                    await refresh_trading_sessions(db, instrument)
+
+                except Exception as error:
+                    logger.error(
+                        f'Trading calendar refresh failed. '
+                        f'{instrument.exchange}:{instrument.symbol}, {error}'
+                    )
+
+        await asyncio.sleep(settings.TRADING_CALENDAR_REFRESH_INTERVAL)
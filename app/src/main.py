@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 from config import settings, db
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_pagination import add_pagination
+from prometheus_client import make_asgi_app
 from routers import api_router
+from bars import services as bar_services
+from instruments import services as instrument_services
+from ib.connector import ib_connector
 import debugpy
 
 
@@ -17,13 +20,25 @@ app.add_middleware(
 )
 
 app.include_router(api_router, prefix=settings.API_URL_PREFIX)
-
-add_pagination(app)
+app.mount('/metrics', make_asgi_app())
 
 
 @app.on_event('startup')
 async def startup():
     await db.init_db()
+    db.start_bar_migrator()
+
+    ib_connector.start()
+    instrument_services.start_calendar_refresher()
+    bar_services.start_prefetcher()
 
     if settings.DEBUG:
         debugpy.listen(('0.0.0.0', 8888))
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    bar_services.stop_prefetcher()
+    db.stop_bar_migrator()
+    instrument_services.stop_calendar_refresher()
+    ib_connector.stop()
@@ -0,0 +1,5 @@
+import os
+
+# Settings are read on import, tests only need the required ones
+os.environ.setdefault('APP_DEBUG', '0')
+os.environ.setdefault('APP_SECRET_KEY', 'test')
@@ -0,0 +1,77 @@
+from common import cache
+from common.cache import LRUCache
+
+
+def test_get_and_set():
+    lru = LRUCache(max_size=10, ttl=60)
+    lru.set('a', 1)
+
+    assert lru.get('a') == 1
+    assert lru.get('b', 'default') == 'default'
+
+
+def test_entries_expire(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now)
+    lru = LRUCache(max_size=10, ttl=60)
+    lru.set('a', 1)
+
+    now += 59
+    assert lru.get('a') == 1
+
+    now += 1
+    assert lru.get('a') is None
+    assert len(lru) == 0
+
+
+def test_least_recently_used_is_evicted():
+    lru = LRUCache(max_size=2, ttl=60)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+
+    assert lru.get('a') == 1
+    assert lru.get('b') is None
+    assert lru.get('c') == 3
+
+
+def test_size_of_values():
+    lru = LRUCache(max_size=5, ttl=60, size_of=len)
+    lru.set('a', 'xx')
+    lru.set('b', 'xxx')
+    assert lru.size == 5
+
+    lru.set('c', 'x')
+    assert lru.get('a') is None
+    assert lru.size == 4
+
+    lru.set('b', 'x')
+    assert lru.size == 2
+
+
+def test_value_larger_than_cache_is_not_stored():
+    lru = LRUCache(max_size=2, ttl=60, size_of=len)
+    lru.set('a', 'x')
+    lru.set('b', 'xxx')
+
+    assert lru.get('a') == 'x'
+    assert lru.get('b') is None
+    assert lru.size == 1
+
+
+def test_delete():
+    lru = LRUCache(max_size=10, ttl=60)
+    lru.set(('bar_set', 1), 1)
+    lru.set(('bar_set', 2), 2)
+    lru.set(('other', 1), 3)
+
+    lru.delete(('other', 1))
+    assert lru.delete_where(lambda key: key[0] == 'bar_set') == 2
+    assert len(lru) == 0
+    assert lru.size == 0
+
+    lru.set('a', 1)
+    lru.clear()
+    assert lru.get('a') is None
+    assert lru.size == 0
@@ -0,0 +1,92 @@
+import math
+
+import numpy as np
+import pytest
+
+from indicators.models import IndicatorType
+from indicators.services.indicator_calc_logic import (
+    CalcBar,
+    calculate_latest,
+    get_warmup_length,
+    update_state,
+)
+
+
+def _random_bars(count: int, seed: int) -> list[CalcBar]:
+    random = np.random.default_rng(seed)
+    closes = 100 + np.cumsum(random.normal(size=count))
+
+    return [
+        CalcBar(
+            high=float(close + random.uniform(0, 2)),
+            low=float(close - random.uniform(0, 2)),
+            close=float(close),
+            volume=int(random.integers(0, 1000)),
+        )
+        for close in closes
+    ]
+
+
+def _calculate_incrementally(
+    type: IndicatorType, length: int, bars: list[CalcBar]
+) -> float | None:
+    state = {}
+    value = None
+
+    for bar in bars:
+        value = update_state(type, length, state, bar)
+
+    return value
+
+
+def _pad(rows: list[list[CalcBar]]) -> list[np.ndarray]:
+    width = max(len(bars) for bars in rows)
+    columns = []
+
+    for field in CalcBar._fields:
+        values = np.full((len(rows), width), np.nan)
+        for index, bars in enumerate(rows):
+            if bars:
+                values[index, -len(bars) :] = [getattr(bar, field) for bar in bars]
+        columns.append(values)
+
+    return columns
+
+
+def test_simple_averages():
+    bars = [
+        CalcBar(high=close, low=close, close=close, volume=1) for close in (1, 2, 3)
+    ]
+
+    assert _calculate_incrementally(IndicatorType.SMA, 2, bars) == 2.5
+    # Seeded with SMA of 1 and 2, then 1.5 + 2 / 3 * (3 - 1.5)
+    assert _calculate_incrementally(IndicatorType.EMA, 2, bars) == 2.5
+    assert _calculate_incrementally(IndicatorType.SMA, 4, bars) is None
+
+
+@pytest.mark.parametrize('type', list(IndicatorType))
+@pytest.mark.parametrize('length', [1, 3, 14])
+def test_latest_matches_incremental(type: IndicatorType, length: int):
+    rows = [_random_bars(count, seed) for seed, count in enumerate((60, 20, 5, 0))]
+
+    latest = calculate_latest(type, length, *_pad(rows))
+
+    for value, bars in zip(latest, rows):
+        expected = _calculate_incrementally(type, length, bars)
+        if expected is None:
+            assert math.isnan(value)
+        else:
+            assert value == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('type', [IndicatorType.SMA, IndicatorType.VWAP])
+def test_latest_is_nan_without_enough_columns(type: IndicatorType):
+    latest = calculate_latest(type, 10, *_pad([_random_bars(5, 0)]))
+
+    assert np.isnan(latest).all()
+
+
+def test_warmup_length():
+    assert get_warmup_length(IndicatorType.SMA, 20) == 20
+    assert get_warmup_length(IndicatorType.VWAP, 20) == 20
+    assert get_warmup_length(IndicatorType.EMA, 20) == 201
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from common.interval_index import IntervalIndex
+from common.schemas import Interval
+
+_START = datetime(2024, 1, 1, tzinfo=pytz.utc)
+_STEP = timedelta(minutes=1)
+
+
+def _interval(start: int, end: int) -> Interval:
+    return Interval(start=_START + start * _STEP, end=_START + end * _STEP)
+
+
+def test_add_merges_overlapping_intervals():
+    index = IntervalIndex([_interval(0, 5), _interval(10, 15)])
+
+    merged = index.add(_START + 4 * _STEP, _START + 11 * _STEP)
+
+    assert merged == _interval(0, 15)
+    assert list(index) == [_interval(0, 15)]
+
+
+def test_add_keeps_disjoint_intervals_sorted():
+    index = IntervalIndex([_interval(10, 15), _interval(0, 5), _interval(20, 25)])
+
+    assert list(index) == [_interval(0, 5), _interval(10, 15), _interval(20, 25)]
+
+
+def test_neighbours_within_gap_are_merged():
+    index = IntervalIndex([_interval(0, 5), _interval(6, 10)], gap=_STEP)
+
+    assert list(index) == [_interval(0, 10)]
+
+
+def test_neighbours_beyond_gap_are_kept_apart():
+    index = IntervalIndex([_interval(0, 5), _interval(7, 10)], gap=_STEP)
+
+    assert len(index) == 2
+
+
+def test_covers():
+    index = IntervalIndex([_interval(0, 10)])
+
+    assert index.covers(_interval(2, 8))
+    assert index.covers(_interval(0, 10))
+    assert not index.covers(_interval(5, 11))
+    assert not IntervalIndex().covers(_interval(0, 1))
+
+
+def test_overlapping():
+    index = IntervalIndex([_interval(0, 5), _interval(10, 15), _interval(20, 25)])
+
+    assert index.overlapping(_interval(4, 12)) == [_interval(0, 5), _interval(10, 15)]
+    assert index.overlapping(_interval(6, 9)) == []
+
+
+def test_missing():
+    index = IntervalIndex([_interval(2, 4), _interval(6, 8)])
+
+    assert index.missing(_interval(0, 10)) == [
+        _interval(0, 2),
+        _interval(4, 6),
+        _interval(8, 10),
+    ]
+    assert index.missing(_interval(2, 4)) == []
+    assert IntervalIndex().missing(_interval(0, 1)) == [_interval(0, 1)]
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytz
+
+from bars.models import Bar, Timeframe
+from bars.services.bar_resample_logic import resample_bars
+from common.schemas import Interval
+from common.utils import decode_price
+from instruments.models import Exchange
+
+_TICK_SIZE = Decimal('0.01')
+# 9:30 in New York
+_SESSION_START = datetime(2024, 1, 2, 14, 30, tzinfo=pytz.utc)
+
+
+def _bar_set(timeframe: Timeframe, exchange: Exchange = Exchange.NASDAQ):
+    instrument = SimpleNamespace(tick_size=_TICK_SIZE, exchange=exchange)
+
+    return SimpleNamespace(id=None, instrument=instrument, timeframe=timeframe)
+
+
+def _bars(start: datetime, step: timedelta, count: int) -> list[Bar]:
+    return [
+        Bar(
+            open=Decimal(100 + index),
+            high=Decimal(110 + index),
+            low=Decimal(90 - index),
+            close=Decimal(105 + index),
+            volume=index + 1,
+            timestamp=start + index * step,
+        )
+        for index in range(count)
+    ]
+
+
+def _prices(bar: Bar) -> tuple:
+    return tuple(
+        decode_price(price, _TICK_SIZE)
+        for price in (bar.open, bar.high, bar.low, bar.close)
+    )
+
+
+def test_minute_bars_are_aggregated():
+    source_bars = _bars(_SESSION_START, timedelta(minutes=1), 10)
+    interval = Interval(start=_SESSION_START, end=source_bars[-1].timestamp)
+
+    bars, derived_interval = resample_bars(
+        _bar_set(Timeframe.M5), Timeframe.M1, source_bars, interval
+    )
+
+    assert [bar.timestamp for bar in bars] == [
+        _SESSION_START,
+        _SESSION_START + timedelta(minutes=5),
+    ]
+    assert _prices(bars[0]) == (100, 114, 86, 109)
+    assert _prices(bars[1]) == (105, 119, 81, 114)
+    assert [bar.volume for bar in bars] == [15, 40]
+    assert derived_interval == Interval(
+        start=_SESSION_START, end=_SESSION_START + timedelta(minutes=5)
+    )
+
+
+def test_incomplete_buckets_are_excluded():
+    source_bars = _bars(_SESSION_START + timedelta(minutes=1), timedelta(minutes=1), 8)
+    interval = Interval(start=source_bars[0].timestamp, end=source_bars[-1].timestamp)
+
+    bars, derived_interval = resample_bars(
+        _bar_set(Timeframe.M5), Timeframe.M1, source_bars, interval
+    )
+    all_bars, _ = resample_bars(
+        _bar_set(Timeframe.M5),
+        Timeframe.M1,
+        source_bars,
+        interval,
+        is_incomplete_included=True,
+    )
+
+    assert bars == []
+    assert derived_interval is None
+    assert len(all_bars) == 2
+
+
+def test_hourly_buckets_start_with_session():
+    source_bars = _bars(_SESSION_START, timedelta(minutes=30), 3)
+    interval = Interval(start=_SESSION_START, end=source_bars[-1].timestamp)
+
+    bars, _ = resample_bars(
+        _bar_set(Timeframe.M60), Timeframe.M30, source_bars, interval
+    )
+
+    # 9:30-10:00 bucket is cut by session open, 10:00-11:00 is a whole hour
+    assert [bar.timestamp for bar in bars] == [
+        _SESSION_START,
+        _SESSION_START + timedelta(minutes=30),
+    ]
+    assert [bar.volume for bar in bars] == [1, 5]
+
+
+def test_intraday_bars_are_labeled_with_trade_date():
+    source_bars = _bars(_SESSION_START, timedelta(hours=1), 7)
+    interval = Interval(start=_SESSION_START, end=source_bars[-1].timestamp)
+
+    bars, derived_interval = resample_bars(
+        _bar_set(Timeframe.DAY), Timeframe.M60, source_bars, interval
+    )
+
+    trade_date = datetime(2024, 1, 2, tzinfo=pytz.utc)
+    assert [bar.timestamp for bar in bars] == [trade_date]
+    assert bars[0].volume == 28
+    assert derived_interval == Interval(start=trade_date, end=trade_date)
+
+
+def test_month_is_incomplete_until_it_ends():
+    start = datetime(2024, 1, 1, tzinfo=pytz.utc)
+    source_bars = _bars(start, timedelta(days=1), 31)
+    # Interval of the last daily bar ends once that day is covered, which is
+    # before January ends
+    interval = Interval(start=start, end=datetime(2024, 1, 31, 15, tzinfo=pytz.utc))
+
+    bars, derived_interval = resample_bars(
+        _bar_set(Timeframe.MONTH), Timeframe.DAY, source_bars, interval
+    )
+
+    assert bars == []
+    assert derived_interval is None
+
+
+def test_month_is_complete_once_it_ends():
+    start = datetime(2024, 1, 1, tzinfo=pytz.utc)
+    source_bars = _bars(start, timedelta(days=1), 31)
+    interval = Interval(start=start, end=datetime(2024, 2, 1, tzinfo=pytz.utc))
+
+    bars, derived_interval = resample_bars(
+        _bar_set(Timeframe.MONTH), Timeframe.DAY, source_bars, interval
+    )
+
+    assert [bar.timestamp for bar in bars] == [start]
+    assert _prices(bars[0]) == (100, 140, 60, 135)
+    assert bars[0].volume == sum(range(1, 32))
+    assert derived_interval == Interval(start=start, end=start)
+
+
+def test_weeks_start_on_monday():
+    # Wednesday to next Friday
+    start = datetime(2024, 1, 3, tzinfo=pytz.utc)
+    source_bars = _bars(start, timedelta(days=1), 10)
+    interval = Interval(start=start, end=datetime(2024, 1, 15, tzinfo=pytz.utc))
+
+    bars, derived_interval = resample_bars(
+        _bar_set(Timeframe.WEEK), Timeframe.DAY, source_bars, interval
+    )
+    all_bars, _ = resample_bars(
+        _bar_set(Timeframe.WEEK),
+        Timeframe.DAY,
+        source_bars,
+        interval,
+        is_incomplete_included=True,
+    )
+
+    monday = datetime(2024, 1, 8, tzinfo=pytz.utc)
+    assert [bar.timestamp for bar in bars] == [monday]
+    assert derived_interval == Interval(start=monday, end=monday)
+    assert [bar.timestamp for bar in all_bars] == [monday - timedelta(days=7), monday]
@@ -0,0 +1,180 @@
+import asyncio
+import time
+
+from ib.scheduler import HistoricalDataScheduler, Priority
+
+
+def _recorder(starts: list, name: str, duration: float = 0):
+    async def func():
+        starts.append((name, time.monotonic()))
+        await asyncio.sleep(duration)
+        return name
+
+    return func
+
+
+def test_returns_result_and_error():
+    async def run():
+        scheduler = HistoricalDataScheduler(max_concurrency=2)
+
+        async def fail():
+            raise ValueError('failed')
+
+        result = await scheduler.submit(_recorder([], 'a'), 'a', 'contract')
+        error = await asyncio.gather(
+            scheduler.submit(fail, 'b', 'contract'), return_exceptions=True
+        )
+
+        return result, error[0]
+
+    result, error = asyncio.run(run())
+
+    assert result == 'a'
+    assert isinstance(error, ValueError)
+
+
+def test_concurrency_is_limited():
+    async def run():
+        scheduler = HistoricalDataScheduler(max_concurrency=2)
+        running = peak = 0
+
+        async def func():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(scheduler.submit(func, key, key) for key in range(5)))
+
+        return peak, scheduler.pending_count
+
+    assert asyncio.run(run()) == (2, 0)
+
+
+def test_identical_requests_are_paced():
+    async def run():
+        scheduler = HistoricalDataScheduler(max_concurrency=2, identical_interval=0.1)
+        starts = []
+
+        await asyncio.gather(
+            scheduler.submit(_recorder(starts, 'first'), 'key', 'contract'),
+            scheduler.submit(_recorder(starts, 'second'), 'key', 'contract'),
+        )
+
+        return starts
+
+    (_, first), (_, second) = asyncio.run(run())
+
+    assert second - first >= 0.09
+
+
+def test_contract_requests_are_paced():
+    async def run():
+        scheduler = HistoricalDataScheduler(
+            max_concurrency=5, contract_limit=2, contract_period=0.1
+        )
+        starts = []
+
+        await asyncio.gather(
+            *(
+                scheduler.submit(_recorder(starts, key), key, 'contract')
+                for key in range(3)
+            )
+        )
+
+        return [ts for _, ts in starts]
+
+    starts = asyncio.run(run())
+
+    assert starts[1] - starts[0] < 0.05
+    assert starts[2] - starts[0] >= 0.09
+
+
+def test_global_pacing_applies_to_paced_requests_only():
+    async def run():
+        scheduler = HistoricalDataScheduler(
+            max_concurrency=5, global_limit=1, global_period=0.1
+        )
+        starts = []
+
+        await asyncio.gather(
+            scheduler.submit(
+                _recorder(starts, 'paced'), 'a', 'a', is_globally_paced=True
+            ),
+            scheduler.submit(_recorder(starts, 'unpaced'), 'b', 'b'),
+            scheduler.submit(
+                _recorder(starts, 'delayed'), 'c', 'c', is_globally_paced=True
+            ),
+        )
+
+        return dict(starts)
+
+    starts = asyncio.run(run())
+
+    assert starts['unpaced'] - starts['paced'] < 0.05
+    assert starts['delayed'] - starts['paced'] >= 0.09
+
+
+def test_interactive_requests_go_first():
+    async def run():
+        scheduler = HistoricalDataScheduler(max_concurrency=1)
+        starts = []
+
+        blocker = asyncio.ensure_future(
+            scheduler.submit(_recorder(starts, 'blocker', 0.01), 'x', 'x')
+        )
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            blocker,
+            scheduler.submit(
+                _recorder(starts, 'background'), 'a', 'a', Priority.BACKGROUND
+            ),
+            scheduler.submit(_recorder(starts, 'interactive'), 'b', 'b'),
+        )
+
+        return [name for name, _ in starts]
+
+    assert asyncio.run(run()) == ['blocker', 'interactive', 'background']
+
+
+def test_background_share_leaves_capacity_to_interactive():
+    async def run():
+        scheduler = HistoricalDataScheduler(max_concurrency=2, background_share=0.5)
+        running = peak = 0
+
+        async def func():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(
+            *(scheduler.submit(func, key, key, Priority.BACKGROUND) for key in range(3))
+        )
+
+        return peak
+
+    assert asyncio.run(run()) == 1
+
+
+def test_cancelled_request_is_dropped():
+    async def run():
+        scheduler = HistoricalDataScheduler(max_concurrency=1)
+        starts = []
+
+        blocker = asyncio.ensure_future(
+            scheduler.submit(_recorder(starts, 'blocker', 0.01), 'x', 'x')
+        )
+        queued = asyncio.ensure_future(
+            scheduler.submit(_recorder(starts, 'queued'), 'a', 'a')
+        )
+        await asyncio.sleep(0)
+        queued.cancel()
+        await blocker
+        await asyncio.sleep(0.01)
+
+        return [name for name, _ in starts], scheduler.pending_count
+
+    assert asyncio.run(run()) == (['blocker'], 0)
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from common.single_flight import SingleFlight
+
+
+def test_same_key_shares_one_call():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(
+            flight.do('a', fetch), flight.do('a', fetch), flight.do('b', fetch)
+        )
+
+        return results, calls, flight.keys()
+
+    results, calls, keys = asyncio.run(run())
+
+    assert calls == 2
+    assert results[0] == results[1]
+    assert keys == []
+
+
+def test_keys_lists_calls_in_flight():
+    async def run():
+        flight = SingleFlight()
+        waiter = flight.do('a', lambda: asyncio.sleep(0.01))
+        keys = flight.keys()
+        await waiter
+
+        return keys, flight.keys()
+
+    in_flight, finished = asyncio.run(run())
+
+    assert in_flight == ['a']
+    assert finished == []
+
+
+def test_failure_is_shared_and_forgotten():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0)
+            raise ValueError(calls)
+
+        results = await asyncio.gather(
+            flight.do('a', fetch), flight.do('a', fetch), return_exceptions=True
+        )
+        retried = await asyncio.gather(flight.do('a', fetch), return_exceptions=True)
+
+        return results + retried
+
+    errors = asyncio.run(run())
+
+    assert [error.args for error in errors] == [(1,), (1,), (2,)]
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    async def run():
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return 'done'
+
+        cancelled = asyncio.ensure_future(flight.do('a', fetch))
+        remaining = asyncio.ensure_future(flight.do('a', fetch))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        return await remaining, cancelled.cancelled()
+
+    assert asyncio.run(run()) == ('done', True)
+
+
+def test_call_is_cancelled_without_waiters():
+    async def run():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def fetch():
+            started.set()
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiter = asyncio.ensure_future(flight.do('a', fetch))
+        await started.wait()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+
+        return flight.keys()
+
+    assert asyncio.run(run()) == []